@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Compare the mongodb plugin's storage modes on workloads like the plugins'.
+
+    $ python scripts/benchmark_mongodb.py [-n 2000] [--uri mongodb://localhost:27017/csbot_benchmark]
+
+Always runs against ``local`` (a temporary SQLite file) and ``mock``
+(mongomock); also against a MongoDB server if ``--uri`` is given, in which case
+the benchmark collections in that database are dropped first.
+"""
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+import mongomock
+import pymongo
+
+from csbot.localdb import LocalClient
+
+
+def last_workload(coll, n):
+    """Upsert the last message for each nick/channel/type, then look up the
+    most recent, like the ``last`` plugin.
+    """
+    coll.create_indexes([pymongo.IndexModel([('nick', pymongo.ASCENDING), ('channel', pymongo.ASCENDING),
+                                             ('type', pymongo.ASCENDING), ('when', pymongo.DESCENDING)])])
+    nicks = [f'nick{i}' for i in range(200)]
+    channels = ['#a', '#b', '#c']
+    timings = {'replace_one': [], 'find_one': []}
+    for i in range(n):
+        query = {'nick': random.choice(nicks), 'channel': random.choice(channels),
+                 'type': random.choice(['message', 'action'])}
+        start = time.perf_counter()
+        coll.replace_one(query, dict(query, when=datetime.datetime.now(), message=f'message {i}'), upsert=True)
+        timings['replace_one'].append(time.perf_counter() - start)
+    for i in range(n):
+        start = time.perf_counter()
+        coll.find_one({'nick': random.choice(nicks), 'channel': random.choice(channels)},
+                      sort=[('when', pymongo.DESCENDING)])
+        timings['find_one'].append(time.perf_counter() - start)
+    return timings
+
+
+def cron_workload(coll, n):
+    """Schedule events and take the next one due, like the ``cron`` plugin."""
+    coll.create_indexes([pymongo.IndexModel([('when', pymongo.ASCENDING)])])
+    now = datetime.datetime.now()
+    timings = {'insert_one': [], 'find_one': [], 'delete_one': []}
+    for i in range(n):
+        start = time.perf_counter()
+        coll.insert_one({'owner': 'bench', 'name': f'event{i}', 'when': now + datetime.timedelta(seconds=i)})
+        timings['insert_one'].append(time.perf_counter() - start)
+    for i in range(n):
+        start = time.perf_counter()
+        doc = coll.find_one({}, sort=[('when', pymongo.ASCENDING)])
+        timings['find_one'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        coll.delete_one({'_id': doc['_id']})
+        timings['delete_one'].append(time.perf_counter() - start)
+    return timings
+
+
+WORKLOADS = {'last': last_workload, 'cron': cron_workload}
+
+
+def report(mode, workload, timings):
+    for op, times in timings.items():
+        times = sorted(times)
+        print('{:<6} {:<5} {:<12} {:>9.1f} ops/s  mean {:>7.3f}ms  p99 {:>7.3f}ms'.format(
+            mode, workload, op, len(times) / sum(times), 1000 * sum(times) / len(times),
+            1000 * times[int(len(times) * 0.99)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, default=2000, help='operations of each kind per workload')
+    parser.add_argument('--uri', help='also benchmark a MongoDB server')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        clients = [
+            ('local', LocalClient(os.path.join(tmp, 'benchmark.sqlite3'))),
+            ('mock', mongomock.MongoClient()),
+        ]
+        if args.uri:
+            clients.append(('uri', pymongo.MongoClient(args.uri)))
+        for mode, client in clients:
+            db = client.get_database('benchmark') if mode == 'mock' else client.get_database()
+            for name, workload in WORKLOADS.items():
+                coll = db[f'benchmark__{name}']
+                coll.drop()
+                random.seed(0)
+                report(mode, name, workload(coll, args.n))
+            client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,7 @@ setuptools.setup(
         'isodate>=0.5.1',
         'aiohttp>=3.5.1,<4.0',
         'async_generator',
+        'async_timeout',
         'attrs',
         'toml',
         'schematics',
@@ -33,5 +34,27 @@ setuptools.setup(
             'csbot = csbot:main',
             'csbot_util = csbot.cli:util',
         ],
+        'csbot.plugins': [
+            'auth = csbot.plugins.auth:Auth',
+            'calc = csbot.plugins.calc:Calc',
+            'cron = csbot.plugins.cron:Cron',
+            'csyork = csbot.plugins.csyork:CSYork',
+            'github = csbot.plugins.github:GitHub',
+            'helix = csbot.plugins.helix:Helix',
+            'hoogle = csbot.plugins.hoogle:Hoogle',
+            'imgur = csbot.plugins.imgur:Imgur',
+            'last = csbot.plugins.last:Last',
+            'linkinfo = csbot.plugins.linkinfo:LinkInfo',
+            'logger = csbot.plugins.logger:Logger',
+            'mongodb = csbot.plugins.mongodb:MongoDB',
+            'termdates = csbot.plugins.termdates:TermDates',
+            'topic = csbot.plugins.topic:Topic',
+            'usertrack = csbot.plugins.usertrack:UserTrack',
+            'webhook = csbot.plugins.webhook:Webhook',
+            'webserver = csbot.plugins.webserver:WebServer',
+            'whois = csbot.plugins.whois:Whois',
+            'xkcd = csbot.plugins.xkcd:xkcd',
+            'youtube = csbot.plugins.youtube:Youtube',
+        ],
     },
 )
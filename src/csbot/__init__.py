@@ -114,18 +114,23 @@ def main(config,
     _, ext = os.path.splitext(config.name)
     if config_format == "ini" or ext.lower() in {".ini", ".cfg"}:
         LOG.debug("Reading configuration with ConfigParser")
-        config_data = load_ini(config)
+        load_config = load_ini
     elif config_format == "json" or ext.lower() in {".json"}:
         LOG.debug("Reading configuration as JSON")
-        config_data = load_json(config)
+        load_config = load_json
     elif config_format == "toml" or ext.lower() in {".toml"}:
         LOG.debug("Reading configuration as TOML")
-        config_data = load_toml(config)
+        load_config = load_toml
     else:
         raise click.BadArgumentUsage('config file extension not in {".ini", ".cfg", ".json", ".toml"} '
                                      'and no --config-format specified, unsure how to load config')
-    client = Bot(config_data)
-    client.bot_setup()
+    client = Bot(load_config(config))
+
+    # Re-read the same file when reloading configuration
+    def config_loader():
+        with open(config.name, 'r') as f:
+            return load_config(f)
+    client.config_loader = config_loader
 
     # Configure Rollbar for exception reporting, report deployment
     if rollbar_token:
@@ -146,10 +151,12 @@ def main(config,
         client.loop.set_exception_handler(handler)
 
         if revision:
-            client.loop.run_until_complete(rollbar_report_deploy(rollbar_token, env_name, revision))
+            run_in_background(client.loop, rollbar_report_deploy(rollbar_token, env_name, revision),
+                              'reporting deploy to Rollbar')
 
     if github_token and github_repo and revision:
-        client.loop.run_until_complete(github_report_deploy(github_token, github_repo, env_name, revision))
+        run_in_background(client.loop, github_report_deploy(github_token, github_repo, env_name, revision),
+                          'reporting deploy to GitHub')
 
     # Run the client
     async def graceful_shutdown(future):
@@ -178,16 +185,32 @@ def main(config,
         LOG.info("Interrupt received, attempting graceful shutdown... (press ^c again to force exit)")
         asyncio.ensure_future(graceful_shutdown(future), loop=client.loop)
 
-    # Run the client until it exits or gets SIGINT
+    # Set up plugins while the client connects; core events are buffered until plugins are ready
     client_future = asyncio.ensure_future(client.run(), loop=client.loop)
+    setup_future = asyncio.ensure_future(client.bot_setup_async(), loop=client.loop)
+
+    def setup_done(future):
+        if not future.cancelled() and future.exception() is not None:
+            LOG.error("Plugin setup failed, exiting...")
+            client_future.cancel()
+    setup_future.add_done_callback(setup_done)
+
+    def reload_config():
+        LOG.info("SIGHUP received, reloading configuration...")
+        run_in_background(client.loop, client.reload_config(), 'reloading configuration')
+
+    # Run the client until it exits or gets SIGINT, reloading configuration on SIGHUP
     client.loop.add_signal_handler(signal.SIGINT, stop, client_future)
+    client.loop.add_signal_handler(signal.SIGHUP, reload_config)
     try:
         client.loop.run_until_complete(client_future)
     except asyncio.CancelledError:
         LOG.error("client.run() task cancelled")
 
     # Run teardown before disposing of the event loop, in case teardown code needs asyncio
-    client.bot_teardown()
+    setup_ok = setup_future.done() and not setup_future.cancelled() and setup_future.exception() is None
+    if setup_ok:
+        client.bot_teardown()
 
     # Cancel all pending tasks (taken from asyncio.run() in python 3.7)
     to_cancel = asyncio.all_tasks(client.loop)
@@ -209,6 +232,10 @@ def main(config,
     client.loop.close()
     LOG.info("Exited")
 
+    # Don't hide why plugin setup failed
+    if setup_future.done() and not setup_future.cancelled() and setup_future.exception() is not None:
+        raise setup_future.exception()
+
 
 def load_ini(f):
     parser = configparser.ConfigParser(interpolation=None, allow_no_value=True)
@@ -230,6 +257,16 @@ def load_toml(f):
     return toml.load(f)
 
 
+def run_in_background(loop, coro, description):
+    """Run *coro* as a task on *loop*, logging (instead of raising) any exception."""
+    async def f():
+        try:
+            await coro
+        except Exception:
+            LOG.exception('Error %s', description)
+    return asyncio.ensure_future(f(), loop=loop)
+
+
 async def rollbar_report_deploy(rollbar_token, env_name, revision):
     async with aiohttp.ClientSession() as session:
         request = session.post(
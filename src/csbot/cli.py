@@ -3,7 +3,7 @@ import sys
 import click
 
 from .core import Bot
-from .plugin import find_plugins
+from .plugin import find_plugins, find_plugin_registry
 
 
 @click.group(context_settings={"help_option_names": ["-h", "--help"]})
@@ -12,9 +12,16 @@ def util():
 
 
 @util.command(help="List available plugins")
-def list_plugins():
-    for P in sorted(find_plugins(), key=lambda p: p.plugin_name()):
-        sys.stdout.write(f"{P.plugin_name():<20}  ({P.qualified_name()})\n")
+@click.option("--import-times", is_flag=True, default=False,
+              help="Import each plugin and show how long it took")
+def list_plugins(import_times):
+    registry = find_plugin_registry()
+    for name in sorted(registry):
+        line = f"{name:<20}  ({registry.qualified_name(name)})"
+        if import_times:
+            registry[name]
+            line += f"  {registry.import_times[name] * 1000:.1f}ms"
+        sys.stdout.write(line + "\n")
 
 
 @util.command(help="Generate example configuration file")
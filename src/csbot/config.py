@@ -22,6 +22,7 @@ from typing import (
 
 import attr
 from schematics import Model, types
+from schematics.models import ModelMeta
 import schematics.exceptions
 import toml
 from toml.encoder import _dump_str
@@ -32,7 +33,15 @@ _LOG = logging.getLogger(__name__)
 _METADATA_KEY = 'csbot_config'
 
 
-class Config(Model):
+class _ConfigMeta(ModelMeta):
+    def __instancecheck__(cls, instance):
+        # A snapshot of a Config subclass counts as an instance of it
+        if isinstance(instance, ConfigSnapshot):
+            return issubclass(instance.config_class, cls)
+        return super().__instancecheck__(instance)
+
+
+class Config(Model, metaclass=_ConfigMeta):
     """Base class for configuration schemas.
 
     Use :func:`option`, :func:`option_list` and :func:`option_map` to create fields in the schema.
@@ -46,6 +55,52 @@ class Config(Model):
         return f"{self.__class__.__name__}({', '.join(f'{a.name}={repr(a.value)}' for a in self.atoms())})"
 
 
+class ConfigSnapshot:
+    """Base class for frozen snapshots of validated :class:`Config` instances.
+
+    The schema is only used for validation and example generation; :func:`structure` returns a snapshot, which is a
+    slotted :mod:`attr` class with an attribute for each option, so reading an option is as fast as any other attribute
+    access.  Nested configuration is also converted to snapshots.  A snapshot counts as an instance of its
+    :attr:`config_class`.
+    """
+    __slots__ = ()
+
+    #: The :class:`Config` subclass this is a snapshot of.
+    config_class: Type[Config] = None
+
+
+_snapshot_classes: Dict[Type[Config], Type[ConfigSnapshot]] = {}
+
+
+def snapshot_class(cls: Type[Config]) -> Type[ConfigSnapshot]:
+    """Get the (cached) :class:`ConfigSnapshot` subclass for *cls*."""
+    snapshot_cls = _snapshot_classes.get(cls)
+    if snapshot_cls is None:
+        snapshot_cls = attr.make_class(cls.__name__,
+                                       {name: attr.ib() for name in cls._schema.fields},
+                                       bases=(ConfigSnapshot,),
+                                       frozen=True,
+                                       slots=True)
+        snapshot_cls.config_class = cls
+        _snapshot_classes[cls] = snapshot_cls
+    return snapshot_cls
+
+
+def snapshot(obj: Config) -> ConfigSnapshot:
+    """Create a :class:`ConfigSnapshot` of validated configuration *obj*."""
+    def convert(value):
+        if isinstance(value, Model):
+            return snapshot(value)
+        elif isinstance(value, list):
+            return [convert(v) for v in value]
+        elif isinstance(value, dict):
+            return {k: convert(v) for k, v in value.items()}
+        else:
+            return value
+    cls = snapshot_class(type(obj))
+    return cls(**{name: convert(obj[name]) for name in type(obj)._schema.fields})
+
+
 #: Raised when configuration fails to validate
 ConfigError = schematics.exceptions.DataError
 
@@ -98,7 +153,7 @@ def is_config(obj: Any) -> bool:
     if inspect.isclass(obj):
         return issubclass(obj, Config)
     else:
-        return isinstance(obj, Config)
+        return isinstance(obj, (Config, ConfigSnapshot))
 
 
 def is_allowable_type(cls: Type) -> bool:
@@ -106,34 +161,36 @@ def is_allowable_type(cls: Type) -> bool:
     return cls in _TYPE_MAP or is_config(cls)
 
 
-def structure(data: Mapping[str, Any], cls: Type[Config]) -> Config:
-    """Create an instance of *cls* from plain Python structure *data*."""
+def structure(data: Mapping[str, Any], cls: Type[Config]) -> ConfigSnapshot:
+    """Create a snapshot of *cls* from plain Python structure *data*."""
     o = cls(data)
     o.validate()
-    return o
+    return snapshot(o)
 
 
-def unstructure(obj: Config) -> Mapping[str, Any]:
+def unstructure(obj: Union[Config, ConfigSnapshot]) -> Mapping[str, Any]:
     """Get plain Python structured data from *obj*."""
+    if isinstance(obj, ConfigSnapshot):
+        return attr.asdict(obj)
     return obj.to_native()
 
 
-def loads(s: str, cls: Type[Config]) -> Config:
+def loads(s: str, cls: Type[Config]) -> ConfigSnapshot:
     """Create an instance of *cls* from the TOML in *s*."""
     return structure(toml.loads(s), cls)
 
 
-def dumps(obj: Config) -> str:
+def dumps(obj: Union[Config, ConfigSnapshot]) -> str:
     """Get TOML string representation of *obj*."""
     return toml.dumps(unstructure(obj))
 
 
-def load(f: TextIO, cls: Type[Config]) -> Config:
+def load(f: TextIO, cls: Type[Config]) -> ConfigSnapshot:
     """Create an instance of *cls* from the TOML in *f*."""
     return structure(toml.load(f), cls)
 
 
-def dump(obj: Config, f: TextIO):
+def dump(obj: Union[Config, ConfigSnapshot], f: TextIO):
     """Write TOML representation of *obj* to *f*."""
     return toml.dump(unstructure(obj), f)
 
@@ -312,12 +369,12 @@ def option_map(cls: Type[_B], *,
     return types.DictType(inner_field, **field_kwargs)
 
 
-def make_example(cls: Type[Config]) -> Config:
-    """Create an instance of *cls* without supplying data, using "example" or "default" values for each option."""
+def make_example(cls: Type[Config]) -> ConfigSnapshot:
+    """Create a snapshot of *cls* without supplying data, using "example" or "default" values for each option."""
     with example_mode():
         o = cls()
         o.validate()
-        return o
+        return snapshot(o)
 
 
 class TomlExampleGenerator:
@@ -363,10 +420,13 @@ class TomlExampleGenerator:
         s = f"{s}\n"
         self._write(s, raw=True)
 
-    def generate(self, obj: Union[Config, Type[Config]], stream: TextIO, prefix: List[str] = None):
+    def generate(self, obj: Union[Config, ConfigSnapshot, Type[Config]], stream: TextIO, prefix: List[str] = None):
         """Generate an example from *obj* and write it to *stream*."""
         if inspect.isclass(obj):
-            obj_ = make_example(obj)
+            obj = make_example(obj)
+        if isinstance(obj, ConfigSnapshot):
+            # Need the schema to generate the example
+            obj_ = obj.config_class(unstructure(obj))
         else:
             obj_ = cast(Config, obj)
         assert is_config(obj)
@@ -513,7 +573,7 @@ class TomlExampleGenerator:
                          for _ in path])
 
 
-def generate_toml_example(obj: Union[Config, Type[Config]], commented: bool = False) -> str:
+def generate_toml_example(obj: Union[Config, ConfigSnapshot, Type[Config]], commented: bool = False) -> str:
     """Generate an example configuration from *obj* as a TOML string."""
     stream = io.StringIO()
     generator = TomlExampleGenerator(commented=commented)
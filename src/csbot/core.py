@@ -1,12 +1,16 @@
 import collections
 import itertools
-from typing import Mapping, Sequence, Type
+import re
+from typing import Callable, Mapping, Sequence, Type
 
-from csbot.plugin import Plugin, SpecialPlugin, find_plugins
-from csbot.plugin import build_plugin_dict, PluginManager, PluginConfigError
+from csbot.plugin import Plugin, SpecialPlugin, find_plugins, find_plugin_registry
+from csbot.plugin import build_plugin_dict, PluginManager, PluginConfigError, PluginFeatureError
 import csbot.events as events
 from csbot.events import Event, CommandEvent
-from csbot.util import maybe_future_result
+from csbot.util import maybe_future_result, irc_lower
+from csbot.worker import WorkerPluginMapping
+from csbot.httpclient import HTTPClient
+from csbot.quota import QuotaManager
 
 from .irc import IRCClient, IRCUser
 from . import config
@@ -16,6 +20,43 @@ class PluginError(Exception):
     pass
 
 
+class _Burst:
+    """Accumulates the per-user events that make up a netsplit or netjoin.
+
+    *key* is either the IRCv3 batch reference, or ``(event_type, servers)`` for
+    a burst detected from quit messages.
+    """
+    def __init__(self, key, event_type, servers):
+        self.key = key
+        self.event_type = event_type
+        self.servers = list(servers)
+        self.users = []
+        # Nicks (lowercase) of the users who rejoined in a netjoin
+        self.nicks = set()
+        self.joins = []
+        self.message = None
+        self.timer = None
+
+    @property
+    def is_batch(self):
+        return not isinstance(self.key, tuple)
+
+    def add_user(self, user):
+        if user not in self.users:
+            self.users.append(user)
+
+    def to_data(self):
+        data = {
+            'servers': self.servers,
+            'users': self.users,
+        }
+        if self.event_type == 'core.netsplit':
+            data['message'] = self.message
+        else:
+            data['joins'] = self.joins
+        return data
+
+
 class Bot(SpecialPlugin, IRCClient):
     # TODO: use IRCUser instances instead of raw user string
 
@@ -30,24 +71,61 @@ class Bot(SpecialPlugin, IRCClient):
         irc_port = config.option(int, default=6667, help="IRC server port")
         command_prefix = config.option(str, default="!", help="Prefix for invoking commands")
         channels = config.option(config.WordList, example=["#cs-york-dev"], help="Channels to join")
-        plugins = config.option(config.WordList, example=lambda: sorted(p.plugin_name() for p in find_plugins()),
+        plugins = config.option(config.WordList, example=lambda: sorted(find_plugin_registry()),
                                 help="Plugins to load")
+        worker_plugins = config.option(config.WordList, help="Plugins to run in worker processes (see csbot.worker)")
         use_notice = config.option(int, default=True, help="Use NOTICE instead of PRIVMSG to send messages")
         client_ping = config.option(int, default=0, help="Send PING if no messages for this many seconds (0=disabled)")
         bind_addr = config.option(str, example="192.168.1.111", help="Bind to specific local address")
         rate_limit_period = config.option(int, default=0, help="Period (in seconds) to consider for rate limit")
         rate_limit_count = config.option(int, default=0, help="Maximum number of messages to send in rate limit period")
-
-    #: Dictionary containing available plugins for loading, using
-    #: straight.plugin to discover plugin classes under a namespace.
+        http_pool_size = config.option(int, default=100, help="Maximum number of HTTP connections (0=unlimited)")
+        http_pool_size_per_host = config.option(int, default=8,
+                                                help="Maximum number of HTTP connections to the same host "
+                                                     "(0=unlimited)")
+        http_dns_cache_ttl = config.option(int, default=300, help="Seconds to cache DNS lookups for HTTP requests")
+        http_connect_timeout = config.option(float, default=10, help="Seconds to wait for an HTTP connection")
+        http_read_timeout = config.option(float, default=30, help="Seconds to wait for data from an HTTP server")
+        http_max_response_size = config.option(int, default=10485760,
+                                               help="Default maximum HTTP response size (in bytes)")
+        http_deadline = config.option(float, default=60,
+                                      help="Seconds for an HTTP request to finish in, including waiting its turn "
+                                           "(0=unlimited)")
+        http_failure_threshold = config.option(int, default=5,
+                                               help="Failed HTTP requests in a row before a host is given a rest")
+        http_failure_cooldown = config.option(float, default=60,
+                                              help="Seconds to stop making HTTP requests to a failing host for")
+        http_cache_size = config.option(int, default=256,
+                                        help="Number of HTTP responses to cache in memory (0=disabled)")
+        http_cache_dir = config.option(str, help="Directory to also cache HTTP responses in")
+        http_cache_dir_size = config.option(int, default=4096, help="Number of HTTP responses to cache on disk")
+
+    #: Function to get the configuration from its source again, used by
+    #: :meth:`reload_config`.  Set by :func:`csbot.main` to re-read the
+    #: configuration file.
+    config_loader: Callable[[], Mapping] = None
+
+    #: Dictionary containing available plugins for loading.  By default this
+    #: is a :class:`~csbot.plugin.PluginRegistry` built from entry points, so
+    #: only the plugins that get loaded are imported.
     available_plugins: Mapping[str, Type[Plugin]]
 
     _WHO_IDENTIFY = ('1', '%na')
 
+    #: Options that :meth:`reconfigure` can apply without a restart
+    _RECONFIGURABLE_OPTIONS = {'command_prefix', 'use_notice', 'channels'}
+
+    #: Quit message used by servers for users lost in a netsplit, e.g. ``*.net *.split``
+    _NETSPLIT_MESSAGE = re.compile(r'(\S+\.\S+) (\S+\.\S+)')
+    #: Seconds without a new quit/join before a detected netsplit/netjoin is considered complete
+    NETSPLIT_QUIET_PERIOD = 2
+    #: Seconds after a netsplit during which rejoining users are considered part of a netjoin
+    NETJOIN_WINDOW = 600
+
     def __init__(self, config=None, *, plugins: Sequence[Type[Plugin]] = None, loop=None):
         # Record available plugins
         if plugins is None:
-            self.available_plugins = build_plugin_dict(find_plugins())
+            self.available_plugins = find_plugin_registry()
         else:
             self.available_plugins = build_plugin_dict(plugins)
 
@@ -83,6 +161,11 @@ class Bot(SpecialPlugin, IRCClient):
 
         self._recent_messages = collections.deque(maxlen=10)
 
+        #: Shared HTTP client, provided to plugins by :meth:`provide`
+        self.http = HTTPClient.from_config(self.config, loop=self.loop)
+        #: Quota accounting for rate-limited APIs, provided to plugins by :meth:`provide`
+        self.quota = QuotaManager(loop=self.loop)
+
         # Plumb in reply(...) method
         if self.config.use_notice:
             self.reply = self.notice
@@ -90,34 +173,160 @@ class Bot(SpecialPlugin, IRCClient):
             self.reply = self.msg
 
         # Plugin management
-        self.plugins = PluginManager([self], self.available_plugins,
+        available = self.available_plugins
+        if self.config.worker_plugins:
+            available = WorkerPluginMapping(available, self.config.worker_plugins)
+        self.plugins = PluginManager([self], available,
                                      self.config.plugins,
                                      [self])
         self.commands = {}
 
         # Event runner
         self.events = events.HybridEventRunner(self._get_hooks, self.loop)
+        # Core events are buffered until plugins are ready (see bot_setup_async())
+        self._event_buffer = []
+        self._event_buffer_future = self.loop.create_future()
 
         # Keeps partial name lists between RPL_NAMREPLY and
         # RPL_ENDOFNAMES events
         self.names_accumulator = collections.defaultdict(list)
 
+        # In-progress netsplits/netjoins, and the split users that might rejoin
+        self._bursts = {}
+        self._split_users = {}
+
     def bot_setup(self):
         """Load plugins defined in configuration and run setup methods.
+
+        Blocking version of :meth:`bot_setup_async`.
+        """
+        self.loop.run_until_complete(self.bot_setup_async())
+
+    async def bot_setup_async(self):
+        """Run plugin setup methods.
+
+        Plugins are set up concurrently within each dependency level.  Core
+        events (``core.*``) posted before this completes, e.g. from an IRC
+        connection started in parallel, are buffered and handled afterwards.
         """
-        self.plugins.setup()
+        await self.plugins.setup()
+        self._flush_event_buffer()
 
     def bot_teardown(self):
         """Run plugin teardown methods.
+
+        Blocking version of :meth:`bot_teardown_async`.
+        """
+        self.loop.run_until_complete(self.bot_teardown_async())
+
+    async def bot_teardown_async(self):
+        """Run plugin teardown methods, in reverse dependency order.
+        """
+        await self.plugins.teardown()
+
+    def provide(self, plugin_name, service):
+        """Provide a bot-wide service for a :meth:`.Plugin.use` usage.
+
+        The services are ``http``, the shared :class:`~csbot.httpclient.HTTPClient`,
+        and ``quota``, the :class:`~csbot.quota.QuotaManager`::
+
+            http = Plugin.use('@bot', service='http')
         """
-        self.plugins.teardown()
+        if service == 'http':
+            return self.http
+        if service == 'quota':
+            return self.quota
+        raise PluginFeatureError(f'unknown @bot service: {service}')
+
+    async def teardown(self):
+        super().teardown()
+        if self.http.cache is not None:
+            self.log.info('HTTP cache: %s entries, %s bytes, %s',
+                          len(self.http.cache), self.http.cache.size, self.http.cache.stats)
+        await self.http.close()
+
+    async def reload_config(self, config_root=None):
+        """Apply new configuration *config_root* without restarting.
+
+        If *config_root* isn't supplied, it's loaded with :attr:`config_loader`.
+        The new configuration for every plugin with changed sections is
+        validated before anything is changed, so an invalid configuration
+        leaves the old one in place.  Those plugins are then reconfigured with
+        :meth:`.PluginManager.reconfigure`.
+
+        Returns the names of the reconfigured plugins.
+        """
+        if config_root is None:
+            if self.config_loader is None:
+                raise PluginError('no config_loader to reload configuration with')
+            config_root = self.config_loader()
+        if not isinstance(config_root, collections.abc.Mapping):
+            raise TypeError("expected 'config_root' to be a dict-like object")
+
+        configs = {}
+        for name, plugin in self.plugins.items():
+            cls = type(plugin)
+            if cls._config_sections(self.config_root) != cls._config_sections(config_root):
+                configs[name] = cls._get_config(config_root)
+
+        self.config_root = config_root
+        await self.plugins.reconfigure(configs)
+        return [p for p in self.plugins if p in configs]
+
+    def reconfigure(self, old, new):
+        """Apply changes to the bot's own configuration.
+
+        Only ``command_prefix``, ``use_notice`` and ``channels`` can change
+        without a restart; a warning is logged for anything else.
+        """
+        if new.use_notice != old.use_notice:
+            self.reply = self.notice if new.use_notice else self.msg
+
+        if self.connected.is_set():
+            for channel in old.channels:
+                if channel not in new.channels:
+                    self.leave(channel)
+            for channel in new.channels:
+                if channel not in old.channels:
+                    self.join(channel)
+
+        restart = [name for name in self.Config._schema.fields
+                   if name not in self._RECONFIGURABLE_OPTIONS and getattr(old, name) != getattr(new, name)]
+        if restart:
+            self.log.warning('restart needed to apply configuration changes: ' + ', '.join(restart))
 
     def _get_hooks(self, event):
-        return itertools.chain(*self.plugins.get_hooks(event.event_type))
+        if event.batch is None:
+            return itertools.chain(*self.plugins.get_hooks(event.event_type))
+        # Plugins that handle the batch event don't need the individual events
+        return itertools.chain(*(p.get_hooks(event.event_type) for p in self.plugins.values()
+                                 if not p.get_hooks(event.batch)))
 
     def post_event(self, event):
+        if self._event_buffer is not None and event.event_type.startswith('core.'):
+            self._event_buffer.append(event)
+            return self._event_buffer_future
         return self.events.post_event(event)
 
+    def _flush_event_buffer(self):
+        """Post events buffered before plugins were ready.
+
+        The future returned for buffered events resolves once they have all
+        been handled.
+        """
+        events, self._event_buffer = self._event_buffer, None
+        future = None
+        for event in events or ():
+            future = self.events.post_event(event)
+
+        def done(f):
+            if not self._event_buffer_future.done():
+                self._event_buffer_future.set_result(None)
+        if future is None:
+            done(None)
+        else:
+            future.add_done_callback(done)
+
     def register_command(self, cmd, metadata, f, tag=None):
         # Bail out if the command already exists
         if cmd in self.commands:
@@ -189,6 +398,52 @@ class Bot(SpecialPlugin, IRCClient):
     def show_plugins(self, e):
         e.reply('loaded plugins: ' + ', '.join(self.plugins))
 
+    @Plugin.command('http.status', help=('http.status: show HTTP requests in progress, hosts that requests '
+                                         'are refused to because of recent failures, and cache statistics'))
+    def show_http_status(self, e):
+        status = 'HTTP: ' + self.http.scheduler.describe()
+        if self.http.cache is not None:
+            status += f'; cache: {len(self.http.cache)} entries, {self.http.cache.stats.hit_rate:.0%} hit rate'
+        e.reply(status)
+
+    @Plugin.command('plugins.reload', help=('plugins.reload <plugin>: reload a plugin, and the plugins '
+                                            'that depend on it, without reconnecting'))
+    async def reload_plugin(self, e):
+        name = e['data'].strip()
+        if 'auth' not in self.plugins:
+            e.reply('error: reloading plugins requires the auth plugin')
+            return
+        if not self.plugins['auth'].check_or_error(e, 'plugins'):
+            return
+        if not name:
+            e.reply('error: no plugin specified')
+            return
+
+        try:
+            reloaded = await self.plugins.reload(name)
+        except Exception as ex:
+            self.log.exception(f'failed to reload plugin: {name}')
+            e.reply(f'error: failed to reload {name}: {ex}')
+        else:
+            e.reply('reloaded plugins: ' + ', '.join(reloaded))
+
+    @Plugin.command('config.reload', help=('config.reload: re-read the configuration file and reconfigure '
+                                           'plugins whose configuration changed'))
+    async def reload_config_command(self, e):
+        if 'auth' not in self.plugins:
+            e.reply('error: reloading configuration requires the auth plugin')
+            return
+        if not self.plugins['auth'].check_or_error(e, 'config'):
+            return
+
+        try:
+            reconfigured = await self.reload_config()
+        except Exception as ex:
+            self.log.exception('failed to reload configuration')
+            e.reply(f'error: failed to reload configuration: {ex}')
+        else:
+            e.reply('reconfigured plugins: ' + (', '.join(reconfigured) or 'none'))
+
     # Implement IRCClient events
 
     def emit_new(self, event_type, data=None):
@@ -206,6 +461,9 @@ class Bot(SpecialPlugin, IRCClient):
         await super().connection_made()
         if self.config.ircv3:
             await self.request_capabilities(enable={'account-notify', 'extended-join'})
+            # Requested separately, so an unsupported 'batch' doesn't get the other capabilities rejected
+            if 'batch' in self.available_capabilities:
+                await self.request_capabilities(enable={'batch'})
         self.emit_new('core.raw.connected')
 
     async def connection_lost(self, exc):
@@ -360,21 +618,143 @@ class Bot(SpecialPlugin, IRCClient):
         self.on_user_identified(msg.prefix, None if account == '*' else account)
 
     def irc_JOIN(self, msg):
-        """Re-implement ``JOIN`` handler to account for ``extended-join`` info.
+        """Re-implement ``JOIN`` handler to account for ``extended-join`` info
+        and netjoins.
         """
-        # Only do special handling if extended-join was enabled
-        if 'extended-join' not in self.enabled_capabilities:
-            return super().irc_JOIN(msg)
-
         user = IRCUser.parse(msg.prefix)
-        nick = user.nick
-        channel, account, _ = msg.params
+        channel = msg.params[0]
 
-        if nick == self.nick:
+        if user.nick == self.nick:
             self.on_joined(channel)
-        else:
+            return
+
+        # Only do special handling if extended-join was enabled
+        if 'extended-join' in self.enabled_capabilities:
+            _, account, _ = msg.params
             self.on_user_identified(user.raw, None if account == '*' else account)
+
+        burst = self._find_netjoin(msg, user)
+        if burst is None:
             self.on_user_joined(user, channel)
+        else:
+            data = {'channel': channel, 'user': user.raw}
+            burst.add_user(user.raw)
+            burst.nicks.add(irc_lower(user.nick))
+            burst.joins.append(data)
+            self._emit_in_burst(burst, 'core.channel.joined', data)
+
+    # Implement netsplit/netjoin detection
+    #
+    # Users lost in a netsplit are recognised either by being in an IRCv3
+    # "netsplit" batch or by their quit message (e.g. "*.net *.split"); a
+    # netjoin is either an IRCv3 "netjoin" batch or split users rejoining.
+    # One core.netsplit/core.netjoin event is fired per burst, and plugins
+    # that hook those events don't receive the individual per-user events.
+
+    def irc_QUIT(self, msg):
+        """Re-implement ``QUIT`` handler to detect netsplits."""
+        user = IRCUser.parse(msg.prefix)
+        (message,) = msg.pad_params(1)
+
+        burst = self._find_netsplit(msg, message)
+        if burst is None:
+            self.on_user_quit(user, message)
+        else:
+            burst.add_user(user.raw)
+            burst.message = message
+            self._split_users[irc_lower(user.nick)] = (burst.servers, self.loop.time() + self.NETJOIN_WINDOW)
+            self._emit_in_burst(burst, 'core.user.quit', {
+                'user': user.raw,
+                'message': message,
+            })
+
+    def irc_BATCH(self, msg):
+        """Track IRCv3 ``netsplit`` and ``netjoin`` batches."""
+        ref, batch_type = msg.pad_params(2)[:2]
+        if ref.startswith('+'):
+            if batch_type in ('netsplit', 'netjoin'):
+                self._bursts[ref[1:]] = _Burst(ref[1:], 'core.' + batch_type, msg.params[2:4])
+        elif ref.startswith('-'):
+            burst = self._bursts.get(ref[1:])
+            if burst is not None:
+                self._finish_burst(burst)
+
+    def _find_netsplit(self, msg, message):
+        """Get the netsplit burst that a ``QUIT`` message belongs to, if any."""
+        batch = msg.get_tag('batch')
+        if batch is not None:
+            burst = self._bursts.get(batch)
+            return burst if burst is not None and burst.event_type == 'core.netsplit' else None
+
+        match = self._NETSPLIT_MESSAGE.fullmatch(message or '')
+        if match is None:
+            return None
+        return self._get_detected_burst('core.netsplit', match.groups())
+
+    def _find_netjoin(self, msg, user):
+        """Get the netjoin burst that a ``JOIN`` message belongs to, if any."""
+        batch = msg.get_tag('batch')
+        if batch is not None:
+            burst = self._bursts.get(batch)
+            return burst if burst is not None and burst.event_type == 'core.netjoin' else None
+
+        nick = irc_lower(user.nick)
+        split = self._split_users.get(nick)
+        if split is None:
+            return None
+        servers, expires = split
+        if expires < self.loop.time():
+            del self._split_users[nick]
+            return None
+
+        # Make sure the netsplit is reported before the netjoin starts
+        netsplit = self._bursts.get(('core.netsplit', tuple(servers)))
+        if netsplit is not None:
+            self._finish_burst(netsplit)
+        return self._get_detected_burst('core.netjoin', servers)
+
+    def _get_detected_burst(self, event_type, servers):
+        key = (event_type, tuple(servers))
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst(key, event_type, servers)
+        return burst
+
+    def _emit_in_burst(self, burst, event_type, data):
+        """Fire a per-user event which is part of *burst*, but only to plugins
+        that don't handle the burst's event.
+        """
+        if not burst.is_batch:
+            # Without an explicit end, the burst is over when things go quiet
+            if burst.timer is not None:
+                burst.timer.cancel()
+            burst.timer = self.loop.call_later(self.NETSPLIT_QUIET_PERIOD, self._finish_burst, burst)
+
+        event = Event(self, event_type, data)
+        event.batch = burst.event_type
+        if any(True for _ in self._get_hooks(event)):
+            return self.post_event(event)
+
+    def _finish_burst(self, burst):
+        """Fire the event for a complete netsplit/netjoin."""
+        if self._bursts.get(burst.key) is not burst:
+            return
+        del self._bursts[burst.key]
+        if burst.timer is not None:
+            burst.timer.cancel()
+
+        if burst.event_type == 'core.netsplit':
+            # Forget about split users that never came back
+            now = self.loop.time()
+            for nick, (_, expires) in list(self._split_users.items()):
+                if expires < now:
+                    del self._split_users[nick]
+        else:
+            # Users who came back aren't split any more, so their next join is an ordinary one
+            for nick in burst.nicks:
+                self._split_users.pop(nick, None)
+
+        self.emit_new(burst.event_type, burst.to_data())
 
     def reply(self, to, message):
         """Reply to a nick/channel.
@@ -317,6 +317,10 @@ class Event(dict):
     #: The value of :meth:`datetime.datetime.now()` when the event was
     #: triggered.
     datetime = None
+    #: The event type of a batch event that also covers this event, e.g.
+    #: ``core.netsplit`` for a ``core.user.quit``.  Plugins that hook the
+    #: batch event don't receive this event.
+    batch = None
 
     def __init__(self, bot, event_type, data=None):
         dict.__init__(self, data if data is not None else {})
@@ -0,0 +1,733 @@
+"""Shared HTTP client for plugins.
+
+The bot owns a single :class:`HTTPClient`, so that all plugins share one
+connection pool: connections are kept alive between requests, DNS lookups are
+cached, and there are limits on the number of connections, both in total and
+per host.  Plugins get the client with :meth:`.Plugin.use`::
+
+    class Foo(Plugin):
+        http = Plugin.use('@bot', service='http')
+
+        async def get_thing(self, url):
+            resp = await self.http.fetch(url)
+            return resp.json()
+
+The pool and the default timeouts and response size limit are configured by
+the ``http_*`` options in the ``[@bot]`` section.
+
+Responses from :meth:`HTTPClient.fetch` are cached by an :class:`HTTPCache`,
+which keeps recently used responses in memory and optionally also on disk.
+How long a response stays fresh comes from its ``Cache-Control`` or
+``Expires`` header, unless the caller overrides it with *ttl*, e.g. for
+resources that are known never to change.  Stale responses that have an
+``ETag`` or ``Last-Modified`` header are revalidated with a conditional
+request, so an unchanged body isn't downloaded again.
+
+Every request goes through the client's :class:`FetchScheduler`, which limits
+how many requests are in progress (in total and per host), gives each request
+a deadline, and has a :class:`CircuitBreaker` per host so that a slow or dead
+site is given a rest instead of being retried by every caller.
+"""
+import asyncio
+import collections
+from email.utils import parsedate_to_datetime
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from typing import Optional
+
+import aiohttp
+import async_timeout
+import attr
+from async_generator import asynccontextmanager
+from multidict import CIMultiDict
+from yarl import URL
+
+from .util import pluralize
+
+
+LOG = logging.getLogger(__name__)
+
+
+class ResponseTooLarge(aiohttp.ClientError):
+    """A response body was larger than the allowed maximum size."""
+
+
+class CircuitOpen(aiohttp.ClientConnectionError):
+    """Requests to a host are refused because its :class:`CircuitBreaker` is
+    open.
+    """
+    def __init__(self, breaker):
+        super().__init__(breaker.host)
+        self.breaker = breaker
+
+    def __str__(self):
+        return f'{self.breaker.host}: too many failed requests, retry in {self.breaker.retry_in:.0f}s'
+
+
+@attr.s(frozen=True, slots=True)
+class HTTPResponse:
+    """A complete HTTP response, as returned by :meth:`HTTPClient.fetch`."""
+    #: Final URL of the response, after any redirects
+    url: str = attr.ib()
+    #: HTTP status code
+    status: int = attr.ib()
+    #: HTTP status reason, e.g. ``"Not Found"``
+    reason: str = attr.ib()
+    #: Response headers (case-insensitive)
+    headers = attr.ib(repr=False)
+    #: Encoding from the ``Content-Type`` header, if present
+    charset: Optional[str] = attr.ib()
+    #: Response body
+    body: bytes = attr.ib(repr=False)
+    #: Was the response served from :class:`HTTPCache`?
+    from_cache: bool = attr.ib(default=False)
+
+    def text(self, encoding=None, errors='replace'):
+        """Decode the response body, using *encoding* if supplied, otherwise
+        :attr:`charset` or UTF-8.
+        """
+        return self.body.decode(encoding or self.charset or 'utf-8', errors)
+
+    def json(self):
+        """Decode the response body as JSON.  Returns None for an empty body."""
+        text = self.text(errors='strict').strip()
+        if not text:
+            return None
+        return json.loads(text)
+
+
+def _parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_cache_control(value):
+    """Parse a ``Cache-Control`` header into a dict of lowercase directive to
+    value (None for directives without a value).
+    """
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+    return directives
+
+
+def freshness_lifetime(headers, now=None):
+    """Get the number of seconds a response with *headers* is fresh for,
+    according to its ``Cache-Control`` or ``Expires`` header.
+
+    Returns None if the response must not be stored, and 0 if it must be
+    revalidated before each use or has no explicit lifetime.
+    """
+    cache_control = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-store' in cache_control:
+        return None
+    if 'no-cache' in cache_control:
+        return 0
+    try:
+        age = int(headers.get('Age', 0))
+    except ValueError:
+        age = 0
+    if 'max-age' in cache_control:
+        try:
+            return max(0, int(cache_control['max-age']) - age)
+        except (TypeError, ValueError):
+            return 0
+    if 'Expires' in headers:
+        expires = _parse_http_date(headers['Expires'])
+        date = _parse_http_date(headers.get('Date')) or (time.time() if now is None else now)
+        return max(0, expires - date) if expires is not None else 0
+    return 0
+
+
+@attr.s(frozen=True, slots=True)
+class CacheEntry:
+    """A response stored in :class:`HTTPCache`."""
+    #: The cached response
+    response: HTTPResponse = attr.ib()
+    #: Time (as :func:`time.time`) after which the response must be revalidated
+    expires: float = attr.ib()
+
+    @property
+    def etag(self):
+        return self.response.headers.get('ETag')
+
+    @property
+    def last_modified(self):
+        return self.response.headers.get('Last-Modified')
+
+    def is_fresh(self, now):
+        return now < self.expires
+
+    def can_revalidate(self):
+        return self.etag is not None or self.last_modified is not None
+
+    def validators(self):
+        """Get headers for a conditional request to revalidate this entry."""
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+@attr.s(slots=True)
+class CacheStats:
+    """Counters for :class:`HTTPCache` usage."""
+    #: Fresh responses served from the cache
+    hits: int = attr.ib(default=0)
+    #: Requests with no usable cached response
+    misses: int = attr.ib(default=0)
+    #: Stale responses revalidated by the server (``304 Not Modified``)
+    revalidated: int = attr.ib(default=0)
+    #: Responses added to the cache
+    stores: int = attr.ib(default=0)
+    #: Responses evicted from memory to make space
+    evictions: int = attr.ib(default=0)
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups that didn't download a body."""
+        total = self.hits + self.revalidated + self.misses
+        return (self.hits + self.revalidated) / total if total else 0.0
+
+
+class DiskStore:
+    """Stores :class:`CacheEntry` objects as files in *directory*, keeping at
+    most *max_entries* (removing the least recently written first).
+
+    Methods block on disk access, so :class:`HTTPCache` calls them in an
+    executor; they can be called from several threads at once.
+    """
+    def __init__(self, directory, max_entries=4096):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Number of entries, so the directory is only listed when it's time to prune
+        self._count = len(self._list())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            LOG.warning('discarding unreadable cache file %s: %s', key, e)
+            self.delete(key)
+            return None
+
+    def put(self, key, entry):
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        path = self._path(key)
+        with self._lock:
+            if not os.path.exists(path):
+                self._count += 1
+            os.replace(tmp, path)
+            if self._count > self.max_entries:
+                self._prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        else:
+            with self._lock:
+                self._count -= 1
+
+    def _list(self):
+        with os.scandir(self.directory) as it:
+            return [e for e in it if e.is_file() and not e.name.startswith('.')]
+
+    def _prune(self):
+        files = self._list()
+        files.sort(key=lambda e: e.stat().st_mtime)
+        for e in files[:max(0, len(files) - self.max_entries)]:
+            try:
+                os.remove(e.path)
+            except FileNotFoundError:
+                pass
+        self._count = len(self._list())
+
+    def __len__(self):
+        return self._count
+
+
+class HTTPCache:
+    """A cache of HTTP responses, keeping up to *max_entries* in memory with
+    least-recently-used eviction, and optionally also in a :class:`DiskStore`
+    (*disk*), so responses survive a restart.
+    """
+    def __init__(self, max_entries=256, disk: DiskStore = None):
+        self.max_entries = max_entries
+        self.disk = disk
+        self.stats = CacheStats()
+        self._entries = collections.OrderedDict()
+
+    @staticmethod
+    def key(url, headers=None):
+        """Get the cache key for a GET of *url* with extra request *headers*."""
+        parts = [url] + sorted(f'{k.lower()}: {v}' for k, v in (headers or {}).items())
+        return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    async def get(self, key) -> Optional[CacheEntry]:
+        """Get the entry for *key*, if there is one (fresh or not)."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        elif self.disk is not None:
+            entry = await asyncio.get_event_loop().run_in_executor(None, self.disk.get, key)
+            if entry is not None:
+                self._remember(key, entry)
+        return entry
+
+    async def put(self, key, entry: CacheEntry):
+        """Store *entry* as *key*."""
+        self._remember(key, entry)
+        if self.disk is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self.disk.put, key, entry)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """Total size in bytes of the response bodies held in memory."""
+        return sum(len(e.response.body) for e in self._entries.values())
+
+    def clear(self):
+        self._entries.clear()
+
+
+class CircuitBreaker:
+    """Tracks failed requests to *host*.
+
+    The breaker starts *closed*, allowing requests.  After *threshold* requests
+    in a row fail it *opens*, and requests are refused for *cooldown* seconds.
+    Then it's *half-open*: one trial request is allowed, which closes the
+    breaker if it succeeds or opens it again if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, host, threshold=5, cooldown=60, clock=time.monotonic):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        #: Number of failed requests in a row
+        self.failures = 0
+        self.failed_at = None
+        self.opened_at = None
+        self._trial = False
+
+    def __str__(self):
+        if self.state == self.OPEN:
+            return f'{self.host} (retry in {self.retry_in:.0f}s)'
+        return f'{self.host} ({self.state})'
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        elif self.clock() - self.opened_at < self.cooldown:
+            return self.OPEN
+        else:
+            return self.HALF_OPEN
+
+    @property
+    def idle(self):
+        """Has the breaker allowed requests for *cooldown* seconds since the
+        last failure, without one being made?  An idle breaker can be
+        forgotten.
+        """
+        if self.failed_at is None or self._trial:
+            return False
+        since = self.failed_at if self.opened_at is None else self.opened_at + self.cooldown
+        return self.clock() - since >= self.cooldown
+
+    @property
+    def retry_in(self):
+        """Seconds until the breaker is half-open (0 if it isn't open)."""
+        if self.opened_at is None:
+            return 0
+        return max(0, self.opened_at + self.cooldown - self.clock())
+
+    def allow(self):
+        """Can a request be made now?  In the half-open state this allows the
+        trial request, so the caller must then call :meth:`record`.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        elif state == self.OPEN or self._trial:
+            return False
+        else:
+            self._trial = True
+            return True
+
+    def record(self, ok):
+        """Record the outcome of an allowed request: True if it succeeded,
+        False if it failed, or None if it didn't finish (e.g. was cancelled).
+        """
+        if self.opened_at is not None:
+            self._trial = False
+        if ok is None:
+            return
+        elif ok:
+            self.failures = 0
+            self.opened_at = None
+        else:
+            self.failures += 1
+            self.failed_at = self.clock()
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = self.failed_at
+
+
+class FetchScheduler:
+    """Decides when requests can be made.
+
+    At most *limit* requests can be in progress at once, and at most
+    *limit_per_host* to the same host (0 for unlimited); others wait their turn.
+    Each host gets a :class:`CircuitBreaker` when a request to it fails (see
+    *failure_threshold* and *failure_cooldown*).  A request fails if it can't
+    connect, times out or gets a server error (5xx) response; timing out while
+    waiting for a turn isn't the host's fault, so doesn't count.  Breakers are
+    forgotten once they close, or when their host goes unused (see
+    :attr:`CircuitBreaker.idle`).
+
+    :param loop: asyncio event loop to use (default: use current loop)
+    """
+    def __init__(self, *, loop=None, limit=100, limit_per_host=8,
+                 failure_threshold=5, failure_cooldown=60, clock=time.monotonic):
+        self.loop = loop
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.failure_threshold = failure_threshold
+        self.failure_cooldown = failure_cooldown
+        self.clock = clock
+        #: Circuit breakers for hosts with recently failed requests
+        self.breakers = {}
+        self._semaphore = None
+        # Per-host semaphores and the number of requests using each
+        self._host_semaphores = {}
+        self._host_users = collections.Counter()
+
+    @property
+    def active(self):
+        """Number of requests that are in progress or waiting their turn."""
+        return sum(self._host_users.values())
+
+    def open_breakers(self):
+        """Get the breakers that are not closed, soonest to retry first."""
+        return sorted((b for b in self.breakers.values() if b.state != CircuitBreaker.CLOSED),
+                      key=lambda b: b.retry_in)
+
+    def describe(self):
+        """Summarise the scheduler state, e.g. for a status command."""
+        breakers = self.open_breakers()
+        return '{} in progress, {}'.format(
+            pluralize(self.active, 'request', 'requests'),
+            'open circuits: ' + ', '.join(str(b) for b in breakers) if breakers else 'no open circuits')
+
+    @asynccontextmanager
+    async def slot(self, host, deadline=None):
+        """Wait for a turn to make a request to *host*, and then make it within
+        the *deadline* (in seconds from now, None for no deadline), otherwise
+        it's cancelled with :exc:`asyncio.TimeoutError`.
+
+        An async context manager which gives a :class:`FetchAttempt`.  Raises
+        :exc:`CircuitOpen` immediately if the host's breaker is open.
+        """
+        breaker = self.breakers.get(host)
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpen(breaker)
+        attempt = FetchAttempt()
+        started = False
+        self._host_users[host] += 1
+        try:
+            async with async_timeout.timeout(deadline):
+                # Wait for the host first, so a busy host doesn't hold up requests to others
+                async with self._limit(self._get_host_semaphore(host)), self._limit(self._get_semaphore()):
+                    started = True
+                    yield attempt
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if started:
+                attempt.ok = False
+            raise
+        finally:
+            self._host_users[host] -= 1
+            if self._host_users[host] == 0:
+                del self._host_users[host]
+                self._host_semaphores.pop(host, None)
+            self._record(host, attempt.ok)
+
+    @staticmethod
+    @asynccontextmanager
+    async def _limit(semaphore):
+        if semaphore is None:
+            yield
+        else:
+            async with semaphore:
+                yield
+
+    def _get_semaphore(self):
+        if self._semaphore is None and self.limit > 0:
+            self._semaphore = asyncio.Semaphore(self.limit, loop=self.loop)
+        return self._semaphore
+
+    def _get_host_semaphore(self, host):
+        if self.limit_per_host <= 0:
+            return None
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(self.limit_per_host, loop=self.loop)
+        return semaphore
+
+    def _record(self, host, ok):
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            if ok is not False:
+                return
+            breaker = self.breakers[host] = CircuitBreaker(host, self.failure_threshold,
+                                                           self.failure_cooldown, self.clock)
+        breaker.record(ok)
+        if breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0:
+            # Only remember hosts that have been failing
+            del self.breakers[host]
+        for other in [h for h, b in self.breakers.items() if b.idle]:
+            del self.breakers[other]
+
+
+class FetchAttempt:
+    """The outcome of a request made in a :meth:`FetchScheduler.slot`."""
+    def __init__(self):
+        #: True if the request succeeded, False if it failed, None if unknown
+        self.ok = None
+
+    def response(self, status):
+        """Record the response *status*; server errors count as failures."""
+        self.ok = status < 500
+
+
+class HTTPClient:
+    """A pooled HTTP client, with connection limits, timeouts and response size
+    limits.
+
+    The :class:`aiohttp.ClientSession` is created when first used, so that it
+    belongs to the running event loop, and must be closed with :meth:`close`.
+
+    :param loop: asyncio event loop to use (default: use current loop)
+    :param limit: Maximum number of connections (0 for unlimited)
+    :param limit_per_host: Maximum number of connections to the same host (0 for unlimited)
+    :param dns_cache_ttl: Seconds to cache DNS lookups for (None to cache forever)
+    :param connect_timeout: Seconds to wait for a connection to be established
+    :param read_timeout: Seconds to wait for data from the server
+    :param max_response_size: Default maximum response size for :meth:`read` and :meth:`fetch`
+    :param deadline: Default seconds for a request to finish in, including waiting its turn (None for no deadline)
+    :param failure_threshold: Failed requests in a row before a host's :class:`CircuitBreaker` opens
+    :param failure_cooldown: Seconds before an open :class:`CircuitBreaker` allows a trial request
+    :param cache: Cache for :meth:`fetch` (default: None, don't cache)
+    """
+
+    #: User-Agent header sent with all requests
+    USER_AGENT = 'csbot/0.1'
+
+    def __init__(self, *, loop=None,
+                 limit=100, limit_per_host=8, dns_cache_ttl=300,
+                 connect_timeout=10, read_timeout=30,
+                 max_response_size=10 * 1024 * 1024,
+                 deadline=60, failure_threshold=5, failure_cooldown=60,
+                 cache: HTTPCache = None):
+        self.loop = loop
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_response_size = max_response_size
+        self.deadline = deadline
+        self.cache = cache
+        #: Limits concurrent requests and tracks failing hosts
+        self.scheduler = FetchScheduler(loop=loop, limit=limit, limit_per_host=limit_per_host,
+                                        failure_threshold=failure_threshold, failure_cooldown=failure_cooldown)
+        self._session = None
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """Create a client from the ``http_*`` options of the bot's *config*."""
+        cache = None
+        if config.http_cache_size > 0:
+            disk = None
+            if config.http_cache_dir:
+                disk = DiskStore(config.http_cache_dir, config.http_cache_dir_size)
+            cache = HTTPCache(config.http_cache_size, disk)
+        return cls(cache=cache,
+                   limit=config.http_pool_size,
+                   limit_per_host=config.http_pool_size_per_host,
+                   dns_cache_ttl=config.http_dns_cache_ttl,
+                   connect_timeout=config.http_connect_timeout,
+                   read_timeout=config.http_read_timeout,
+                   max_response_size=config.http_max_response_size,
+                   deadline=config.http_deadline or None,
+                   failure_threshold=config.http_failure_threshold,
+                   failure_cooldown=config.http_failure_cooldown,
+                   **kwargs)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared :class:`aiohttp.ClientSession`, created if necessary."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                ssl=False,
+                loop=self.loop,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={'User-Agent': self.USER_AGENT},
+                loop=self.loop,
+            )
+        return self._session
+
+    @asynccontextmanager
+    async def request(self, method, url, *, deadline=..., **kwargs):
+        """Make an HTTP request, without reading the response body.
+
+        An async context manager which gives an :class:`aiohttp.ClientResponse`;
+        the connection is returned to the pool on exit.  *kwargs* are passed to
+        :meth:`aiohttp.ClientSession.request`.  Use :meth:`read` to get the body
+        with a size limit.
+
+        The request waits for its turn from :attr:`scheduler`, and must be
+        finished (including reading the body) within *deadline* seconds
+        (default: :attr:`deadline`), otherwise :exc:`asyncio.TimeoutError` is
+        raised.  Raises :exc:`CircuitOpen` if requests to the host are being
+        refused because of recent failures.
+        """
+        if deadline is ...:
+            deadline = self.deadline
+        async with self.scheduler.slot(URL(url).host, deadline) as attempt:
+            async with self.session.request(method, url, **kwargs) as resp:
+                attempt.response(resp.status)
+                yield resp
+
+    def get(self, url, **kwargs):
+        """Make an HTTP GET request; see :meth:`request`."""
+        return self.request('GET', url, **kwargs)
+
+    async def read(self, resp: aiohttp.ClientResponse, max_size=None, *, truncate=False) -> bytes:
+        """Read the body of *resp*, up to *max_size* bytes (default:
+        :attr:`max_response_size`).
+
+        The size is checked as the body is streamed, so a large response is
+        never completely read.  If the body is too large, raises
+        :exc:`ResponseTooLarge`, or if *truncate* is True returns the first
+        *max_size* bytes.
+        """
+        if max_size is None:
+            max_size = self.max_response_size
+        if not truncate and resp.content_length is not None and resp.content_length > max_size:
+            raise ResponseTooLarge(f'Content-Length too large: {resp.content_length} bytes, >{max_size}')
+        body = bytearray()
+        async for chunk in resp.content.iter_chunked(max_size):
+            body += chunk
+            if len(body) > max_size:
+                if truncate:
+                    break
+                raise ResponseTooLarge(f'response too large: >{max_size} bytes')
+        return bytes(body[:max_size])
+
+    #: Statuses of responses that can be cached
+    CACHEABLE_STATUSES = {200, 203, 300, 301, 404, 410}
+
+    async def fetch(self, url, *, method='GET', max_size=None, ttl=None, cache=True, **kwargs) -> HTTPResponse:
+        """Make an HTTP request and read the whole response, with a size limit
+        (see :meth:`read`) and deadline (see :meth:`request`).
+
+        GET requests use :attr:`cache`, if there is one, unless *cache* is
+        False.  A cached response is fresh for *ttl* seconds if supplied,
+        otherwise for as long as its ``Cache-Control`` or ``Expires`` header
+        says.  ``Cache-Control: no-store`` responses are never cached.
+
+        Returns an :class:`HTTPResponse`.
+        """
+        if method != 'GET' or not cache or self.cache is None:
+            return await self._fetch(method, url, max_size, **kwargs)
+
+        key = self.cache.key(url, kwargs.get('headers'))
+        now = time.time()
+        entry = await self.cache.get(key)
+        if entry is not None and entry.is_fresh(now):
+            self.cache.stats.hits += 1
+            return entry.response
+
+        if entry is not None and entry.can_revalidate():
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **entry.validators())
+        response = await self._fetch(method, url, max_size, **kwargs)
+
+        if entry is not None and response.status == 304:
+            self.cache.stats.revalidated += 1
+            headers = CIMultiDict(entry.response.headers)
+            for name in set(response.headers):
+                headers.popall(name, None)
+            headers.extend(response.headers)
+            response = attr.evolve(entry.response, headers=headers)
+        else:
+            self.cache.stats.misses += 1
+
+        lifetime = freshness_lifetime(response.headers, now)
+        if ttl is not None and lifetime is not None:
+            lifetime = ttl
+        if lifetime is not None and response.status in self.CACHEABLE_STATUSES:
+            stored = CacheEntry(attr.evolve(response, from_cache=True), now + lifetime)
+            if lifetime > 0 or stored.can_revalidate():
+                await self.cache.put(key, stored)
+                self.cache.stats.stores += 1
+        return response
+
+    async def _fetch(self, method, url, max_size, **kwargs):
+        async with self.request(method, url, **kwargs) as resp:
+            body = await self.read(resp, max_size)
+            return HTTPResponse(url=str(resp.url),
+                                status=resp.status,
+                                reason=resp.reason,
+                                headers=CIMultiDict(resp.headers),
+                                charset=resp.charset,
+                                body=body)
+
+    async def close(self):
+        """Close the session and all pooled connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            # Give SSL connections a moment to close cleanly (see aiohttp docs)
+            await asyncio.sleep(0)
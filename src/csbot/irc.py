@@ -27,12 +27,13 @@ class IRCParseError(Exception):
 
 
 class IRCMessage(namedtuple('_IRCMessage',
-                            'prefix command params command_name raw')):
+                            'prefix command params command_name raw tags')):
     """Represents an IRC message.
 
-    The IRC message format, paraphrased and simplified from RFC2812, is::
+    The IRC message format, paraphrased and simplified from RFC2812 (plus the
+    IRCv3 message tags extension), is::
 
-        message = [":" prefix " "] command {" " parameter} [" :" trailing]
+        message = ["@" tags " "] [":" prefix " "] command {" " parameter} [" :" trailing]
 
     This is represented as a :class:`namedtuple` with the following attributes:
 
@@ -46,6 +47,8 @@ class IRCMessage(namedtuple('_IRCMessage',
     :type command_name: str
     :param raw: The raw IRC message
     :type raw: str
+    :param tags: IRCv3 message tags, or None if the message had no tags
+    :type tags: dict or None
 
     The *command_name* attribute is intended to be the "readable" form of the
     *command*.  Usually it will be the same as *command*, but numeric replies
@@ -53,8 +56,10 @@ class IRCMessage(namedtuple('_IRCMessage',
     """
 
     #: Regular expression to extract message components from a message.
-    REGEX = re.compile(r'(:(?P<prefix>\S+) )?(?P<command>\S+)'
+    REGEX = re.compile(r'(@(?P<tags>\S+) )?(:(?P<prefix>\S+) )?(?P<command>\S+)'
                        r'(?P<params>( (?!:)\S+)*)( :(?P<trailing>.*))?')
+    #: Escape sequences used in IRCv3 message tag values.
+    TAG_ESCAPES = {':': ';', 's': ' ', 'r': '\r', 'n': '\n', '\\': '\\'}
     #: Commands to force trailing parameter (``:blah``) for
     FORCE_TRAILING = {'USER', 'QUIT', 'PRIVMSG'}
 
@@ -78,8 +83,23 @@ class IRCMessage(namedtuple('_IRCMessage',
             # numeric command, or just the received command.
             groups['command_name'] = NUMERIC_REPLIES.get(groups['command'],
                                                          groups['command'])
+            if groups['tags'] is not None:
+                groups['tags'] = cls._parse_tags(groups['tags'])
             return cls(**groups)
 
+    @classmethod
+    def _parse_tags(cls, raw):
+        """Parse the ``key=value;...`` tags section of a message into a dict.
+
+        Tags without a value get an empty string value.
+        """
+        tags = {}
+        for tag in raw.split(';'):
+            key, _, value = tag.partition('=')
+            if key:
+                tags[key] = re.sub(r'\\(.?)', lambda m: cls.TAG_ESCAPES.get(m.group(1), m.group(1)), value)
+        return tags
+
     @classmethod
     def create(cls, command, params=None, prefix=None):
         """Create an :class:`IRCMessage` from its core components.
@@ -100,6 +120,12 @@ class IRCMessage(namedtuple('_IRCMessage',
         }
         return cls(**args)
 
+    def get_tag(self, key, default=None):
+        """Get the value of IRCv3 message tag *key*, or *default* if absent."""
+        if self.tags is None:
+            return default
+        return self.tags.get(key, default)
+
     @property
     def pretty(self):
         """Get a more readable version of the raw IRC message.
@@ -144,6 +170,10 @@ class IRCMessage(namedtuple('_IRCMessage',
         return raw
 
 
+# Messages without IRCv3 tags can be created without specifying *tags*
+IRCMessage.__new__.__defaults__ = (None,)
+
+
 class IRCUser(namedtuple('_IRCUser', 'raw nick user host')):
     """Provide access to the parts of an IRC user string.
 
@@ -0,0 +1,452 @@
+"""A small embedded document store, for running the ``mongodb`` plugin without
+a MongoDB server (``mode = "local"``).
+
+Collections are tables in a SQLite database file, with each document stored
+as JSON, and indexes are SQLite indexes on the indexed fields.  Only the part
+of the pymongo :class:`~pymongo.collection.Collection` API that plugins use is
+implemented:
+
+* :meth:`~LocalCollection.find` (returning a list, with *sort*, *limit* and
+  *skip*), :meth:`~LocalCollection.find_one` and
+  :meth:`~LocalCollection.count_documents`
+* :meth:`~LocalCollection.insert_one`, :meth:`~LocalCollection.insert_many`,
+  :meth:`~LocalCollection.replace_one`, :meth:`~LocalCollection.delete_one`,
+  :meth:`~LocalCollection.delete_many` and :meth:`~LocalCollection.bulk_write`
+* the deprecated :meth:`~LocalCollection.insert`,
+  :meth:`~LocalCollection.remove` and :meth:`~LocalCollection.save`
+* :meth:`~LocalCollection.create_index`, :meth:`~LocalCollection.create_indexes`
+  (including TTL indexes) and :meth:`~LocalCollection.index_information`
+
+Filters can compare fields (including dotted paths) with a value, or use
+``$eq``, ``$ne``, ``$lt``, ``$lte``, ``$gt``, ``$gte``, ``$in``, ``$nin`` and
+``$exists``, combined with ``$and`` and ``$or``.  Unlike MongoDB, comparing an
+array field with a single value doesn't match the array's elements.  As in
+MongoDB, ``$lt``, ``$lte``, ``$gt`` and ``$gte`` only match values of the same
+type as the operand, which must be a number, string, boolean, date or ObjectId.
+Documents can contain the JSON types, :class:`~datetime.datetime` and
+:class:`~bson.objectid.ObjectId`.
+"""
+from contextlib import contextmanager
+import datetime
+import json
+import sqlite3
+import threading
+import time
+
+from bson import ObjectId
+import pymongo
+from pymongo.errors import DuplicateKeyError
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+
+# Strings starting with this character encode a non-JSON value, e.g. "\x1edate:2020-01-01T00:00:00.000000",
+# so that dates still sort correctly in SQLite
+_TAG = '\x1e'
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+#: Seconds between removing expired documents for TTL indexes (as MongoDB does)
+TTL_INTERVAL = 60
+
+
+def encode(value):
+    """Convert *value* to something that can be stored as JSON."""
+    if isinstance(value, str):
+        return _TAG + 'str:' + value if value.startswith(_TAG) else value
+    elif value is None or isinstance(value, (bool, int, float)):
+        return value
+    elif isinstance(value, dict):
+        return {k: encode(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    elif isinstance(value, datetime.datetime):
+        # Like pymongo, timezone-aware datetimes are stored as UTC
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return _TAG + 'date:' + value.strftime(_DATE_FORMAT)
+    elif isinstance(value, ObjectId):
+        return _TAG + 'oid:' + str(value)
+    else:
+        raise TypeError(f'cannot store {type(value).__name__} value: {value!r}')
+
+
+def decode(value):
+    """Reverse :func:`encode`."""
+    if isinstance(value, str):
+        if value.startswith(_TAG):
+            kind, _, data = value[1:].partition(':')
+            if kind == 'date':
+                return datetime.datetime.strptime(data, _DATE_FORMAT)
+            elif kind == 'oid':
+                return ObjectId(data)
+            return data
+        return value
+    elif isinstance(value, dict):
+        return {k: decode(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [decode(v) for v in value]
+    return value
+
+
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _field(key):
+    """SQL expression for the value of *key* in the ``doc`` column."""
+    path = '$.' + '.'.join('"{}"'.format(part.replace('"', '\\"')) for part in key.split('.'))
+    return "json_extract(doc, '{}')".format(path.replace("'", "''"))
+
+
+def _sql_value(value):
+    """Get an SQL expression and parameters for comparing with *value*."""
+    if isinstance(value, (dict, list, tuple)):
+        return 'json(?)', [json.dumps(encode(value))]
+    return '?', [encode(value)]
+
+
+_COMPARISONS = {'$lt': '<', '$lte': '<=', '$gt': '>', '$gte': '>='}
+
+
+def _compile_filter(filter):
+    """Get an SQL condition and parameters for a query *filter*."""
+    clauses, params = [], []
+    for key, value in (filter or {}).items():
+        if key in ('$and', '$or'):
+            parts = [_compile_filter(f) for f in value]
+            joiner = ' AND ' if key == '$and' else ' OR '
+            clauses.append('(' + joiner.join(f'({sql})' for sql, _ in parts) + ')' if parts else '1')
+            for _, p in parts:
+                params.extend(p)
+        elif key.startswith('$'):
+            raise NotImplementedError(f'unsupported query operator: {key}')
+        elif isinstance(value, dict) and value and all(k.startswith('$') for k in value):
+            for op, operand in value.items():
+                sql, p = _compile_operator(key, op, operand)
+                clauses.append(sql)
+                params.extend(p)
+        else:
+            sql, p = _compile_operator(key, '$eq', value)
+            clauses.append(sql)
+            params.extend(p)
+    return ' AND '.join(clauses) or '1', params
+
+
+def _compile_operator(key, op, operand):
+    field = _field(key)
+    if op == '$eq':
+        if operand is None:
+            return f'{field} IS NULL', []
+        if key == '_id':
+            # Use the primary key
+            return '_id = ?', [json.dumps(encode(operand))]
+        sql, params = _sql_value(operand)
+        return f'{field} = {sql}', params
+    elif op == '$ne':
+        sql, params = _compile_operator(key, '$eq', operand)
+        return f'NOT ({sql})' if operand is None else f'({field} IS NULL OR NOT ({sql}))', params
+    elif op in _COMPARISONS:
+        guard, params = _type_guard(key, operand)
+        sql, p = _sql_value(operand)
+        return f'({guard} AND {field} {_COMPARISONS[op]} {sql})', params + p
+    elif op == '$in':
+        parts = [_compile_operator(key, '$eq', v) for v in operand]
+        return '(' + ' OR '.join(sql for sql, _ in parts) + ')' if parts else '0', [p for _, ps in parts for p in ps]
+    elif op == '$nin':
+        sql, params = _compile_operator(key, '$in', operand)
+        return f'NOT {sql}', params
+    elif op == '$exists':
+        path = _field(key).replace('json_extract', 'json_type', 1)
+        return f'{path} IS {"NOT " if operand else ""}NULL', []
+    raise NotImplementedError(f'unsupported query operator: {op}')
+
+
+def _type_guard(key, operand):
+    """Get an SQL condition and parameters for the value of *key* having the
+    same type as *operand*, because SQLite compares values of any types.
+    """
+    field = _field(key)
+    kind = field.replace('json_extract', 'json_type', 1)
+    if isinstance(operand, bool):
+        return f"{kind} IN ('true', 'false')", []
+    elif isinstance(operand, (int, float)):
+        return f"{kind} IN ('integer', 'real')", []
+    elif isinstance(operand, (str, datetime.datetime, ObjectId)):
+        if isinstance(operand, str):
+            # Not a tagged value
+            return f"{kind} = 'text' AND substr({field}, 1, 1) <> ?", [_TAG]
+        encoded = encode(operand)
+        prefix = encoded[:encoded.index(':') + 1]
+        return f"{kind} = 'text' AND substr({field}, 1, {len(prefix)}) = ?", [prefix]
+    raise NotImplementedError(f'unsupported comparison with {type(operand).__name__} value: {operand!r}')
+
+
+def _compile_sort(sort):
+    if not sort:
+        return ''
+    if isinstance(sort, str):
+        sort = [(sort, pymongo.ASCENDING)]
+    return ' ORDER BY ' + ', '.join('{} {}'.format(_field(key), 'DESC' if direction == pymongo.DESCENDING else 'ASC')
+                                    for key, direction in sort)
+
+
+class LocalClient:
+    """A :class:`pymongo.MongoClient` equivalent for a SQLite database at
+    *path*, which can be ``":memory:"``.
+
+    The client can be used from any thread, but runs one operation at a time.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS _indexes '
+                           '(collection TEXT, name TEXT, key TEXT, options TEXT, PRIMARY KEY (collection, name))')
+        self._db = LocalDatabase(self)
+
+    def get_database(self):
+        return self._db
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            else:
+                self._conn.execute('COMMIT')
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+
+class LocalDatabase:
+    """A :class:`pymongo.database.Database` equivalent for a :class:`LocalClient`."""
+    def __init__(self, client):
+        self.client = client
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = LocalCollection(self.client, name)
+        return self._collections[name]
+
+
+class LocalCollection:
+    """A :class:`pymongo.collection.Collection` equivalent; see the module
+    documentation for what's supported.
+    """
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._table = _quote(name)
+        self._ttl_checked = 0
+        self.client._execute(f'CREATE TABLE IF NOT EXISTS {self._table} (_id TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+
+    def __repr__(self):
+        return f'LocalCollection({self.client.path!r}, {self.name!r})'
+
+    # Queries
+
+    def find(self, filter=None, projection=None, skip=0, limit=0, sort=None) -> list:
+        """Get the documents matching *filter*, as a list."""
+        if projection is not None:
+            raise NotImplementedError('projections are not supported')
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+        self._expire()
+        where, params = _compile_filter(filter)
+        sql = f'SELECT doc FROM {self._table} WHERE {where}{_compile_sort(sort)}'
+        if limit or skip:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [limit or -1, skip]
+        return [decode(json.loads(doc)) for doc, in self.client._execute(sql, params)]
+
+    def find_one(self, filter=None, *args, **kwargs):
+        kwargs['limit'] = 1
+        docs = self.find(filter, *args, **kwargs)
+        return docs[0] if docs else None
+
+    def count_documents(self, filter, limit=0, skip=0):
+        self._expire()
+        where, params = _compile_filter(filter)
+        sql = f'SELECT _id FROM {self._table} WHERE {where}'
+        if limit or skip:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [limit or -1, skip]
+        return self.client._execute(f'SELECT COUNT(*) FROM ({sql})', params)[0][0]
+
+    def explain(self, filter=None, sort=None):
+        """Get SQLite's query plan for a :meth:`find`, e.g. to see if an index
+        is used.
+        """
+        where, params = _compile_filter(filter)
+        rows = self.client._execute(
+            f'EXPLAIN QUERY PLAN SELECT doc FROM {self._table} WHERE {where}{_compile_sort(sort)}', params)
+        return '\n'.join(row[-1] for row in rows)
+
+    # Writes
+
+    def _insert(self, conn, document):
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        try:
+            conn.execute(f'INSERT INTO {self._table} (_id, doc) VALUES (?, ?)',
+                         (json.dumps(encode(document['_id'])), json.dumps(encode(document))))
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f'duplicate key: {document["_id"]!r}') from e
+        return document['_id']
+
+    def insert_one(self, document):
+        """Insert *document*, adding an ``_id`` if it doesn't have one."""
+        with self.client._transaction() as conn:
+            return InsertOneResult(self._insert(conn, document), True)
+
+    def insert_many(self, documents):
+        with self.client._transaction() as conn:
+            return InsertManyResult([self._insert(conn, d) for d in documents], True)
+
+    def _replace(self, conn, filter, replacement, upsert):
+        where, params = _compile_filter(filter)
+        row = conn.execute(f'SELECT _id FROM {self._table} WHERE {where} LIMIT 1', params).fetchone()
+        if row is not None:
+            replacement['_id'] = decode(json.loads(row[0]))
+            try:
+                conn.execute(f'UPDATE {self._table} SET doc = ? WHERE _id = ?',
+                             (json.dumps(encode(replacement)), row[0]))
+            except sqlite3.IntegrityError as e:
+                raise DuplicateKeyError(f'duplicate key: {replacement!r}') from e
+            return {'n': 1, 'nModified': 1}
+        elif upsert:
+            if '_id' not in replacement and '_id' in (filter or {}):
+                replacement['_id'] = filter['_id']
+            return {'n': 1, 'nModified': 0, 'upserted': self._insert(conn, replacement)}
+        else:
+            return {'n': 0, 'nModified': 0}
+
+    def replace_one(self, filter, replacement, upsert=False):
+        """Replace the first document matching *filter*, or insert
+        *replacement* if none do and *upsert* is True.
+        """
+        with self.client._transaction() as conn:
+            return UpdateResult(self._replace(conn, filter, replacement, upsert), True)
+
+    def _delete(self, conn, filter, limit):
+        where, params = _compile_filter(filter)
+        return conn.execute(f'DELETE FROM {self._table} WHERE _id IN '
+                            f'(SELECT _id FROM {self._table} WHERE {where} LIMIT ?)', params + [limit]).rowcount
+
+    def delete_one(self, filter):
+        with self.client._transaction() as conn:
+            return DeleteResult({'n': self._delete(conn, filter, 1)}, True)
+
+    def delete_many(self, filter):
+        with self.client._transaction() as conn:
+            return DeleteResult({'n': self._delete(conn, filter, -1)}, True)
+
+    def bulk_write(self, requests, ordered=True):
+        """Apply a list of :class:`~pymongo.InsertOne`,
+        :class:`~pymongo.ReplaceOne`, :class:`~pymongo.DeleteOne` and
+        :class:`~pymongo.DeleteMany` in one transaction.  (If any of them
+        fails, none are applied, regardless of *ordered*.)
+        """
+        result = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        with self.client._transaction() as conn:
+            for i, request in enumerate(requests):
+                # pymongo's operation classes don't have public attributes
+                if isinstance(request, pymongo.InsertOne):
+                    self._insert(conn, request._doc)
+                    result['nInserted'] += 1
+                elif isinstance(request, pymongo.ReplaceOne):
+                    raw = self._replace(conn, request._filter, request._doc, request._upsert)
+                    if 'upserted' in raw:
+                        result['nUpserted'] += 1
+                        result['upserted'].append({'index': i, '_id': raw['upserted']})
+                    else:
+                        result['nMatched'] += raw['n']
+                        result['nModified'] += raw['nModified']
+                elif isinstance(request, (pymongo.DeleteOne, pymongo.DeleteMany)):
+                    limit = 1 if isinstance(request, pymongo.DeleteOne) else -1
+                    result['nRemoved'] += self._delete(conn, request._filter, limit)
+                else:
+                    raise NotImplementedError(f'unsupported bulk write operation: {request!r}')
+        return BulkWriteResult(result, True)
+
+    def drop(self):
+        with self.client._transaction() as conn:
+            conn.execute(f'DELETE FROM {self._table}')
+            for name, in conn.execute('SELECT name FROM _indexes WHERE collection = ?', (self.name,)).fetchall():
+                conn.execute('DROP INDEX IF EXISTS {}'.format(_quote(f'{self.name}.{name}')))
+            conn.execute('DELETE FROM _indexes WHERE collection = ?', (self.name,))
+
+    # Deprecated pymongo methods
+
+    def insert(self, doc_or_docs):
+        if isinstance(doc_or_docs, dict):
+            return self.insert_one(doc_or_docs).inserted_id
+        return self.insert_many(doc_or_docs).inserted_ids
+
+    def remove(self, spec_or_id=None):
+        if spec_or_id is not None and not isinstance(spec_or_id, dict):
+            spec_or_id = {'_id': spec_or_id}
+        return {'n': self.delete_many(spec_or_id).deleted_count, 'ok': 1.0}
+
+    def save(self, document):
+        if '_id' in document:
+            self.replace_one({'_id': document['_id']}, document, upsert=True)
+        else:
+            self.insert_one(document)
+        return document['_id']
+
+    # Indexes
+
+    def create_indexes(self, indexes):
+        """Create indexes from a list of :class:`pymongo.IndexModel`.  Of the
+        index options, only ``unique`` and ``expireAfterSeconds`` (for TTL
+        indexes) are supported.
+        """
+        names = []
+        with self.client._transaction() as conn:
+            for index in indexes:
+                options = dict(index.document)
+                key = list(options.pop('key').items())
+                name = options.pop('name')
+                unique = options.get('unique', False)
+                columns = ', '.join('{} {}'.format(_field(k), 'DESC' if d == pymongo.DESCENDING else 'ASC')
+                                    for k, d in key)
+                conn.execute('CREATE {}INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                    'UNIQUE ' if unique else '', _quote(f'{self.name}.{name}'), self._table, columns))
+                conn.execute('INSERT OR REPLACE INTO _indexes VALUES (?, ?, ?, ?)',
+                             (self.name, name, json.dumps(key), json.dumps(options)))
+                names.append(name)
+        self._ttl_checked = 0
+        return names
+
+    def create_index(self, keys, **kwargs):
+        return self.create_indexes([pymongo.IndexModel(keys, **kwargs)])[0]
+
+    def index_information(self):
+        info = {'_id_': {'key': [('_id', 1)]}}
+        for name, key, options in self.client._execute(
+                'SELECT name, key, options FROM _indexes WHERE collection = ?', (self.name,)):
+            info[name] = dict(json.loads(options), key=[tuple(k) for k in json.loads(key)])
+        return info
+
+    def _expire(self):
+        """Remove documents that have expired according to TTL indexes."""
+        now = time.monotonic()
+        if self._ttl_checked and now - self._ttl_checked < TTL_INTERVAL:
+            return
+        self._ttl_checked = now
+        for index in self.index_information().values():
+            if 'expireAfterSeconds' in index:
+                cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=index['expireAfterSeconds'])
+                self.delete_many({index['key'][0][0]: {'$lt': cutoff}})
@@ -0,0 +1,205 @@
+"""Describe image and video files from the first few bytes.
+
+Only the container header is parsed, so the whole file never needs to be
+downloaded: :func:`parse_header` gets the format and, where the header has
+them, the dimensions (PNG, GIF, JPEG, WebP) or duration (MP4 and QuickTime).
+The header of an MP4 file isn't always at the start; if not,
+:attr:`MediaInfo.more_at` says where it is, and :func:`parse_isobmff` can
+parse the bytes from there.
+"""
+import struct
+from typing import Optional
+
+import attr
+
+
+@attr.s(slots=True)
+class MediaInfo:
+    """What :func:`parse_header` found out about a file."""
+    #: Format name, e.g. ``"PNG"``
+    format: str = attr.ib()
+    #: ``"image"`` or ``"video"``
+    kind: str = attr.ib()
+    width: Optional[int] = attr.ib(default=None)
+    height: Optional[int] = attr.ib(default=None)
+    #: Duration in seconds
+    duration: Optional[float] = attr.ib(default=None)
+    #: File offset of the rest of the header, if it wasn't all in the data
+    more_at: Optional[int] = attr.ib(default=None)
+
+    def __str__(self):
+        return self.describe()
+
+    def describe(self, size=None):
+        """Describe the file, e.g. ``"MP4 video (3:25, 1280x720, 45.2 MiB)"``,
+        including its *size* in bytes if known.
+        """
+        details = []
+        if self.duration is not None:
+            details.append(format_duration(self.duration))
+        if self.width and self.height:
+            details.append(f'{self.width}x{self.height}')
+        if size is not None:
+            details.append(format_size(size))
+        return f'{self.format} {self.kind}' + (' ({})'.format(', '.join(details)) if details else '')
+
+
+def format_duration(seconds):
+    """Format *seconds* as ``m:ss`` or ``h:mm:ss``."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f'{hours}:{minutes:02}:{seconds:02}'
+    return f'{minutes}:{seconds:02}'
+
+
+def format_size(size):
+    """Format a number of bytes, e.g. ``"1.5 MiB"``."""
+    for unit in ('bytes', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024
+    return f'{size} {unit}' if unit == 'bytes' else f'{size:.1f} {unit}'
+
+
+def parse_header(data: bytes) -> Optional[MediaInfo]:
+    """Identify the file that starts with *data*.  Returns None if the format
+    isn't recognised.
+    """
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return _parse_png(data)
+    elif data[:6] in (b'GIF87a', b'GIF89a'):
+        return _parse_gif(data)
+    elif data.startswith(b'\xff\xd8'):
+        return _parse_jpeg(data)
+    elif data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _parse_webp(data)
+    elif data[4:8] == b'ftyp':
+        brand = data[8:12]
+        info = MediaInfo('QuickTime' if brand == b'qt  ' else 'MP4', 'video')
+        return parse_isobmff(data, 0, info)
+    return None
+
+
+def _parse_png(data):
+    info = MediaInfo('PNG', 'image')
+    # The first chunk is always IHDR, which starts with the dimensions
+    if data[12:16] == b'IHDR' and len(data) >= 24:
+        info.width, info.height = struct.unpack('>II', data[16:24])
+    return info
+
+
+def _parse_gif(data):
+    info = MediaInfo('GIF', 'image')
+    if len(data) >= 10:
+        info.width, info.height = struct.unpack('<HH', data[6:10])
+    return info
+
+
+#: JPEG "start of frame" markers, which contain the dimensions
+_JPEG_SOF = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+
+
+def _parse_jpeg(data):
+    info = MediaInfo('JPEG', 'image')
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xff:
+            break
+        marker = data[i + 1]
+        if marker == 0xff:
+            # Padding
+            i += 1
+            continue
+        if marker in _JPEG_SOF:
+            if i + 9 <= len(data):
+                info.height, info.width = struct.unpack('>HH', data[i + 5:i + 9])
+            break
+        if marker == 0xd9 or marker == 0xda:
+            # End of image, or start of scan without a frame header
+            break
+        # Skip over the segment, which includes its own length
+        i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+    return info
+
+
+def _parse_webp(data):
+    info = MediaInfo('WebP', 'image')
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack('<HH', data[26:30])
+        info.width, info.height = width & 0x3fff, height & 0x3fff
+    elif chunk == b'VP8L' and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], 'little')
+        info.width, info.height = (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    elif chunk == b'VP8X' and len(data) >= 30:
+        info.width = int.from_bytes(data[24:27], 'little') + 1
+        info.height = int.from_bytes(data[27:30], 'little') + 1
+    return info
+
+
+def _boxes(data, start=0, end=None):
+    """Iterate over ``(type, offset of contents, offset of end)`` for the
+    ISO base media file format boxes in *data*, stopping at a box that doesn't
+    have a valid header.  Box ends may be beyond the end of *data*.
+    """
+    if end is None:
+        end = len(data)
+    i = start
+    while i + 8 <= end:
+        size, type = struct.unpack('>I4s', data[i:i + 8])
+        header = 8
+        if size == 1:
+            if i + 16 > end:
+                return
+            size = struct.unpack('>Q', data[i + 8:i + 16])[0]
+            header = 16
+        elif size == 0:
+            # Box extends to the end of the file
+            size = float('inf')
+        if size < header:
+            return
+        yield type, i + header, i + size
+        i += size
+
+
+def parse_isobmff(data: bytes, offset: int, info: MediaInfo) -> MediaInfo:
+    """Parse MP4/QuickTime boxes in *data*, which starts at *offset* in the file,
+    looking for the ``moov`` box with the duration and video dimensions.
+
+    Updates and returns *info*.  If ``moov`` isn't in *data*, but another box
+    ends before the end of the file, :attr:`MediaInfo.more_at` is set to the
+    offset of the box after it.
+    """
+    info.more_at = None
+    for type, start, end in _boxes(data):
+        if type == b'moov':
+            _parse_moov(data, start, min(end, len(data)), info)
+            return info
+        if end > len(data):
+            if end != float('inf'):
+                info.more_at = offset + end
+            break
+    return info
+
+
+def _parse_moov(data, start, end, info):
+    for type, child_start, child_end in _boxes(data, start, end):
+        child_end = min(child_end, end)
+        if type == b'mvhd' and child_start + 4 <= child_end:
+            version = data[child_start]
+            if version == 1 and child_start + 32 <= child_end:
+                timescale, duration = struct.unpack('>IQ', data[child_start + 20:child_start + 32])
+            elif version == 0 and child_start + 20 <= child_end:
+                timescale, duration = struct.unpack('>II', data[child_start + 12:child_start + 20])
+            else:
+                continue
+            if timescale:
+                info.duration = duration / timescale
+        elif type == b'trak' and info.width is None:
+            for trak_type, tkhd_start, tkhd_end in _boxes(data, child_start, child_end):
+                if trak_type == b'tkhd' and tkhd_end <= child_end:
+                    # Width and height are the last 8 bytes, as 16.16 fixed point
+                    width, height = struct.unpack('>II', data[tkhd_end - 8:tkhd_end])
+                    if width and height:
+                        info.width, info.height = width >> 16, height >> 16
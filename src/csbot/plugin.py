@@ -1,9 +1,13 @@
 import collections
 from collections import abc
-from functools import partial
+from functools import partial, reduce
+import asyncio
+import importlib
 import itertools
 import logging
 import os
+import sys
+import time
 from typing import (
     Any,
     Callable,
@@ -20,17 +24,46 @@ import attr
 import straight.plugin
 
 from . import config
-from .util import topological_sort
+from .util import topological_sort, maybe_future_result
+
+
+LOG = logging.getLogger(__name__)
+
+#: Entry point group that plugins are registered under.
+PLUGIN_ENTRY_POINT_GROUP = 'csbot.plugins'
 
 
 def find_plugins():
     """Find available plugins.
 
-    Returns a list of discovered plugin classes.
+    Returns a list of discovered plugin classes.  This imports every plugin
+    module, so prefer :func:`find_plugin_registry` when only some plugins are
+    needed.
     """
     return list(straight.plugin.load('csbot.plugins', subclasses=Plugin))
 
 
+def find_plugin_registry(group=PLUGIN_ENTRY_POINT_GROUP):
+    """Find available plugins without importing them.
+
+    Returns a :class:`PluginRegistry` built from the *group* entry points.  If
+    there are no entry points (e.g. csbot isn't installed), falls back to
+    :func:`find_plugins`.
+    """
+    import pkg_resources
+    entries = {}
+    for entry_point in pkg_resources.iter_entry_points(group):
+        target = f"{entry_point.module_name}:{'.'.join(entry_point.attrs)}"
+        if entry_point.name in entries:
+            raise PluginDuplicate(entry_point.name, target, entries[entry_point.name])
+        entries[entry_point.name] = target
+
+    if len(entries) == 0:
+        LOG.warning(f"no '{group}' entry points found, importing all plugins")
+        return PluginRegistry.from_classes(find_plugins())
+    return PluginRegistry(entries)
+
+
 def build_plugin_dict(plugins):
     """Build a dictionary mapping the value of :meth:`~Plugin.plugin_name` to
     each plugin class in *plugins*.  :exc:`PluginDuplicate` is raised if more
@@ -47,6 +80,92 @@ def build_plugin_dict(plugins):
     return mapping
 
 
+def reload_plugin_class(available, name):
+    """Re-import plugin *name* from *available*, returning the new plugin class.
+
+    Uses ``available.reload(name)`` if it exists (e.g.
+    :meth:`PluginRegistry.reload`), otherwise reloads the module that the
+    current plugin class is defined in.
+    """
+    if hasattr(available, 'reload'):
+        return available.reload(name)
+    old_cls = available[name]
+    module = importlib.reload(sys.modules[old_cls.__module__])
+    return reduce(getattr, old_cls.__qualname__.split('.'), module)
+
+
+class PluginRegistry(abc.Mapping):
+    """A mapping of plugin name to plugin class which only imports a plugin
+    when its class is first accessed.
+
+    *entries* maps each plugin name to a ``module:Class`` string.  The time
+    taken to import each plugin is logged and recorded in
+    :attr:`import_times`; this includes any dependencies imported for the first
+    time by the plugin's module.
+    """
+
+    #: Plugin name to ``module:Class`` string.
+    entries: Mapping[str, str]
+    #: Plugin name to time (in seconds) taken to import the plugin.
+    import_times: MutableMapping[str, float]
+
+    def __init__(self, entries):
+        self.entries = dict(entries)
+        self.import_times = {}
+        self._classes = {}
+
+    @classmethod
+    def from_classes(cls, plugins):
+        """Create a registry of already-imported plugin classes."""
+        classes = build_plugin_dict(plugins)
+        registry = cls({name: f'{P.__module__}:{P.__qualname__}' for name, P in classes.items()})
+        registry._classes.update(classes)
+        return registry
+
+    def qualified_name(self, name):
+        """Get the fully qualified class name of plugin *name* without importing it."""
+        return self.entries[name].replace(':', '.')
+
+    def reload(self, name):
+        """Re-import the module for plugin *name*, returning the new plugin class.
+        """
+        self._classes[name] = self._import(name, reload=True)
+        return self._classes[name]
+
+    def _import(self, name, reload=False):
+        module_name, _, attr_path = self.entries[name].partition(':')
+        start = time.perf_counter()
+        if reload and module_name in sys.modules:
+            module = importlib.reload(sys.modules[module_name])
+        else:
+            module = importlib.import_module(module_name)
+        P = reduce(getattr, attr_path.split('.'), module)
+        elapsed = time.perf_counter() - start
+        self.import_times[name] = elapsed
+        LOG.info(f"plugin imported: {name} ({self.entries[name]}) in {elapsed * 1000:.1f}ms")
+        if P.plugin_name() != name:
+            raise PluginFeatureError(f"plugin {self.entries[name]} registered as '{name}' "
+                                     f"but named '{P.plugin_name()}'")
+        return P
+
+    # Implement abstract "read-only" Mapping interface
+
+    def __getitem__(self, name):
+        if name not in self._classes:
+            self._classes[name] = self._import(name)
+        return self._classes[name]
+
+    def __contains__(self, name):
+        # Overridden so that checking for a plugin doesn't import it
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+
 class LazyMethod:
     def __init__(self, obj, name):
         self.obj = obj
@@ -72,6 +191,22 @@ class PluginConfigError(Exception):
     pass
 
 
+class ConfigTable(dict):
+    """Resolved configuration values, keyed by ``(subsection, key)``.
+
+    The plugin's own section is subsection ``None``.  Looking up a key in a
+    subsection that doesn't exist gives the value from the plugin's own
+    section, and :exc:`KeyError` is raised if that doesn't exist either.
+
+    See :meth:`Plugin.build_config_table`.
+    """
+    def __missing__(self, key):
+        subsection, name = key
+        if subsection is None:
+            raise KeyError(key)
+        return self[None, name]
+
+
 class PluginManager(abc.Mapping):
     """A simple plugin manager and proxy.
 
@@ -86,6 +221,11 @@ class PluginManager(abc.Mapping):
     state.  A plugin class' dependencies are checked before loading and a
     :exc:`PluginDependencyUnmet` is raised if any are missing.
 
+    :meth:`setup` and :meth:`teardown` run the corresponding plugin methods one
+    dependency level at a time, with the plugins in each level run concurrently.
+    :meth:`reload` replaces a plugin (and the plugins that rely on it) with
+    a freshly imported version while everything else keeps running.
+
     The :class:`~collections.abc.Mapping` interface is implemented to provide easy
     querying and access to the loaded plugins.  All attributes that do not
     start with a ``_`` are treated as methods that will be proxied through to
@@ -99,10 +239,15 @@ class PluginManager(abc.Mapping):
     def __init__(self, loaded, available, plugins, args):
         self.log = logging.getLogger(__name__)
         self.plugins = collections.OrderedDict()
+        self._available = available
+        self._args = args
+        # Plugins with hooks for each event type, built as needed
+        self._hook_table = {}
 
         # Register already-loaded plugins
         for p in loaded:
             self.plugins[p.plugin_name()] = p
+        self._preloaded = set(self.plugins.keys())
 
         # All known plugins that should be loaded eventually, including those pre-loaded
         known = set(self.plugins.keys())
@@ -139,6 +284,159 @@ class PluginManager(abc.Mapping):
             self.plugins[p] = cls(*args)
             self.log.info(f"plugin loaded: {p}")
 
+        self._update_levels()
+
+    def _update_levels(self):
+        """Group plugin names by dependency level, each level in load order."""
+        dependencies = {p: type(plugin)._Plugin__plugin_data.dependencies for p, plugin in self.plugins.items()}
+        self._levels = [[p for p in self.plugins if p in level] for level in topological_sort(dependencies)]
+
+    async def setup(self):
+        """Run :meth:`Plugin.setup` for all plugins.
+
+        A plugin is only set up after all of its dependencies have been set up.
+        If a plugin's setup fails, the plugins that were set up are torn down
+        again before the exception is raised.
+        """
+        done = []
+        for level in self._levels:
+            results = await asyncio.gather(*(self._call_plugin(p, 'setup') for p in level), return_exceptions=True)
+            done.append([p for p, r in zip(level, results) if not isinstance(r, BaseException)])
+            errors = [r for r in results if isinstance(r, BaseException)]
+            if errors:
+                await self._undo_setup(done)
+                raise errors[0]
+
+    async def _undo_setup(self, levels):
+        """Tear down the plugins in *levels* after a failed setup, logging (rather
+        than raising) any errors so that the original error is reported.
+        """
+        for level in reversed(levels):
+            results = await asyncio.gather(*(self._call_plugin(p, 'teardown') for p in level), return_exceptions=True)
+            for p, r in zip(level, results):
+                if isinstance(r, Exception):
+                    self.log.error(f"error tearing down plugin after failed setup: {p}", exc_info=r)
+
+    async def teardown(self):
+        """Run :meth:`Plugin.teardown` for all plugins.
+
+        A plugin is only torn down after all plugins that depend on it have been
+        torn down.
+        """
+        for level in reversed(self._levels):
+            await asyncio.gather(*(self._call_plugin(p, 'teardown') for p in level))
+
+    async def reconfigure(self, configs):
+        """Replace the configuration of the plugins in *configs*, a mapping of
+        plugin name to new :attr:`Plugin.config` value, and run their
+        :meth:`Plugin.reconfigure` methods.
+
+        Plugins are reconfigured one dependency level at a time, like :meth:`setup`.
+        """
+        for level in self._levels:
+            await asyncio.gather(*(self._reconfigure_plugin(p, configs[p]) for p in level if p in configs))
+
+    async def _reconfigure_plugin(self, name, new):
+        self.log.debug(f"plugin reconfigure: {name}")
+        plugin = self.plugins[name]
+        old = plugin._replace_config(new)
+        await maybe_future_result(plugin.reconfigure(old, new), log=self.log)
+        self.log.info(f"plugin reconfigured: {name}")
+
+    async def _call_plugin(self, name, method):
+        self.log.debug(f"plugin {method}: {name}")
+        await maybe_future_result(getattr(self.plugins[name], method)(), log=self.log)
+
+    async def reload(self, name):
+        """Reload plugin *name* from a freshly imported module.
+
+        Plugins that depend on or integrate with *name*, directly or
+        indirectly, are re-created from their existing classes.  The old
+        instances are torn down (dependents first) and the new instances are
+        set up (dependencies first), moving the attributes named in
+        :attr:`Plugin.PLUGIN_STATE` to each new instance after its setup.  If
+        creating or setting up a new instance fails, the plugins are re-created
+        from their previous classes and the exception is raised.
+
+        Returns the names of all re-created plugins, in load order.
+        """
+        if name not in self.plugins:
+            raise PluginFeatureError(f"plugin not loaded: {name}")
+        if name in self._preloaded:
+            raise PluginFeatureError(f"cannot reload plugin: {name}")
+
+        # Import before tearing anything down, so a broken module leaves the old plugin running
+        cls = reload_plugin_class(self._available, name)
+        missing = cls.missing_dependencies(self.plugins)
+        if len(missing) > 0:
+            raise PluginDependencyUnmet(f"{name} has unmet dependencies: {', '.join(missing)}")
+
+        affected = self._get_dependents(name)
+        old = {p: self.plugins[p] for p in affected}
+        for p in reversed(affected):
+            await self._call_plugin(p, 'teardown')
+
+        done = []
+        try:
+            await self._replace_plugins(old, {name: cls}, done)
+        except Exception:
+            # Put back plugins like the old ones, so the bot keeps working
+            self.log.exception(f"plugin reload failed, restoring: {', '.join(affected)}")
+            await self._undo_setup([[p] for p in done])
+            await self._replace_plugins(old, {}, [])
+            raise
+        for p in affected:
+            self.log.info(f"plugin reloaded: {p}")
+
+        return affected
+
+    async def _replace_plugins(self, old, classes, done):
+        """Replace the plugins in *old* with new instances, of the class in
+        *classes* or otherwise the same class, and set them up, moving their
+        :attr:`Plugin.PLUGIN_STATE`.  The names of the plugins set up are
+        added to *done*.
+        """
+        for p, plugin in old.items():
+            self.plugins[p] = classes.get(p, type(plugin))(*self._args)
+        self._hook_table.clear()
+        self._update_levels()
+
+        for p, plugin in old.items():
+            await self._call_plugin(p, 'setup')
+            done.append(p)
+            new = self.plugins[p]
+            for attribute in new.PLUGIN_STATE:
+                if hasattr(plugin, attribute):
+                    setattr(new, attribute, getattr(plugin, attribute))
+
+    def _get_dependents(self, name):
+        """Get *name* and the plugins that depend on or integrate with it, directly
+        or indirectly, in load order.
+        """
+        affected = {name}
+        changed = True
+        while changed:
+            changed = False
+            for p, plugin in self.plugins.items():
+                data = type(plugin)._Plugin__plugin_data
+                related = set(data.dependencies)
+                for others, _ in data.integrations:
+                    related.update(others)
+                if p not in affected and related & affected:
+                    affected.add(p)
+                    changed = True
+        return [p for p in self.plugins if p in affected]
+
+    def get_hooks(self, hook):
+        """Get the handlers for *hook*, as a list of lists of each plugin's handlers.
+
+        Plugins without handlers for *hook* are skipped.
+        """
+        plugins = self._hook_table.get(hook)
+        if plugins is None:
+            plugins = self._hook_table[hook] = [p for p in self.plugins.values() if p.get_hooks(hook)]
+        return [p.get_hooks(hook) for p in plugins]
+
     def __getattr__(self, name):
         """Treat all undefined public attributes as proxy methods.
 
@@ -286,6 +584,9 @@ class Plugin(object, metaclass=PluginMeta):
     CONFIG_ENVVARS: Mapping[str, Sequence[str]] = {}
     #: Plugins that :meth:`missing_dependencies` should check for.
     PLUGIN_DEPENDS: Sequence[str] = []
+    #: Attributes to move to the new instance when the plugin is reloaded (see
+    #: :meth:`PluginManager.reload`).
+    PLUGIN_STATE: Sequence[str] = []
 
     #: The plugin's logger, created by default using the plugin class'
     #: containing module name as the logger name.
@@ -299,7 +600,7 @@ class Plugin(object, metaclass=PluginMeta):
         # 'csbot.plugin' instead.
         self.log = logging.getLogger(self.__class__.__module__)
         self.bot = bot
-        self.__config = self._get_config(bot)
+        self.__config = self._get_config(bot.config_root)
 
     @classmethod
     def plugin_name(cls):
@@ -389,6 +690,11 @@ class Plugin(object, metaclass=PluginMeta):
         * Replace all :class:`ProvidedByPlugin` attributes.
         * Fire all plugin integration methods.
         * Register all commands provided by the plugin.
+
+        Subclasses can override this with an ``async def setup(self)`` if setup
+        needs to wait for something; the ``super().setup()`` call is still a
+        normal method call.  Plugins with the same dependency level are set up
+        concurrently.
         """
         # Preserve old behaviour of provide() being called during setup()
         for descriptor in self.__plugin_data.uses:
@@ -413,15 +719,44 @@ class Plugin(object, metaclass=PluginMeta):
         """Plugin teardown.
 
         * Unregister all commands provided by the plugin.
+
+        Like :meth:`setup`, this can be overridden with a coroutine function.
         """
         self.bot.unregister_commands(tag=self)
 
+    def reconfigure(self, old, new):
+        """Handle a change to the plugin's configuration.
+
+        Called by :meth:`PluginManager.reconfigure` when the plugin's sections of
+        the configuration have changed, after :attr:`config` has been replaced.
+        *old* and *new* are the previous and current values of :attr:`config`.
+        The default implementation does nothing, which is fine for plugins that
+        read :attr:`config` whenever they need it; plugins that build things
+        from their configuration during :meth:`setup` should rebuild them here.
+
+        Like :meth:`setup`, this can be overridden with a coroutine function.
+        """
+        pass
+
+    def _replace_config(self, new):
+        """Replace :attr:`config` with *new*, returning the old value."""
+        old = self.config
+        self.__config = new
+        return old
+
     @classmethod
-    def _get_config(cls, bot):
+    def _config_sections(cls, config_root):
+        """Get the ``[plugin_name]`` and ``[plugin_name/subsection]`` sections from *config_root*."""
+        plugin = cls.plugin_name()
+        return {section: values for section, values in config_root.items()
+                if section == plugin or section.startswith(plugin + '/')}
+
+    @classmethod
+    def _get_config(cls, config_root):
         # Get dict-like access to config
         plugin = cls.plugin_name()
-        if plugin in bot.config_root:
-            cfg = bot.config_root[plugin]
+        if plugin in config_root:
+            cfg = config_root[plugin]
         else:
             cfg = {}
 
@@ -445,7 +780,7 @@ class Plugin(object, metaclass=PluginMeta):
         .. seealso:: :mod:`configparser`
         """
         if self.__config is None:
-            self.__config = self._get_config(self.bot)
+            self.__config = self._get_config(self.bot.config_root)
         return self.__config
 
     def subconfig(self, subsection):
@@ -488,6 +823,36 @@ class Plugin(object, metaclass=PluginMeta):
         # Fallback which will raise KeyError if they key wasn't found anywhere
         return self.CONFIG_DEFAULTS[key]
 
+    def build_config_table(self):
+        """Flatten the plugin's configuration into a :class:`ConfigTable`.
+
+        Each value is resolved as :meth:`config_get` would, and each
+        ``[plugin_name/subsection]`` section gets a value for every key, so
+        that a lookup is a single dictionary access.  Changes to the
+        configuration or environment after this is called are not seen by the
+        table.
+        """
+        keys = set(self.CONFIG_DEFAULTS) | set(self.CONFIG_ENVVARS) | set(self.config)
+        table = ConfigTable()
+        for key in keys:
+            try:
+                # Not self.config_get(), which plugins may override to use the table
+                table[None, key] = Plugin.config_get(self, key)
+            except KeyError:
+                pass
+
+        prefix = self.plugin_name() + '/'
+        for section, values in self.bot.config_root.items():
+            if not section.startswith(prefix):
+                continue
+            subsection = section[len(prefix):]
+            for key in keys | set(values):
+                if key in values:
+                    table[subsection, key] = values[key]
+                elif (None, key) in table:
+                    table[subsection, key] = table[None, key]
+        return table
+
     def config_getboolean(self, key):
         """Identical to :meth:`config_get`, but proxying ``getboolean``.
         """
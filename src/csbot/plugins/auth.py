@@ -94,13 +94,19 @@ class Auth(Plugin):
 
     def setup(self):
         super(Auth, self).setup()
+        self._permissions = self._build_permissions(self.config)
 
-        self._permissions = PermissionDB()
-        for entity, permissions in self.config.items():
-            self._permissions.process(entity, permissions)
+    def reconfigure(self, old, new):
+        self._permissions = self._build_permissions(new)
 
-        for e, p in self._permissions.items():
+    def _build_permissions(self, config):
+        permissions = PermissionDB()
+        for entity, entity_permissions in config.items():
+            permissions.process(entity, entity_permissions)
+
+        for e, p in permissions.items():
             self.log.debug((e, p))
+        return permissions
 
     def check(self, nick, perm, channel=None):
         account = self.bot.plugins['usertrack'].get_user(nick)['account']
@@ -1,8 +1,13 @@
 from csbot.plugin import Plugin
 from csbot.events import Event
-import asyncio
+from csbot.util import maybe_future_result
 from datetime import datetime, timedelta
+import asyncio
+import enum
+import heapq
+import itertools
 import pymongo
+from bson import ObjectId
 
 
 class Cron(Plugin):
@@ -17,14 +22,20 @@ class Cron(Plugin):
     if you schedule multiple events at the same time, don't make any
     assumptions about the order in which they'll be called.
 
+    Callbacks can be coroutines.  Each due task runs in its own asyncio task,
+    so a slow callback doesn't hold up the others, but at most
+    ``max_concurrent_tasks`` run at once.  If a repeating task is overdue by
+    more than its interval, e.g. because the bot wasn't running, its
+    :class:`Misfire` policy says what to do about the missed occurrences.
+
     Example of usage:
 
         class MyPlugin(Plugin):
             cron = Plugin.use('cron')
 
-            def setup(self):
+            async def setup(self):
                 ...
-                self.cron.after(
+                await self.cron.after(
                     "hello world",
                     datetime.timedelta(days=1),
                     "callback")
@@ -36,18 +47,43 @@ class Cron(Plugin):
             def hourlyevent(self, e):
                 self.log.info(u'An hour has passed')
     """
-    tasks = Plugin.use('mongodb', collection='tasks')
+    CONFIG_DEFAULTS = {
+        'max_concurrent_tasks': 4,
+    }
+
+    tasks = Plugin.use('mongodb', collection='tasks', indexes=[
+        # For matching task signatures
+        [('owner', pymongo.ASCENDING), ('name', pymongo.ASCENDING)],
+    ])
 
-    def setup(self):
+    async def setup(self):
         super(Cron, self).setup()
 
         # Schedule own events with the same API other plugins will use
         self.cron = self.provide(self.plugin_name())
 
+        #: Scheduled tasks, by owner and then by signature (see :meth:`schedule`)
+        self.scheduled = {}
+        # Heap of (when, sequence number, task) for the scheduled tasks;
+        # unscheduled tasks are left in the heap and skipped when reached
+        self.heap = []
+        self._sequence = itertools.count()
+
         # An asyncio.Handle for the event runner delayed call
         self.scheduler = None
+        # The asyncio.Task for the event runner, once it has been called
+        self.runner = None
         # The datetime of the next task, which self.scheduler was created for
         self.scheduler_next = None
+        # The asyncio.Tasks running callbacks, limited by self.semaphore
+        self.running = set()
+        self.semaphore = asyncio.Semaphore(int(self.config_get('max_concurrent_tasks')), loop=self.bot.loop)
+        # Futures for tasks still being saved, by _id, which must finish before
+        # the tasks are deleted or replaced
+        self.saving = {}
+
+        for task in await self.tasks.find({}):
+            self._add(task)
 
         # Now we need to remove the hourly, daily, and weekly events
         # (if there are any), because the scheduler just runs things
@@ -57,7 +93,7 @@ class Cron(Plugin):
         #
         # Sadly this can't happen in the teardown, as we want to do
         # this even if the bot crashes unexpectedly.
-        self.cron.unschedule_all()
+        await self.cron.unschedule_all()
 
         # Add regular cron.hourly/daily/weekly events which plugins
         # can listen to.
@@ -66,30 +102,35 @@ class Cron(Plugin):
                           seconds=now.second,
                           microseconds=now.microsecond)
 
-        self.cron.schedule(name='hourly',
-                           when=now + when + timedelta(hours=1),
-                           interval=timedelta(hours=1),
-                           callback='fire_event',
-                           args=['cron.hourly'])
+        await self.cron.schedule(name='hourly',
+                                 when=now + when + timedelta(hours=1),
+                                 interval=timedelta(hours=1),
+                                 callback='fire_event',
+                                 args=['cron.hourly'])
 
         when -= timedelta(hours=now.hour)
-        self.cron.schedule(name='daily',
-                           when=now + when + timedelta(days=1),
-                           interval=timedelta(days=1),
-                           callback='fire_event',
-                           args=['cron.daily'])
+        await self.cron.schedule(name='daily',
+                                 when=now + when + timedelta(days=1),
+                                 interval=timedelta(days=1),
+                                 callback='fire_event',
+                                 args=['cron.daily'])
 
         when -= timedelta(days=now.weekday())
-        self.cron.schedule(name='weekly',
-                           when=now + when + timedelta(weeks=1),
-                           interval=timedelta(weeks=1),
-                           callback='fire_event',
-                           args=['cron.weekly'])
+        await self.cron.schedule(name='weekly',
+                                 when=now + when + timedelta(weeks=1),
+                                 interval=timedelta(weeks=1),
+                                 callback='fire_event',
+                                 args=['cron.weekly'])
 
-    def teardown(self):
+    async def teardown(self):
         super().teardown()
         if self.scheduler is not None:
             self.scheduler.cancel()
+        if self.runner is not None:
+            self.runner.cancel()
+        for task in self.running:
+            task.cancel()
+        await asyncio.gather(*self.running, return_exceptions=True)
 
     def fire_event(self, now, name):
         """Fire off a regular event.
@@ -113,9 +154,10 @@ class Cron(Plugin):
             matcher['kwargs'] = kwargs
         return matcher
 
-    def schedule(self, owner, name, when,
-                 interval=None, callback=None,
-                 args=None, kwargs=None):
+    async def schedule(self, owner, name, when,
+                       interval=None, callback=None,
+                       args=None, kwargs=None,
+                       misfire=None, catch_up_limit=10):
         """Schedule a new task.
 
         :param owner:    The plugin which created the task
@@ -128,35 +170,49 @@ class Cron(Plugin):
                          call owner.name.
         :param args:     Callback positional arguments.
         :param kwargs:   Callback keyword arguments.
+        :param misfire:  What to do about missed occurrences of a
+                         repeating task, see :class:`Misfire`.
+        :param catch_up_limit: The most occurrences to run with
+                         :attr:`Misfire.CATCH_UP` (None for no limit).
 
         The signature of a task is ``(owner, name, args, kwargs)``, and trying
         to create a task with the same signature as an existing task will raise
         :exc:`DuplicateTaskError`.  Any subset of the signature can be used to
         :meth:`unschedule` all matching tasks (``owner`` is mandatory).
         """
-        # Create the new task
+        # Create the new task, with an _id so that the event runner can
+        # refer to it even if it's due before it has been saved
         secs = interval.total_seconds() if interval is not None else None
-        task = {'owner': owner,
+        task = {'_id': ObjectId(),
+                'owner': owner,
                 'name': name,
                 'when': when,
                 'interval': secs,
                 'callback': callback or name,
-                'args': args or [],
-                'kwargs': kwargs or {}}
+                'args': list(args or []),
+                'kwargs': kwargs or {},
+                'misfire': Misfire(misfire or Misfire.RUN_ONCE).value,
+                'catch_up_limit': catch_up_limit}
 
         # See if this task duplicates another
-        match = self.match_task(task['owner'], task['name'],
-                                task['args'], task['kwargs'])
-        if self.tasks.find_one(match):
-            raise DuplicateTaskError('Identical task already scheduled', match)
+        if _signature(task) in self.scheduled.get(owner, {}):
+            raise DuplicateTaskError('Identical task already scheduled',
+                                     self.match_task(owner, name, task['args'], task['kwargs']))
 
         # If we made it this far, save the task
-        self.tasks.insert(task)
+        self._add(task)
+        saving = self.saving[task['_id']] = asyncio.ensure_future(self.tasks.insert_one(task), loop=self.bot.loop)
+        saving.add_done_callback(lambda _: self.saving.pop(task['_id'], None))
+        try:
+            await asyncio.shield(saving, loop=self.bot.loop)
+        except Exception:
+            self._remove(task)
+            raise
 
         # Reschedule the event runner in case it now needs to happen earlier
         self.schedule_event_runner()
 
-    def unschedule(self, owner, name=None, args=None, kwargs=None):
+    async def unschedule(self, owner, name=None, args=None, kwargs=None):
         """Unschedule a task.
 
         Removes all existing tasks that match based on the criteria passed as
@@ -166,7 +222,51 @@ class Cron(Plugin):
         call, but this isn't a problem as it's not a very intensive function,
         so there's no point in rescheduling it here.
         """
-        self.tasks.remove(self.match_task(owner, name, args, kwargs))
+        match = self.match_task(owner, name, None if args is None else list(args), kwargs)
+        saving = []
+        for task in list(self.scheduled.get(owner, {}).values()):
+            if all(task[k] == v for k, v in match.items()):
+                self._remove(task)
+                if task['_id'] in self.saving:
+                    saving.append(self.saving[task['_id']])
+        # Don't let unscheduled tasks pile up in the heap
+        if len(self.heap) > 2 * sum(map(len, self.scheduled.values())) + 100:
+            self.heap = [entry for entry in self.heap if self._is_scheduled(entry[2]) and entry[2]['when'] == entry[0]]
+            heapq.heapify(self.heap)
+        await self._saved(saving)
+        await self.tasks.delete_many(match)
+
+    async def _saved(self, saving):
+        """Wait for the tasks being saved by *saving* futures, so that later
+        writes to them aren't overtaken by the inserts.
+        """
+        if saving:
+            await asyncio.wait(saving, loop=self.bot.loop)
+
+    def _add(self, task):
+        self.scheduled.setdefault(task['owner'], {})[_signature(task)] = task
+        heapq.heappush(self.heap, (task['when'], next(self._sequence), task))
+
+    def _remove(self, task):
+        tasks = self.scheduled.get(task['owner'], {})
+        if tasks.get(_signature(task)) is task:
+            del tasks[_signature(task)]
+            if not tasks:
+                del self.scheduled[task['owner']]
+
+    def _is_scheduled(self, task):
+        return self.scheduled.get(task['owner'], {}).get(_signature(task)) is task
+
+    def _next_task(self):
+        """Get the scheduled task that is due first, discarding unscheduled
+        tasks from the top of the heap.
+        """
+        while self.heap:
+            when, _, task = self.heap[0]
+            if self._is_scheduled(task) and task['when'] == when:
+                return task
+            heapq.heappop(self.heap)
+        return None
 
     def schedule_event_runner(self):
         """Schedule the event runner.
@@ -175,53 +275,66 @@ class Cron(Plugin):
         is required by the next scheduled task.  If a different call already
         exists it is replaced.
         """
-        now = datetime.now()
-        # There will always be at least one event remaining because we
-        # have three repeating ones, so this is safe.
-        remaining_tasks = self.tasks.find().sort('when', pymongo.ASCENDING)
-        next_run = remaining_tasks[0]['when']
+        if self.runner is not None and not self.runner.done():
+            # The runner will do this when it finishes
+            return
+        task = self._next_task()
+        next_run = task['when'] if task is not None else None
 
-        if self.scheduler_next is None or next_run != self.scheduler_next:
+        if next_run != self.scheduler_next or self.scheduler is None:
             if self.scheduler is not None:
                 self.scheduler.cancel()
-            delay = (next_run - now).total_seconds()
-            self.log.debug('calling event runner in %s seconds', delay)
-            # TODO: need a better API for using the bot's event loop
-            self.scheduler = asyncio.get_event_loop().call_later(delay, self.event_runner)
+                self.scheduler = None
             self.scheduler_next = next_run
+            if next_run is None:
+                return
+            # Convert to the loop's monotonic clock, which isn't affected by
+            # changes to the system time while waiting
+            delay = (next_run - datetime.now()).total_seconds()
+            self.log.debug('calling event runner in %s seconds', delay)
+            self.scheduler = self.bot.loop.call_at(self.bot.loop.time() + max(0, delay), self._start_event_runner)
         else:
             self.log.debug('already scheduled for %s', self.scheduler_next)
 
-    def event_runner(self):
+    def _start_event_runner(self):
+        self.scheduler = None
+        self.scheduler_next = None
+        self.runner = self.bot.loop.create_task(self.event_runner())
+
+    async def event_runner(self):
         """Run pending tasks.
 
-        Run all tasks which have a trigger time in the past, and then
-        reschedule self to run in time for the next task.
+        Start all tasks which have a trigger time in the past, and then
+        reschedule self to run in time for the next task.  Repeating tasks
+        are moved straight to their next occurrence after now, and their
+        missed occurrences are handled according to their :class:`Misfire`
+        policy.
         """
         now = datetime.now()
         self.log.debug('running event runner at %s', now)
 
-        # Find and run every task from before now
-        for taskdef in self.tasks.find({'when': {'$lt': now}}):
+        # Find every task from before now.  Each one is removed (or
+        # rescheduled for the future) straight away, as if it schedules
+        # things itself, the scheduler will be called again, but the task
+        # will still be there (and so be run again), resulting in an error
+        # when it tries to schedule the second time.
+        due = []
+        writes = []
+        saving = []
+        while True:
+            taskdef = self._next_task()
+            if taskdef is None or taskdef['when'] > now:
+                break
+            heapq.heappop(self.heap)
+            when = taskdef['when']
+            if taskdef['_id'] in self.saving:
+                saving.append(self.saving[taskdef['_id']])
+
             # Going to be using this a lot
             task_name = u'{}/{}'.format(
                 taskdef['owner'],
                 taskdef['name'])
 
-            self.log.info(u'Running task ' + task_name)
-
-            # Now that we have the task, we need to remove it from the
-            # database (or reschedule it for the future) straight
-            # away, as if it schedules things itself, the scheduler
-            # will be called again, but the task will still be there
-            # (and so be run again), resulting in an error when it
-            # tries to schedule the second time.
-            if taskdef['interval'] is not None:
-                taskdef['when'] += timedelta(seconds=taskdef['interval'])
-                self.tasks.save(taskdef)
-            else:
-                self.unschedule(taskdef['owner'], taskdef['name'])
-
             # There are two things that could go wrong in running a
             # task. The method might not exist, this can arise in two
             # ways: a plugin scheduled it in a prior incarnation of
@@ -236,36 +349,116 @@ class Cron(Plugin):
             try:
                 func = getattr(self.bot.plugins[taskdef['owner']],
                                taskdef['callback'])
-            except AttributeError:
+            except (AttributeError, KeyError):
                 self.log.error(
                     u'Couldn\'t find method {}.{} for task {}'.format(
                         taskdef['owner'],
                         taskdef['callback'],
                         task_name))
-                self.unschedule(taskdef['owner'], taskdef['name'])
-                continue
-
-            # The second way is if the method does exist, but raises
-            # an exception during its execution. There are two ways to
-            # handle this. We could let the exception propagate
-            # upwards and outwards, killing the bot, or we could log
-            # it as an error and carry on. I went for the latter here,
-            # on the assumption that, whilst exceptions are bad and
-            # shouldn't get this far anyway, killing the bot is worse.
+                func = None
+
+            occurrences = [when]
+            if taskdef['interval'] is not None and func is not None:
+                interval = timedelta(seconds=taskdef['interval'])
+                # Occurrences after the first one that are also due
+                missed = (now - when) // interval
+                occurrences = _misfire_occurrences(taskdef, when, interval, missed)
+                taskdef['when'] = when + (missed + 1) * interval
+                heapq.heappush(self.heap, (taskdef['when'], next(self._sequence), taskdef))
+                writes.append(pymongo.ReplaceOne({'_id': taskdef['_id']}, taskdef))
+            else:
+                self._remove(taskdef)
+                writes.append(pymongo.DeleteOne({'_id': taskdef['_id']}))
+            if func is not None and occurrences:
+                due.append((task_name, func, occurrences, taskdef['args'], taskdef['kwargs']))
+            elif func is not None:
+                self.log.info(u'Skipping missed occurrences of task ' + task_name)
+
+        # Save all the changes at once, after any tasks that were only just
+        # scheduled have been inserted
+        await self._saved(saving)
+        if writes:
             try:
-                func(taskdef['when'], *taskdef['args'], **taskdef['kwargs'])
-            except Exception as e:
-                # Don't really want exceptions to kill cron, so let's just log
-                # them as an error.
+                await self.tasks.bulk_write(writes, ordered=False)
+            except Exception:
+                self.log.exception('failed to save tasks')
 
-                self.log.error(
-                    u'Exception raised when running task {}: {} {}'.format(
-                        task_name,
-                        type(e), e.args))
+        for task_name, func, occurrences, args, kwargs in due:
+            task = self.bot.loop.create_task(self._run_task(task_name, func, occurrences, args, kwargs))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
 
         # Schedule the event runner for the next task
+        self.runner = None
         self.schedule_event_runner()
 
+    async def _run_task(self, task_name, func, occurrences, args, kwargs):
+        """Call *func* for each of *occurrences* in turn, once there's a
+        free slot.
+        """
+        async with self.semaphore:
+            for when in occurrences:
+                self.log.info(u'Running task ' + task_name)
+
+                # The second way is if the method does exist, but raises
+                # an exception during its execution. There are two ways to
+                # handle this. We could let the exception propagate
+                # upwards and outwards, killing the bot, or we could log
+                # it as an error and carry on. I went for the latter here,
+                # on the assumption that, whilst exceptions are bad and
+                # shouldn't get this far anyway, killing the bot is worse.
+                try:
+                    await maybe_future_result(func(when, *args, **kwargs), log=self.log)
+                except Exception as e:
+                    # Don't really want exceptions to kill cron, so let's just log
+                    # them as an error.
+
+                    self.log.error(
+                        u'Exception raised when running task {}: {} {}'.format(
+                            task_name,
+                            type(e), e.args))
+
+
+class Misfire(enum.Enum):
+    """What to do when a repeating task is overdue by more than its interval."""
+    #: Run the most recent missed occurrence only
+    RUN_ONCE = 'run_once'
+    #: Don't run any of the missed occurrences
+    SKIP = 'skip'
+    #: Run each missed occurrence in turn, but at most ``catch_up_limit`` of
+    #: them (the most recent ones)
+    CATCH_UP = 'catch_up'
+
+
+def _misfire_occurrences(taskdef, when, interval, missed):
+    """Get the times to run a repeating task for, if it was due at *when*
+    and *missed* more occurrences have also passed.
+    """
+    if missed == 0:
+        return [when]
+    misfire = Misfire(taskdef.get('misfire', Misfire.RUN_ONCE.value))
+    if misfire is Misfire.SKIP:
+        return []
+    elif misfire is Misfire.RUN_ONCE:
+        return [when + missed * interval]
+    else:
+        limit = taskdef.get('catch_up_limit')
+        count = missed + 1 if limit is None else min(missed + 1, limit)
+        return [when + i * interval for i in range(missed + 1 - count, missed + 1)]
+
+
+def _freeze(value):
+    """Get a hashable equivalent of a task's *args* or *kwargs*."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _signature(task):
+    return task['name'], _freeze(task['args']), _freeze(task['kwargs'])
+
 
 class DuplicateTaskError(Exception):
     """Task with a given signature already exists.
@@ -297,43 +490,49 @@ class PluginCron(object):
         self.cron = cron
         self.plugin = plugin
 
-    def schedule(self, name, when, interval=None, callback=None, args=None, kwargs=None):
+    async def schedule(self, name, when, interval=None, callback=None, args=None, kwargs=None,
+                       misfire=None, catch_up_limit=10):
         """Pass through to :meth:`Cron.schedule`, adding *owner* argument."""
-        self.cron.schedule(self.plugin, name, when, interval, callback, args, kwargs)
+        await self.cron.schedule(self.plugin, name, when, interval, callback, args, kwargs,
+                                 misfire, catch_up_limit)
 
-    def after(self, _delay, _name, _method_name, *args, **kwargs):
+    async def after(self, _delay, _name, _method_name, *args, **kwargs):
         """Schedule an event to occur after the timedelta delay has passed."""
-        self.schedule(_name,
-                      datetime.now() + _delay,
-                      callback=_method_name,
-                      args=args,
-                      kwargs=kwargs)
+        await self.schedule(_name,
+                            datetime.now() + _delay,
+                            callback=_method_name,
+                            args=args,
+                            kwargs=kwargs)
 
-    def at(self, _when, _name, _method_name, *args, **kwargs):
+    async def at(self, _when, _name, _method_name, *args, **kwargs):
         """Schedule an event to occur at a given time."""
-        self.schedule(_name,
-                      _when,
-                      callback=_method_name,
-                      args=args,
-                      kwargs=kwargs)
-
-    def every(self, _freq, _name, _method_name, *args, **kwargs):
-        """Schedule an event to occur every time the delay passes."""
-        self.schedule(_name,
-                      datetime.now() + _freq,
-                      interval=_freq,
-                      callback=_method_name,
-                      args=args,
-                      kwargs=kwargs)
-
-    def unschedule(self, name, args=None, kwargs=None):
+        await self.schedule(_name,
+                            _when,
+                            callback=_method_name,
+                            args=args,
+                            kwargs=kwargs)
+
+    async def every(self, _freq, _name, _method_name, *args, _misfire=None, _catch_up_limit=10, **kwargs):
+        """Schedule an event to occur every time the delay passes, with a
+        :class:`Misfire` policy for occurrences that are missed.
+        """
+        await self.schedule(_name,
+                            datetime.now() + _freq,
+                            interval=_freq,
+                            callback=_method_name,
+                            args=args,
+                            kwargs=kwargs,
+                            misfire=_misfire,
+                            catch_up_limit=_catch_up_limit)
+
+    async def unschedule(self, name, args=None, kwargs=None):
         """Pass through to :meth:`Cron.unschedule`, adding *owner* argument."""
-        self.cron.unschedule(self.plugin, name, args, kwargs)
+        await self.cron.unschedule(self.plugin, name, args, kwargs)
 
-    def unschedule_all(self):
+    async def unschedule_all(self):
         """Unschedule all tasks for this plugin.
 
         This could be supported by :meth:`unschedule`, but it's nice to
         prevent code accidentally wiping all of a plugin's tasks.
         """
-        self.cron.unschedule(self.plugin)
+        await self.cron.unschedule(self.plugin)
@@ -23,17 +23,19 @@ class GitHub(Plugin):
 
     __sentinel = object()
 
+    def setup(self):
+        super().setup()
+        self.config_table = self.build_config_table()
+
+    def reconfigure(self, old, new):
+        self.config_table = self.build_config_table()
+
     def config_get(self, key, repo=None):
         """A special implementation of :meth:`Plugin.config_get` which looks at
         a repo-based configuration subsection before the plugin's
         configuration section.
         """
-        default = super().config_get(key)
-
-        if repo is None:
-            return default
-        else:
-            return self.subconfig(repo).get(key, default)
+        return self.config_table[repo, key]
 
     @Plugin.hook('webhook.github')
     async def webhook(self, e):
@@ -1,14 +1,16 @@
 import urllib.parse
 
 from csbot.plugin import Plugin
-from csbot.util import simple_http_get_async
 
 
 class Hoogle(Plugin):
     CONFIG_DEFAULTS = {
         'results': 5,
+        'cache_ttl': 3600,
     }
 
+    http = Plugin.use('@bot', service='http')
+
     def setup(self):
         super(Hoogle, self).setup()
 
@@ -20,28 +22,28 @@ class Hoogle(Plugin):
 
         query = e['data']
         hurl = 'http://www.haskell.org/hoogle/?mode=json&hoogle=' + query
-        async with simple_http_get_async(hurl) as hresp:
-
-            if hresp.status != 200:
-                self.log.warn('request failed for ' + hurl)
-                return
-
-            # The Hoogle response JSON is of the following format:
-            # {
-            #  "version": "<hoogle version>"
-            #  "results": [
-            #    {
-            #      "location": "<link to docs>"
-            #      "self":     "<name> :: <type>"
-            #      "docs":     "<short description>"
-            #    },
-            #    ...
-            #  ]
-            # }
-
-            maxresults = int(self.config_get('results'))
-
-            json = await hresp.json()
+        hresp = await self.http.fetch(hurl, ttl=int(self.config_get('cache_ttl')))
+
+        if hresp.status != 200:
+            self.log.warn('request failed for ' + hurl)
+            return
+
+        # The Hoogle response JSON is of the following format:
+        # {
+        #  "version": "<hoogle version>"
+        #  "results": [
+        #    {
+        #      "location": "<link to docs>"
+        #      "self":     "<name> :: <type>"
+        #      "docs":     "<short description>"
+        #    },
+        #    ...
+        #  ]
+        # }
+
+        maxresults = int(self.config_get('results'))
+
+        json = hresp.json()
 
         if json is None:
             self.log.warn('invalid JSON received from Hoogle')
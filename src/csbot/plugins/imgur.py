@@ -1,6 +1,7 @@
 from ..plugin import Plugin
-from ..util import pluralize, simple_http_get_async
-from .linkinfo import LinkInfoResult
+from ..quota import Priority, QuotaExceeded
+from ..util import pluralize
+from .linkinfo import LinkInfoResult, URLSpec
 
 
 class ImgurError(Exception):
@@ -11,6 +12,8 @@ class Imgur(Plugin):
     CONFIG_DEFAULTS = {
         'client_id': None,
         'client_secret': None,
+        # Fraction of the rate limits kept for commands
+        'quota_reserve': 0.2,
     }
 
     CONFIG_ENVVARS = {
@@ -18,12 +21,32 @@ class Imgur(Plugin):
         'client_secret': ['IMGUR_CLIENT_SECRET'],
     }
 
+    #: Imgur's rate limits (requests per day per client, and per hour per
+    #: user), until the real values are seen in ``X-RateLimit-*`` headers
+    CLIENT_LIMIT = 12500
+    USER_LIMIT = 500
+
+    http = Plugin.use('@bot', service='http')
+    quota = Plugin.use('@bot', service='quota')
+
+    def setup(self):
+        super().setup()
+        self._update_budgets()
+
+    def reconfigure(self, old, new):
+        self._update_budgets()
+
+    def _update_budgets(self):
+        reserve = float(self.config_get('quota_reserve'))
+        self.client_budget = self.quota.budget('imgur', self.CLIENT_LIMIT, reserve=reserve)
+        self.user_budget = self.quota.budget('imgur.user', self.USER_LIMIT, period=60 * 60, reserve=reserve)
+
     @Plugin.integrate_with('linkinfo')
     def integrate_with_linkinfo(self, linkinfo):
-        linkinfo.register_handler(lambda url: url.netloc in ('imgur.com', 'i.imgur.com'),
-                                  self._linkinfo_handler, exclusive=True)
+        linkinfo.register_handler(URLSpec(hosts=['imgur.com', 'i.imgur.com']),
+                                  self._linkinfo_handler, exclusive=True, pass_priority=True)
 
-    async def _linkinfo_handler(self, url, match):
+    async def _linkinfo_handler(self, url, match, priority):
         # Split up endpoint and ID: /<image>, /a/<album> or /gallery/<id>
         kind, _, id = url.path.lstrip('/').rpartition('/')
         # Strip file extension from direct image links
@@ -31,11 +54,11 @@ class Imgur(Plugin):
 
         try:
             if kind == '':
-                nsfw, title = self._format_image(await self._get_image(id))
+                nsfw, title = self._format_image(await self._get_image(id, priority))
             elif kind == 'a':
-                nsfw, title = self._format_album(await self._get_album(id), url.fragment)
+                nsfw, title = self._format_album(await self._get_album(id, priority), url.fragment)
             elif kind == 'gallery':
-                data = await self._get_gallery_item(id)
+                data = await self._get_gallery_item(id, priority)
                 if data['is_album']:
                     nsfw, title = self._format_album(data, None)
                 else:
@@ -43,10 +66,13 @@ class Imgur(Plugin):
             else:
                 nsfw, title = False, None
         except ImgurError as e:
-            return LinkInfoResult(url, str(e), is_error=True)
+            return LinkInfoResult(url.geturl(), str(e), is_error=True)
+        except QuotaExceeded as e:
+            # Might work next time, e.g. if the user asks with a command
+            return LinkInfoResult(url.geturl(), str(e), is_error=True, cacheable=False)
 
         if title:
-            return LinkInfoResult(url, title, nsfw=nsfw)
+            return LinkInfoResult(url.geturl(), title, nsfw=nsfw)
         else:
             return None
 
@@ -65,20 +91,32 @@ class Imgur(Plugin):
             title += ': ' + image['title']
         return data['nsfw'] or 'nsfw' in title.lower(), title
 
-    async def _get(self, url):
+    async def _get(self, url, priority=Priority.INTERACTIVE):
         headers = {'Authorization': f'Client-ID {self.config_get("client_id")}'}
-        async with simple_http_get_async(url, headers=headers) as resp:
-            json = await resp.json()
-            if json['success']:
-                return json['data']
-            else:
-                raise ImgurError(json['data']['error'])
+        await self.quota.acquire('imgur', 'imgur.user', priority=priority)
+        resp = await self.http.fetch(url, headers=headers)
+        if not resp.from_cache:
+            self.client_budget.observe_headers(resp.headers,
+                                               remaining='X-RateLimit-ClientRemaining',
+                                               limit='X-RateLimit-ClientLimit',
+                                               reset=None)
+            self.user_budget.observe_headers(resp.headers,
+                                             remaining='X-RateLimit-UserRemaining',
+                                             limit='X-RateLimit-UserLimit',
+                                             reset='X-RateLimit-UserReset')
+            if resp.status == 429:
+                self.user_budget.exhaust()
+        json = resp.json()
+        if json['success']:
+            return json['data']
+        else:
+            raise ImgurError(json['data']['error'])
 
-    async def _get_image(self, id):
-        return await self._get(f'https://api.imgur.com/3/image/{id}')
+    async def _get_image(self, id, priority=Priority.INTERACTIVE):
+        return await self._get(f'https://api.imgur.com/3/image/{id}', priority)
 
-    async def _get_album(self, id):
-        return await self._get(f'https://api.imgur.com/3/album/{id}')
+    async def _get_album(self, id, priority=Priority.INTERACTIVE):
+        return await self._get(f'https://api.imgur.com/3/album/{id}', priority)
 
-    async def _get_gallery_item(self, id):
-        return await self._get(f'https://api.imgur.com/3/gallery/{id}')
+    async def _get_gallery_item(self, id, priority=Priority.INTERACTIVE):
+        return await self._get(f'https://api.imgur.com/3/gallery/{id}', priority)
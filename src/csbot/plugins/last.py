@@ -1,7 +1,7 @@
 from csbot.plugin import Plugin
-from csbot.util import nick
-from csbot.events import Event
+from csbot.util import nick, pluralize, irc_lower
 from datetime import datetime
+import asyncio
 import pymongo
 
 
@@ -9,40 +9,93 @@ class Last(Plugin):
     """Utility plugin to record the last message (and time said) of a
     user. Records both messages and actions individually, and allows
     querying on either.
-    """
-    db = Plugin.use('mongodb', collection='last')
 
-    def last(self, nick, channel=None, msgtype=None):
+    Lookups use an in-memory index of the latest record for each nick, channel
+    and type (ignoring case), loaded from the database at startup.  New records
+    are written to the database every ``flush_interval`` seconds, so only the
+    latest record for each nick, channel and type since the previous write is
+    saved.
+    """
+    CONFIG_DEFAULTS = {
+        'flush_interval': 5,
+    }
+
+    db = Plugin.use('mongodb', collection='last', indexes=[
+        [('nick', pymongo.ASCENDING), ('channel', pymongo.ASCENDING), ('type', pymongo.ASCENDING),
+         ('when', pymongo.DESCENDING)],
+    ])
+
+    async def setup(self):
+        super(Last, self).setup()
+        #: Latest records, by case-mapped nick and then (case-mapped channel, type)
+        self.seen = {}
+        for record in await self.db.find({}):
+            self._index(record)
+        #: Records not yet written to the database, by (nick, channel, type)
+        self.pending = {}
+        self._flusher = self.bot.loop.create_task(self._flush_periodically())
+
+    async def teardown(self):
+        self._flusher.cancel()
+        await self.flush()
+        super(Last, self).teardown()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(float(self.config_get('flush_interval')))
+            await self.flush()
+
+    async def flush(self):
+        """Write pending records to the database, as one bulk write."""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await self.db.bulk_write([pymongo.ReplaceOne({'nick': nick, 'channel': channel, 'type': msgtype},
+                                                         dict(record), upsert=True)
+                                      for (nick, channel, msgtype), record in batch.items()],
+                                     ordered=False)
+        except Exception:
+            self.log.exception('failed to write %s', pluralize(len(batch), 'record', 'records'))
+            # Try again next time, unless there's a newer record
+            for key, record in batch.items():
+                self.pending.setdefault(key, record)
+
+    def _index(self, record):
+        records = self.seen.setdefault(irc_lower(record['nick']), {})
+        key = (irc_lower(record['channel']), record['type'])
+        if key not in records or records[key]['when'] <= record['when']:
+            records[key] = record
+
+    async def last(self, nick, channel=None, msgtype=None):
         """Get the last thing said (including actions) by a given
-        nick, optionally filtering by channel.
+        nick, optionally filtering by channel.  Without a channel, this
+        is the last thing the nick said anywhere.
         """
-        search = {'nick': nick}
-
+        records = self.seen.get(irc_lower(nick), {}).values()
         if channel is not None:
-            search['channel'] = channel
-
+            records = [r for r in records if irc_lower(r['channel']) == irc_lower(channel)]
         if msgtype is not None:
-            search['type'] = msgtype
+            records = [r for r in records if r['type'] == msgtype]
+        return max(records, key=lambda r: r['when'], default=None)
 
-        return self.db.find_one(search, sort=[('when', pymongo.DESCENDING)])
-
-    def last_message(self, nick, channel=None):
+    async def last_message(self, nick, channel=None):
         """Get the last message sent by a nick, optionally filtering
         by channel.
         """
-        return self.last(nick, channel=channel, msgtype='message')
+        return await self.last(nick, channel=channel, msgtype='message')
 
-    def last_action(self, nick, channel=None):
+    async def last_action(self, nick, channel=None):
         """Get the last action sent by a nick, optionally filtering
         by channel.
         """
-        return self.last(nick, channel=channel, msgtype='action')
+        return await self.last(nick, channel=channel, msgtype='action')
 
-    def last_command(self, nick, channel=None):
+    async def last_command(self, nick, channel=None):
         """Get the last command sent by a nick, optionally filtering
         by channel.
         """
-        return self.last(nick, channel=channel, msgtype='command')
+        return await self.last(nick, channel=channel, msgtype='command')
 
     @Plugin.hook('core.message.privmsg')
     def record_message(self, event):
@@ -88,31 +141,31 @@ class Last(Plugin):
     def record(self, event, nick, channel, msgtype, msg):
         """Record a new message, of a given type.
         """
-        self._schedule_update(event,
-                              {'nick': nick,
-                               'channel': channel,
-                               'type': msgtype},
-                              {'nick': nick,
-                               'channel': channel,
-                               'type': msgtype,
-                               'when': datetime.now(),
-                               'message': msg})
-
-    def _schedule_update(self, e, query, update):
-        self.bot.post_event(Event.extend(e, 'last.update',
-                                         {'query': query, 'update': update}))
-
-    @Plugin.hook('last.update')
-    def _apply_update(self, e):
-        self.db.remove(e['query'])
-        self.db.insert(e['update'])
+        record = {'nick': nick,
+                  'channel': channel,
+                  'type': msgtype,
+                  'when': datetime.now(),
+                  'message': msg}
+        self._index(record)
+        self.pending[(nick, channel, msgtype)] = record
 
     @Plugin.command('seen', help=('seen nick [type]: show the last thing'
                                   ' said by a nick in this channel, optionally'
                                   ' filtering by type: message, action,'
                                   ' or command.'))
-    def show_seen(self, event):
+    async def show_seen(self, event):
+        await self._show_seen(event, event['channel'])
+
+    @Plugin.command('seen.anywhere', help=('seen.anywhere nick [type]: like seen,'
+                                           ' but in any channel.'))
+    async def show_seen_anywhere(self, event):
+        await self._show_seen(event, None)
+
+    async def _show_seen(self, event, channel):
         splitted = event['data'].split()
+        if not splitted:
+            event.reply('Who?')
+            return
         thenick = splitted[0]
         msgtype = splitted[1] if len(splitted) > 1 else None
 
@@ -120,15 +173,14 @@ class Last(Plugin):
             event.reply('Bad filter: {}. Accepted are "message", "command", and "action".'.format(msgtype))
             return
 
-        message = self.last(thenick, channel=event['channel'], msgtype=msgtype)
+        message = await self.last(thenick, channel=channel, msgtype=msgtype)
 
         if message is None:
             event.reply('Nothing recorded for {}'.format(thenick))
-        elif message['type'] in ['message', 'command']:
-            event.reply('[{}] <{}> {}'.format(message['when'].strftime("%Y-%m-%d %H:%M:%S"),
-                                              thenick,
-                                              message['message']))
+            return
+        when = message['when'].strftime("%Y-%m-%d %H:%M:%S")
+        where = '' if channel is not None else ' {}'.format(message['channel'])
+        if message['type'] in ['message', 'command']:
+            event.reply('[{}]{} <{}> {}'.format(when, where, message['nick'], message['message']))
         else:
-            event.reply('[{}] * {} {}'.format(message['when'].strftime("%Y-%m-%d %H:%M:%S"),
-                                              thenick,
-                                              message['message']))
+            event.reply('[{}]{} * {} {}'.format(when, where, message['nick'], message['message']))
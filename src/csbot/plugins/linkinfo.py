@@ -1,3 +1,5 @@
+import asyncio
+import copy
 import os.path
 import re
 from urllib.parse import urlparse
@@ -7,15 +9,244 @@ import datetime
 from functools import partial
 
 import aiohttp
+import attr
 import lxml.etree
-import lxml.html
 
+from ..httpclient import CircuitOpen
+from ..mediainfo import parse_header, parse_isobmff, format_size
 from ..plugin import Plugin
-from ..util import Struct, simple_http_get_async, maybe_future_result
+from ..util import Struct, BloomFilter, maybe_future_result
+from ..quota import Priority, QuotaExceeded
 from .. import config
 
 
-LinkInfoHandler = namedtuple('LinkInfoHandler', ['filter', 'handler', 'exclusive'])
+LinkInfoHandler = namedtuple('LinkInfoHandler', ['filter', 'handler', 'exclusive', 'pass_priority'])
+
+
+#: Regular expression flags that can be scoped to part of a pattern, e.g. ``(?i:...)``
+_SCOPED_FLAGS = {re.I: 'i', re.M: 'm', re.S: 's', re.X: 'x'}
+
+
+@attr.s(frozen=True)
+class URLSpec:
+    """A declarative URL filter for :meth:`LinkInfo.register_handler` and
+    :meth:`LinkInfo.register_exclude`.
+
+    A URL matches if its hostname is one of *hosts*, or is one of *suffixes* or
+    a subdomain of one, and its path matches the *path* regular expression
+    (with :func:`re.search`).  Omitted parts match anything.  Unlike a filter
+    function, the :class:`LinkInfo` plugin can index specs by hostname and
+    combine their path patterns, so it only tries the ones that could match.
+
+    Calling a spec with a URL returns the path :class:`re.Match` object (or
+    True if there is no *path*) if it matches, otherwise None.
+    """
+    hosts = attr.ib(default=(), converter=lambda hs: frozenset(h.lower() for h in hs))
+    suffixes = attr.ib(default=(), converter=lambda ss: frozenset(s.lower().strip('.') for s in ss))
+    path = attr.ib(default=None, converter=attr.converters.optional(re.compile))
+
+    @path.validator
+    def _check_path(self, attribute, value):
+        if value is not None and value.flags & ~(re.U | sum(_SCOPED_FLAGS)):
+            raise ValueError('path pattern can only use the I, M, S and X flags')
+
+    @property
+    def any_host(self):
+        return not (self.hosts or self.suffixes)
+
+    def matches_host(self, host):
+        if self.any_host or host in self.hosts:
+            return True
+        labels = host.split('.')
+        return any('.'.join(labels[i:]) in self.suffixes for i in range(len(labels)))
+
+    def __call__(self, url):
+        if not self.matches_host((url.hostname or '').lower()):
+            return None
+        if self.path is None:
+            return True
+        return self.path.search(url.path)
+
+
+class URLIndex:
+    """URL filters, each with an associated value, indexed so that finding the
+    ones that match a URL only tries those that could.
+
+    :class:`URLSpec` filters are indexed by hostname and suffix.  The path
+    patterns of specs that apply to any host are also combined into one regular
+    expression, so a URL that none of them match is rejected with one search;
+    patterns with groups are left out, because their group names and numbers
+    would clash.  Other callables are always tried.
+    """
+    def __init__(self):
+        self._entries = []
+        self._by_host = collections.defaultdict(list)
+        self._by_suffix = collections.defaultdict(list)
+        self._unindexed = []
+        self._combined_path = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, filter, value=None):
+        i = len(self._entries)
+        self._entries.append((filter, value))
+        if isinstance(filter, URLSpec) and not filter.any_host:
+            for host in filter.hosts:
+                self._by_host[host].append(i)
+            for suffix in filter.suffixes:
+                self._by_suffix[suffix].append(i)
+        else:
+            self._unindexed.append(i)
+        self._combined_path = None
+
+    def clear(self):
+        self.__init__()
+
+    def matches(self, url):
+        """Get ``(value, match)`` for each filter that matches *url* (a
+        :class:`urllib.parse.ParseResult`), in the order they were added.
+        """
+        host = (url.hostname or '').lower()
+        candidates = set(self._unindexed)
+        candidates.update(self._by_host.get(host, ()))
+        if self._by_suffix:
+            labels = host.split('.')
+            for i in range(len(labels)):
+                candidates.update(self._by_suffix.get('.'.join(labels[i:]), ()))
+
+        any_path_match = None
+        for i in sorted(candidates):
+            filter, value = self._entries[i]
+            if self._is_combined(filter):
+                if any_path_match is None:
+                    any_path_match = self._get_combined_path().search(url.path) is not None
+                if not any_path_match:
+                    continue
+            match = filter(url)
+            if match:
+                yield value, match
+
+    def any(self, url):
+        """Does any filter match *url*?"""
+        return next(self.matches(url), None) is not None
+
+    @staticmethod
+    def _is_combined(filter):
+        return (isinstance(filter, URLSpec) and filter.any_host and filter.path is not None
+                and filter.path.groups == 0)
+
+    def _get_combined_path(self):
+        if self._combined_path is None:
+            patterns = []
+            for filter, _ in self._entries:
+                if self._is_combined(filter):
+                    flags = ''.join(c for f, c in _SCOPED_FLAGS.items() if filter.path.flags & f)
+                    patterns.append(f'(?{flags}:{filter.path.pattern})' if flags else f'(?:{filter.path.pattern})')
+            self._combined_path = re.compile('|'.join(patterns))
+        return self._combined_path
+
+
+#: Links to media files, which are described by :meth:`LinkInfo.scrape_media_info` instead of
+#: :meth:`LinkInfo.scrape_html_title`
+MEDIA_URL = URLSpec(path=re.compile(r'\.(png|jpe?g|gif|webp|mp3|mp4|m4v|wav|avi|mkv|mov|webm)$', re.I))
+
+#: Query parameters that only say where a link was shared from
+TRACKING_PARAMETERS = re.compile(r'utm_\w+|fbclid|gclid')
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalise_url(url):
+    """Get a normalised string for *url* (a :class:`urllib.parse.ParseResult`),
+    so that different ways of writing the same URL share a cache entry.
+
+    The scheme and host are made lowercase, default ports and tracking query
+    parameters (e.g. ``utm_source``) are removed, and an empty path becomes
+    ``/``.  The fragment is kept, because some handlers use it.
+    """
+    scheme = url.scheme.lower()
+    try:
+        host = url.hostname or ''
+        if ':' in host:
+            host = f'[{host}]'
+        if url.port is not None and url.port != DEFAULT_PORTS.get(scheme):
+            host += f':{url.port}'
+    except ValueError:
+        host = url.netloc.lower()
+    query = '&'.join(p for p in url.query.split('&')
+                     if p and not TRACKING_PARAMETERS.fullmatch(p.partition('=')[0]))
+    return url._replace(scheme=scheme, netloc=host, path=url.path or '/', query=query).geturl()
+
+
+class TitleExtractor:
+    """Find the title of an HTML document by parsing it incrementally.
+
+    Feed the document to :meth:`feed` as it arrives, until it returns True to
+    say that the title has been found or the ``<head>`` is over, and then call
+    :meth:`close`.  The result is :attr:`title`, or if there is no ``<title>``
+    tag, the ``og:title`` OpenGraph ``<meta>`` tag from the ``<head>``.
+
+    The document is decoded with *encoding* if supplied and recognised,
+    otherwise the parser works it out (e.g. from a ``<meta charset>`` tag).
+    """
+    def __init__(self, encoding=None):
+        try:
+            self._parser = lxml.etree.HTMLPullParser(events=('start', 'end'), encoding=encoding)
+        except LookupError:
+            self._parser = lxml.etree.HTMLPullParser(events=('start', 'end'))
+        self._title = None
+        self._og_title = None
+        #: Has the parser found any elements?
+        self.found_elements = False
+        #: Has enough of the document been seen?
+        self.done = False
+
+    @property
+    def title(self):
+        """The title, with whitespace normalised, or None if not found."""
+        title = ' '.join((self._title or '').split()) or ' '.join((self._og_title or '').split())
+        return title or None
+
+    def feed(self, data: bytes) -> bool:
+        """Parse the next part of the document.  Returns :attr:`done`."""
+        if not self.done:
+            try:
+                self._parser.feed(data)
+            except lxml.etree.LxmlError:
+                self.done = True
+            self._read_events()
+        return self.done
+
+    def close(self):
+        """Finish parsing whatever has been fed so far."""
+        try:
+            self._parser.close()
+        except lxml.etree.LxmlError:
+            pass
+        self._read_events()
+        self.done = True
+
+    def _read_events(self):
+        for event, element in self._parser.read_events():
+            self.found_elements = True
+            if self.done:
+                continue
+            tag = element.tag
+            if event == 'end' and tag == 'title' and self._title is None:
+                self._title = element.text or ''
+                # A <title> with something in it is all we need
+                self.done = bool(self._title.strip())
+            elif event == 'end' and tag == 'meta' and element.get('property') == 'og:title':
+                self._og_title = element.get('content')
+            elif (event == 'end' and tag == 'head') or (event == 'start' and tag == 'body'):
+                self.done = True
+
+
+class _Lookup:
+    """An in-progress lookup of a URL, shared by everyone waiting for it."""
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
 
 
 class LinkInfoResult(Struct):
@@ -29,6 +260,8 @@ class LinkInfoResult(Struct):
     nsfw = False
     #: URL information is redundant? (e.g. duplicated in URL string)
     is_redundant = False
+    #: Can the result be reused for later lookups of the same URL?
+    cacheable = True
 
     def get_message(self):
         if self.is_error:
@@ -38,8 +271,14 @@ class LinkInfoResult(Struct):
 
 
 class LinkInfo(Plugin):
+    PLUGIN_STATE = ['rate_limit_list']
+
+    http = Plugin.use('@bot', service='http')
+
     class Config(config.Config):
         scan_limit = config.option(int, default=1, help="Maximum number of parts of a PRIVMSG to scan for URLs")
+        scan_timeout = config.option(float, default=10,
+                                     help="Seconds to wait for the URLs in a PRIVMSG to be looked up")
         minimum_slug_length = config.option(int, default=10, help="Minimum slug length in 'title in URL' filter")
         max_file_ext_length = config.option(
             int, default=6, help="Maximum file extension length (including the dot) for 'title in URL' filter")
@@ -49,52 +288,76 @@ class LinkInfo(Plugin):
         rate_limit_time = config.option(int, default=60, help="Number of seconds for rolling rate limit period")
         rate_limit_count = config.option(int, default=5, help="maximum rate of URL responses over rate limiting period")
         max_response_size = config.option(int, default=1048576, help="Maximum HTTP response size (in bytes)")
+        media_header_size = config.option(int, default=65536,
+                                          help="Bytes to read from the start of a media file to describe it")
+        result_cache_size = config.option(int, default=1000, help="Number of URL results to cache (0=disabled)")
+        result_cache_ttl = config.option(int, default=3600, help="Seconds to cache URL results for")
+        error_cache_ttl = config.option(int, default=300, help="Seconds to cache URL errors for")
+        excluded_filter_size = config.option(int, default=10000, help="Number of excluded URLs to remember")
 
     def __init__(self, *args, **kwargs):
         super(LinkInfo, self).__init__(*args, **kwargs)
 
         # URL handlers
-        self.handlers = []
+        self.handlers = URLIndex()
 
-        # URL exclusion filters, with defaults
-        self.excludes = [
-            # Ignore media links, they'll just waste time and bandwidth
-            lambda url: re.search(r'\.(png|jpg|jpeg|gif|mp3|mp4|wav|avi|mkv'
-                                  r'|mov)$', url.path, re.I),
-        ]
+        # URL exclusion filters
+        self.excludes = URLIndex()
 
         # Timestamps of recently handled URLs for cooldown timer
         self.rate_limit_list = collections.deque()
 
-    def register_handler(self, filter, handler, exclusive=False):
+        # Recent results, by normalised URL: (expiry time, LinkInfoResult)
+        self.result_cache = collections.OrderedDict()
+        # Normalised URLs that matched an exclusion filter
+        self.excluded_urls = BloomFilter(self.config.excluded_filter_size)
+        # In-progress lookups, by (normalised URL, priority)
+        self.lookups = {}
+
+    def reconfigure(self, old, new):
+        if new.excluded_filter_size != old.excluded_filter_size:
+            self.excluded_urls = BloomFilter(new.excluded_filter_size)
+        self._trim_result_cache()
+
+    def register_handler(self, filter, handler, exclusive=False, pass_priority=False):
         """Add a URL handler.
 
-        *filter* should be a function that returns a True-like or False-like
-        value to indicate whether *handler* should be run for a particular URL.
-        The URL is supplied as a :class:`urlparse:ParseResult` instance.
+        *filter* should be a :class:`URLSpec`, or a function that returns a
+        True-like or False-like value to indicate whether *handler* should be
+        run for a particular URL.  The URL is supplied as a
+        :class:`urlparse:ParseResult` instance.  Prefer a :class:`URLSpec`,
+        because filter functions have to be tried for every URL.
 
         If *handler* is called, it will be as ``handler(url, filter(url))``.
         The filter result is useful for accessing the results of a regular
-        expression filter, for example.  The result should be a
+        expression filter (e.g. the :class:`URLSpec` *path* match), for
+        example.  The result should be a
         :class:`LinkInfoResult` instance.  If the result is None instead, the
         processing will fall through to the next handler; this is the best way
         to signal that a handler doesn't know what to do with a particular URL.
+        A handler can also raise :exc:`~csbot.quota.QuotaExceeded` to fall
+        through, in which case the result isn't cached, because the handler
+        might have enough quota next time.
 
         If *exclusive* is True, the fall-through behaviour will not happen,
         instead terminating the handling with the result of calling *handler*.
+
+        If *pass_priority* is True, *handler* is also given the lookup's
+        :class:`~csbot.quota.Priority` as a *priority* keyword argument, to
+        pass on to :meth:`~csbot.quota.QuotaManager.acquire`.
         """
-        self.handlers.append(LinkInfoHandler(filter, handler, exclusive))
+        self.handlers.add(filter, LinkInfoHandler(filter, handler, exclusive, pass_priority))
 
     def register_exclude(self, filter):
         """Add a URL exclusion filter.
 
-        *filter* should be a function that returns a True-like or False-like
-        value to indicate whether or not a URL should be excluded from the
-        default title-scraping behaviour (after all registered handlers have
-        been tried).  The URL is supplied as a :class:`urlparse.ParseResult`
-        instance.
+        *filter* should be a :class:`URLSpec`, or a function that returns a
+        True-like or False-like value to indicate whether or not a URL should
+        be excluded from the default title-scraping behaviour (after all
+        registered handlers have been tried).  The URL is supplied as a
+        :class:`urlparse.ParseResult` instance.
         """
-        self.excludes.append(filter)
+        self.excludes.add(filter)
 
     @Plugin.command('link')
     async def link_command(self, e):
@@ -128,6 +391,11 @@ class LinkInfo(Plugin):
     async def scan_privmsg(self, e):
         """Scan the data of PRIVMSG events for URLs and respond with
         information about them.
+
+        The URLs are looked up concurrently, within ``scan_timeout`` seconds
+        overall.  The reply is for the first URL in the message with a useful
+        result, and once that's known the other lookups are cancelled (and
+        don't count towards the rate limit).
         """
         # Don't want to be scanning URLs inside commands,
         # especially because we'd show information twice when the "link"
@@ -136,6 +404,7 @@ class LinkInfo(Plugin):
             return
 
         parts = e['message'].split()
+        lookups = []
         for i, part in enumerate(parts[:self.config.scan_limit]):
             # Skip parts that don't look like URLs
             if '://' not in part:
@@ -145,28 +414,61 @@ class LinkInfo(Plugin):
             if self._rate_limited():
                 break
 
-            # Get info for the URL
-            result = await self.get_link_info(part)
-            self._log_if_error(result)
-
-            if result.is_error:
-                # Try next bit if this one didn't work - might have not really
-                # been a valid URL, and we're only guessing after all...
-                continue
-            else:
-                # See if "NSFW" appears anywhere else in the message
-                result.nsfw |= 'nsfw' in ''.join(parts[:i] + parts[i + 1:]).lower()
-                # Send message only if it was interesting enough
-                if not result.is_redundant:
-                    e.reply(result.get_message())
-                # ... and since we got a useful result, stop processing the message
-                break
+            # Start getting info for the URL, remembering its rate limit slot
+            # (Nobody asked for these lookups, so they shouldn't use up API quota that could be used for commands)
+            lookup = self.bot.loop.create_task(self.get_link_info(part, priority=Priority.BACKGROUND))
+            lookups.append((i, lookup, self.rate_limit_list[-1]))
+
+        deadline = self.bot.loop.time() + self.config.scan_timeout
+        unused = list(lookups)
+        try:
+            # Handle results in message order, waiting for each if necessary
+            for i, lookup, _ in lookups:
+                unused.pop(0)
+                done, _ = await asyncio.wait([lookup], timeout=max(0, deadline - self.bot.loop.time()),
+                                             loop=self.bot.loop)
+                if not done:
+                    self.log.debug('timed out looking up URLs in message')
+                    break
+                result = lookup.result()
+                self._log_if_error(result)
 
-    async def get_link_info(self, original_url):
+                if result.is_error:
+                    # Try next bit if this one didn't work - might have not really
+                    # been a valid URL, and we're only guessing after all...
+                    continue
+                else:
+                    # See if "NSFW" appears anywhere else in the message
+                    result.nsfw |= 'nsfw' in ''.join(parts[:i] + parts[i + 1:]).lower()
+                    # Send message only if it was interesting enough
+                    if not result.is_redundant:
+                        e.reply(result.get_message())
+                    # ... and since we got a useful result, stop processing the message
+                    break
+        finally:
+            for _, _, slot in unused:
+                self._release_rate_limit(slot)
+            for _, lookup, _ in lookups:
+                if not lookup.done():
+                    lookup.cancel()
+                elif not lookup.cancelled() and lookup.exception() is not None:
+                    self.log.debug('unused URL lookup failed: %r', lookup.exception())
+
+    async def get_link_info(self, original_url, priority=Priority.INTERACTIVE):
         """Get information about a URL.
 
         Using the *original_url* string, run the chain of URL handlers and
-        excludes to get a :class:`LinkInfoResult`.
+        excludes to get a :class:`LinkInfoResult`.  Handlers that spend API
+        quota do so with *priority* (see :mod:`csbot.quota`).
+
+        Results are cached by normalised URL (see :func:`normalise_url`), for
+        ``result_cache_ttl`` seconds or ``error_cache_ttl`` seconds for errors.
+        URLs that were excluded are remembered in a :class:`~csbot.util.BloomFilter`,
+        so they are rejected again without trying the handlers; very rarely
+        another URL will be wrongly rejected too.
+
+        Concurrent calls for the same URL share a single lookup, which is only
+        cancelled if all of the callers are cancelled.
         """
         make_error = partial(LinkInfoResult, original_url, is_error=True)
 
@@ -176,32 +478,92 @@ class LinkInfo(Plugin):
         if url.scheme not in ('http', 'https'):
             return make_error('not a recognised URL scheme: {}'.format(url.scheme))
 
-        # Try handlers in registration order
-        for h in self.handlers:
-            match = h.filter(url)
-            if match:
-                result = await maybe_future_result(h.handler(url, match), log=self.log)
-                if result is not None:
-                    # Useful result, return it
-                    return result
-                elif h.exclusive:
-                    # No result, and exclusive handler
-                    return make_error('exclusive handler gave no result')
-                else:
-                    # No result, fall through to next handler
-                    pass
-        # If no handlers gave a response, use the default handler
+        key = normalise_url(url)
+        if key in self.excluded_urls:
+            return make_error('URL excluded')
+        result = self._get_cached_result(key)
+        if result is None:
+            result = await self._join_lookup(url, key, make_error, priority)
+        # Callers modify results, so give each a copy
+        result = copy.copy(result)
+        result.url = original_url
+        return result
+
+    async def _join_lookup(self, url, key, make_error, priority):
+        """Wait for the result of looking up *url*, starting the lookup if
+        nobody else is already doing it.
+        """
+        # Don't share across priorities, e.g. a command shouldn't get a
+        # background lookup's refusal to use API quota
+        lookup_key = (key, priority)
+        lookup = self.lookups.get(lookup_key)
+        if lookup is None:
+            task = self.bot.loop.create_task(self._lookup(url, key, make_error, priority))
+            lookup = self.lookups[lookup_key] = _Lookup(task)
+            task.add_done_callback(lambda f: self._forget_lookup(lookup_key, lookup))
         else:
-            # Check that the URL hasn't been excluded
-            for f in self.excludes:
-                if f(url):
-                    return make_error('URL excluded')
-            # Invoke the default handler if not excluded
+            self.log.debug('joining lookup in progress: %s', key)
+        lookup.waiters += 1
+        try:
+            return await asyncio.shield(lookup.task)
+        finally:
+            lookup.waiters -= 1
+            if lookup.waiters == 0 and not lookup.task.done():
+                self._forget_lookup(lookup_key, lookup)
+                lookup.task.cancel()
+
+    def _forget_lookup(self, lookup_key, lookup):
+        if self.lookups.get(lookup_key) is lookup:
+            del self.lookups[lookup_key]
+
+    async def _lookup(self, url, key, make_error, priority):
+        result = await self._get_link_info(url, key, make_error, priority)
+        self._cache_result(key, result)
+        return result
+
+    async def _get_link_info(self, url, key, make_error, priority):
+        quota_exceeded = False
+        # Try matching handlers in registration order
+        for h, match in self.handlers.matches(url):
+            kwargs = {'priority': priority} if h.pass_priority else {}
+            try:
+                result = await maybe_future_result(h.handler(url, match, **kwargs), log=self.log)
+            except QuotaExceeded:
+                quota_exceeded = True
+                result = None
+            if result is not None:
+                # Useful result, return it
+                return result
+            elif h.exclusive:
+                # No result, and exclusive handler
+                return make_error('exclusive handler gave no result', cacheable=not quota_exceeded)
             else:
-                try:
-                    return await self.scrape_html_title(url)
-                except aiohttp.ClientConnectionError:
-                    return make_error('Connection error')
+                # No result, fall through to next handler
+                pass
+
+        result = await self._get_default_link_info(url, key, make_error, remember=not quota_exceeded)
+        if quota_exceeded:
+            # A better handler might work next time
+            result.cacheable = False
+        return result
+
+    async def _get_default_link_info(self, url, key, make_error, remember=True):
+        # If no handlers gave a response, use the default handler, unless the URL has been excluded
+        if self.excludes.any(url):
+            if remember:
+                self.excluded_urls.add(key)
+            return make_error('URL excluded', cacheable=False)
+        try:
+            if MEDIA_URL(url):
+                return await self.scrape_media_info(url)
+            return await self.scrape_html_title(url)
+        except CircuitOpen:
+            # The breaker's cooldown decides when to try again, not the error cache
+            return make_error('Too many recent failures', cacheable=False)
+        except aiohttp.ClientConnectionError:
+            return make_error('Connection error')
+        except asyncio.TimeoutError:
+            return make_error('Timed out')
 
     async def scrape_html_title(self, url):
         """Scrape the ``<title>`` tag contents from the HTML page at *url*.
@@ -211,7 +573,7 @@ class LinkInfo(Plugin):
         make_error = partial(LinkInfoResult, url.geturl(), is_error=True)
 
         # Let's see what's on the other end...
-        async with simple_http_get_async(url.geturl()) as r:
+        async with self.http.get(url.geturl()) as r:
             # Only bother with 200 OK
             if r.status != 200:
                 return make_error('HTTP request failed: {} {}'
@@ -219,6 +581,8 @@ class LinkInfo(Plugin):
             # Only process HTML-ish responses
             if 'Content-Type' not in r.headers:
                 return make_error('No Content-Type header')
+            elif r.headers['Content-Type'].startswith(('image/', 'video/', 'audio/')):
+                return await self._describe_media(url, r)
             elif 'html' not in r.headers['Content-Type']:
                 return make_error('Content-Type not HTML-ish: {}'
                                   .format(r.headers['Content-Type']))
@@ -229,42 +593,25 @@ class LinkInfo(Plugin):
                     return make_error('Content-Length too large: {} bytes, >{}'
                                       .format(r.headers['Content-Length'], max_size))
 
-            # Get the correct parser
             # If present, charset attribute in HTTP Content-Type header takes
             # precedence, but fallback to default if encoding isn't recognised
-            parser = lxml.html.html_parser
-            if r.charset is not None:
-                encoding = r.charset
-                try:
-                    parser = lxml.html.HTMLParser(encoding=encoding)
-                except LookupError:
-                    pass    # Oh well
-
-            # In case Content-Length is absent on a massive file, get only a
-            # reasonable chunk instead. We don't just get the first chunk
-            # because chunk-encoded responses iterate over chunks rather than
-            # the size we request...
-            chunk = b''
-            async for next_chunk in r.content.iter_chunked(self.config.max_response_size):
-                chunk += next_chunk
-                if len(chunk) >= self.config.max_response_size:
+            extractor = TitleExtractor(r.charset)
+
+            # Parse the response as it arrives, and stop reading as soon as the
+            # title is known, or if Content-Length is absent on a massive file,
+            # after a reasonable amount
+            size = 0
+            async for data in r.content.iter_any():
+                size += len(data)
+                if extractor.feed(data) or size >= self.config.max_response_size:
                     break
-            # Try to trim chunk to a tag end to help the HTML parser out
-            try:
-                chunk = chunk[:chunk.rindex(b'>') + 1]
-            except ValueError:
-                pass
+            extractor.close()
+            self.log.debug('read %s bytes of %s to find title', size, url.geturl())
 
-            # Attempt to parse as an HTML document
-            html = lxml.etree.fromstring(chunk, parser)
-            if html is None:
+            if not extractor.found_elements:
                 return make_error('Response not usable as HTML')
 
-            # Attempt to get the <title> tag
-            title = html.findtext('.//title') or ''
-            # Normalise title whitespace
-            title = ' '.join(title.strip().split())
-
+            title = extractor.title
             if not title:
                 return make_error('Missing or empty <title> tag')
 
@@ -275,6 +622,55 @@ class LinkInfo(Plugin):
             result.is_redundant = self._filter_title_in_url(url, title)
             return result
 
+    async def scrape_media_info(self, url):
+        """Describe the image, video or audio file at *url*: its format,
+        dimensions or duration if known, and size.
+
+        Only the start of the file is requested, with a ``Range`` header, and
+        if the server sends more it isn't read.  Returns a
+        :class:`LinkInfoResult`.
+        """
+        make_error = partial(LinkInfoResult, url.geturl(), is_error=True)
+
+        async with self.http.get(url.geturl(), headers=self._media_range(0)) as r:
+            if r.status not in (200, 206):
+                return make_error('HTTP request failed: {} {}'.format(r.status, r.reason))
+            if 'html' not in r.headers.get('Content-Type', ''):
+                return await self._describe_media(url, r)
+        # Not a media file after all, e.g. an image viewer page
+        return await self.scrape_html_title(url)
+
+    def _media_range(self, start):
+        return {'Range': 'bytes={}-{}'.format(start, start + self.config.media_header_size - 1)}
+
+    async def _describe_media(self, url, r):
+        # Total size: from Content-Range for a partial response, otherwise Content-Length
+        size = r.content_length
+        if r.status == 206:
+            total = r.headers.get('Content-Range', '').rpartition('/')[2]
+            size = int(total) if total.isdigit() else None
+
+        data = await self.http.read(r, self.config.media_header_size, truncate=True)
+        info = parse_header(data)
+
+        # The MP4 header can be after the media data, so have one more look there if possible
+        if (info is not None and info.more_at is not None and (size is None or info.more_at < size) and
+                (r.status == 206 or r.headers.get('Accept-Ranges') == 'bytes')):
+            async with self.http.get(url.geturl(), headers=self._media_range(info.more_at)) as r2:
+                if r2.status == 206:
+                    data = await self.http.read(r2, self.config.media_header_size, truncate=True)
+                    info = parse_isobmff(data, info.more_at, info)
+
+        if info is not None:
+            text = info.describe(size)
+        elif 'Content-Type' in r.headers:
+            text = r.headers['Content-Type'].partition(';')[0].strip()
+            if size is not None:
+                text += ' ({})'.format(format_size(size))
+        else:
+            return LinkInfoResult(url.geturl(), 'Unrecognised media file', is_error=True)
+        return LinkInfoResult(url.geturl(), text, nsfw=url.netloc.endswith('.xxx'))
+
     def _filter_title_in_url(self, url, title):
         """See if *title* is represented in *url*.
         """
@@ -317,6 +713,32 @@ class LinkInfo(Plugin):
         # Didn't match
         return False
 
+    def _get_cached_result(self, key):
+        """Get the cached result for normalised URL *key*, if not expired."""
+        cached = self.result_cache.get(key)
+        if cached is None:
+            return None
+        expires, result = cached
+        if expires <= self.bot.loop.time():
+            del self.result_cache[key]
+            return None
+        self.result_cache.move_to_end(key)
+        return result
+
+    def _cache_result(self, key, result):
+        if result is None or not result.cacheable:
+            return
+        ttl = self.config.error_cache_ttl if result.is_error else self.config.result_cache_ttl
+        if ttl <= 0:
+            return
+        self.result_cache[key] = (self.bot.loop.time() + ttl, result)
+        self.result_cache.move_to_end(key)
+        self._trim_result_cache()
+
+    def _trim_result_cache(self):
+        while len(self.result_cache) > max(0, self.config.result_cache_size):
+            self.result_cache.popitem(last=False)
+
     def _log_if_error(self, result):
         """If *result* represents an error, log it.
         """
@@ -346,3 +768,11 @@ class LinkInfo(Plugin):
 
         self.log.debug('rate limiting URL responses')
         return True
+
+    def _release_rate_limit(self, when):
+        """Give back the rate limit slot taken at *when* by :meth:`_rate_limited`."""
+        try:
+            self.rate_limit_list.remove(when)
+        except ValueError:
+            # Already expired
+            pass
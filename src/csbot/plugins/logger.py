@@ -81,6 +81,20 @@ class Logger(Plugin):
     def quit(self, event):
         self.pretty_log.info('{user} has quit'.format(user=event['user']))
 
+    @Plugin.hook('core.netsplit')
+    def netsplit(self, event):
+        self.pretty_log.info('[Netsplit {servers}] {count} users quit: {users}'.format(
+            servers=' <-> '.join(event['servers']),
+            count=len(event['users']),
+            users=', '.join(nick(u) for u in event['users'])))
+
+    @Plugin.hook('core.netjoin')
+    def netjoin(self, event):
+        self.pretty_log.info('[Netjoin {servers}] {count} users rejoined: {users}'.format(
+            servers=' <-> '.join(event['servers']),
+            count=len(event['users']),
+            users=', '.join(nick(u) for u in event['users'])))
+
     @Plugin.hook('core.user.renamed')
     def renamed(self, event):
         self.pretty_log.info('{oldnick} is now {newnick}'.format(
@@ -1,15 +1,165 @@
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import time
+
+import attr
 import pymongo
 import mongomock
 
+from csbot.localdb import LocalClient
 from csbot.plugin import Plugin
 
 
+@attr.s(slots=True)
+class OperationStats:
+    """Latency of one kind of operation on one collection."""
+    #: Number of operations
+    count: int = attr.ib(default=0)
+    #: Number of operations that raised an exception
+    errors: int = attr.ib(default=0)
+    #: Total seconds taken
+    total: float = attr.ib(default=0.0)
+    #: Longest time taken, in seconds
+    max: float = attr.ib(default=0.0)
+
+    def __str__(self):
+        return f'{self.count} ({self.errors} failed), mean {self.mean * 1000:.1f}ms, max {self.max * 1000:.1f}ms'
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def record(self, seconds, error=False):
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+def _query_fields(filter):
+    """Get the fields that could narrow down a query with *filter*, as a set of
+    fields for each branch of a top-level ``$or``.
+    """
+    fields = set()
+    branches = []
+    for key, value in (filter or {}).items():
+        if key == '$or':
+            branches.extend(_query_fields(f)[0] for f in value)
+        elif key == '$and':
+            for f in value:
+                fields.update(_query_fields(f)[0])
+        elif not key.startswith('$'):
+            fields.add(key)
+    if not branches:
+        return [frozenset(fields)]
+    return [frozenset(fields | b) for b in branches]
+
+
+def _operation(name, query=False):
+    async def operation(self, *args, **kwargs):
+        if query:
+            self._check_query(args[0] if args else kwargs.get('filter'), kwargs.get('sort'))
+        return await self._run(name, getattr(self.collection, name), *args, **kwargs)
+    operation.__name__ = operation.__qualname__ = name
+    operation.__doc__ = f'Awaitable :meth:`pymongo.collection.Collection.{name}`.'
+    return operation
+
+
+class AsyncCollection:
+    """Awaitable wrapper for a pymongo :class:`~pymongo.collection.Collection`.
+
+    Each operation runs in *executor*, so it doesn't block the event loop, and
+    its latency (including waiting for a free thread) is recorded in *stats*, a
+    mapping of ``"{collection}.{operation}"`` to :class:`OperationStats`.  The
+    underlying collection is :attr:`collection`.
+
+    A warning is logged on *log* the first time each kind of query is made that
+    none of *indexes* (a list of :class:`pymongo.IndexModel`) can be used for,
+    i.e. that has to scan the whole collection.
+    """
+    def __init__(self, collection, executor, stats, *, loop, indexes=(), log=None):
+        self.collection = collection
+        self.executor = executor
+        self.stats = stats
+        self.loop = loop
+        self.log = log
+        self.indexes = list(indexes)
+        self._checked_queries = set()
+
+    def _check_query(self, filter, sort=None):
+        first_keys = {'_id'} | {next(iter(i.document['key'])) for i in self.indexes}
+        for fields in _query_fields(filter):
+            shape = (fields, sort[0][0] if sort else None)
+            if shape in self._checked_queries:
+                continue
+            self._checked_queries.add(shape)
+            if fields:
+                supported = not fields.isdisjoint(first_keys)
+            else:
+                # Reading everything is fine, unless it's also sorted
+                supported = not sort or sort[0][0] in first_keys
+            if not supported and self.log is not None:
+                self.log.warning('no index for %s query on %s%s', self.collection.name,
+                                 ', '.join(sorted(fields)) or 'all documents',
+                                 f' sorted by {sort[0][0]}' if sort else '')
+
+    async def _run(self, name, f, *args, **kwargs):
+        start = time.perf_counter()
+        error = False
+        try:
+            return await self.loop.run_in_executor(self.executor, partial(f, *args, **kwargs))
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.stats[f'{self.collection.name}.{name}'].record(time.perf_counter() - start, error)
+
+    async def find(self, filter=None, *args, **kwargs) -> list:
+        """Awaitable :meth:`pymongo.collection.Collection.find`, which reads
+        the whole result into a list (so use *limit* for large results).
+        """
+        self._check_query(filter, kwargs.get('sort'))
+        return await self._run('find', lambda: list(self.collection.find(filter, *args, **kwargs)))
+
+    find_one = _operation('find_one', query=True)
+    count_documents = _operation('count_documents', query=True)
+    insert_one = _operation('insert_one')
+    insert_many = _operation('insert_many')
+    replace_one = _operation('replace_one', query=True)
+    update_one = _operation('update_one', query=True)
+    update_many = _operation('update_many', query=True)
+    delete_one = _operation('delete_one', query=True)
+    delete_many = _operation('delete_many', query=True)
+    bulk_write = _operation('bulk_write')
+    create_index = _operation('create_index')
+    create_indexes = _operation('create_indexes')
+
+
 class MongoDB(Plugin):
     """A plugin that provides access to a MongoDB server via pymongo.
+
+    With ``mode = "local"``, collections are instead kept in a SQLite database
+    file at ``path`` (see :mod:`csbot.localdb`), for running without a server.
+
+    Plugins get an :class:`AsyncCollection`, so that database operations don't
+    block the event loop; they run in a pool of ``pool_size`` threads.  Plugins
+    can declare the indexes their queries need, either as
+    :class:`pymongo.IndexModel` objects (e.g. for TTL indexes) or as index keys,
+    and they are created in the background if they don't exist::
+
+        class Foo(Plugin):
+            things = Plugin.use('mongodb', collection='things', indexes=[
+                [('owner', pymongo.ASCENDING), ('when', pymongo.DESCENDING)],
+                pymongo.IndexModel('expires', expireAfterSeconds=0),
+            ])
     """
     CONFIG_DEFAULTS = {
         'uri': 'mongodb://localhost:27017/csbot',
         'mode': 'uri',
+        'pool_size': 4,
+        'path': 'csbot.sqlite3',
     }
 
     CONFIG_ENVVARS = {
@@ -18,18 +168,67 @@ class MongoDB(Plugin):
 
     def __init__(self, *args, **kwargs):
         super(MongoDB, self).__init__(*args, **kwargs)
-        self.log.info('connecting to mongodb: ' + self.config_get('uri'))
+        if self.config_get('mode') not in ('uri', 'mock', 'local'):
+            raise ValueError('Expected a mode of "uri", "mock" or "local"')
+        self.client = None
+        self.db = None
+        self.executor = ThreadPoolExecutor(int(self.config_get('pool_size')), thread_name_prefix='mongodb')
+        #: Latency of operations, see :class:`AsyncCollection`
+        self.stats = collections.defaultdict(OperationStats)
+        # Tasks creating indexes in the background
+        self.index_tasks = set()
+
+    async def setup(self):
+        super(MongoDB, self).setup()
+        # Creating a client can block, e.g. resolving a mongodb+srv:// URI
+        self.client, self.db = await self.bot.loop.run_in_executor(self.executor, self._connect)
+
+    async def teardown(self):
+        if self.index_tasks:
+            await asyncio.wait(self.index_tasks, loop=self.bot.loop)
+        for name, stats in sorted(self.stats.items()):
+            self.log.info('%s: %s', name, stats)
+        # Let queued operations finish before closing the client
+        await self.bot.loop.run_in_executor(None, self._close)
+        super(MongoDB, self).teardown()
 
+    def _connect(self):
         if self.config_get('mode') == 'uri':
-            self.client = pymongo.MongoClient(self.config_get('uri'))
-            self.db = self.client.get_database()
-        elif self.config_get('mode') == 'mock':
-            self.log.info('using mock instead')
-            self.client = mongomock.MongoClient()
-            self.db = self.client.db
+            self.log.info('connecting to mongodb: ' + self.config_get('uri'))
+            client = pymongo.MongoClient(self.config_get('uri'))
+            return client, client.get_database()
+        elif self.config_get('mode') == 'local':
+            self.log.info('using local database: ' + self.config_get('path'))
+            client = LocalClient(self.config_get('path'))
+            return client, client.get_database()
         else:
-            raise ValueError('Expected a mode of either "uri" or "mock"')
+            self.log.info('using mock mongodb')
+            client = mongomock.MongoClient()
+            return client, client.db
 
-    def provide(self, plugin_name, collection):
-        """Get a MongoDB collection for ``{plugin_name}__{collection}``."""
-        return self.db['{}__{}'.format(plugin_name, collection)]
+    def _close(self):
+        self.executor.shutdown(wait=True)
+        if self.client is not None:
+            self.client.close()
+
+    def provide(self, plugin_name, collection, indexes=()):
+        """Get an :class:`AsyncCollection` for ``{plugin_name}__{collection}``,
+        starting to create *indexes* if there are any.
+        """
+        indexes = [i if isinstance(i, pymongo.IndexModel) else pymongo.IndexModel(i) for i in indexes]
+        collection = AsyncCollection(self.db['{}__{}'.format(plugin_name, collection)],
+                                     self.executor, self.stats, loop=self.bot.loop, indexes=indexes, log=self.log)
+        if indexes:
+            task = self.bot.loop.create_task(collection.create_indexes(indexes))
+            self.index_tasks.add(task)
+            task.add_done_callback(partial(self._index_task_done, collection.collection.name))
+        return collection
+
+    def _index_task_done(self, name, task):
+        self.index_tasks.discard(task)
+        if task.cancelled():
+            return
+        elif task.exception() is not None:
+            self.log.error('failed to create indexes for %s', name, exc_info=task.exception())
+        else:
+            self.log.info('indexes for %s: %s', name, ', '.join(task.result()))
@@ -1,4 +1,5 @@
 from csbot.plugin import Plugin
+import asyncio
 from datetime import datetime, timedelta
 import math
 
@@ -15,14 +16,15 @@ class TermDates(Plugin):
     db_terms = Plugin.use('mongodb', collection='terms')
     db_weeks = Plugin.use('mongodb', collection='weeks')
 
-    def setup(self):
+    async def setup(self):
         super(TermDates, self).setup()
 
         # If we have stuff in mongodb, we can just load it directly.
-        if self.db_terms.find_one():
+        terms = await self.db_terms.find_one()
+        if terms:
             self.initialised = True
-            self.terms = self.db_terms.find_one()
-            self.weeks = self.db_weeks.find_one()
+            self.terms = terms
+            self.weeks = await self.db_weeks.find_one()
             return
 
         # If no term dates have been set, the calendar is uninitialised and
@@ -158,7 +160,7 @@ class TermDates(Plugin):
 
     @Plugin.command('termdates.set',
                     help='termdates.set <aut> <spr> <sum>: set the term dates')
-    def termdates_set(self, e):
+    async def termdates_set(self, e):
         dates = e['data'].split()
 
         if len(dates) < 3:
@@ -193,11 +195,18 @@ class TermDates(Plugin):
                 week_start = real_start + timedelta(weeks=week-1)
                 self.weeks['{} {}'.format(term, week)] = week_start
 
-        # Save to the database. As we don't touch the _id attribute in this
-        # method, this will cause `save` to override the previously-loaded
-        # entry (if there is one).
-        self.db_terms.save(self.terms)
-        self.db_weeks.save(self.weeks)
+        # Save to the database, replacing the previously-loaded entry (if
+        # there is one), which has the only _id in the collection.
+        await asyncio.gather(self._save(self.db_terms, self.terms),
+                             self._save(self.db_weeks, self.weeks))
 
         # Finally, we're initialised!
         self.initialised = True
+
+    @staticmethod
+    async def _save(db, document):
+        """Insert *document*, or replace it if it has been saved before."""
+        if '_id' in document:
+            await db.replace_one({'_id': document['_id']}, document, upsert=True)
+        else:
+            await db.insert_one(document)
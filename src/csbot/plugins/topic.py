@@ -5,6 +5,7 @@ from csbot.plugin import Plugin
 
 class Topic(Plugin):
     PLUGIN_DEPENDS = ['auth']
+    PLUGIN_STATE = ['topics']
 
     CONFIG_DEFAULTS = {
         'history': 5,
@@ -16,18 +17,17 @@ class Topic(Plugin):
     def setup(self):
         super(Topic, self).setup()
         self.topics = defaultdict(deque)
+        self.config_table = self.build_config_table()
+
+    def reconfigure(self, old, new):
+        self.config_table = self.build_config_table()
 
     def config_get(self, key, channel=None):
         """A special implementation of :meth:`Plugin.config_get` which looks at
         a channel-based configuration subsection before the plugin's
         configuration section.
         """
-        default = super(Topic, self).config_get(key)
-
-        if channel is None:
-            return default
-        else:
-            return self.subconfig(channel).get(key, default)
+        return self.config_table[channel, key]
 
     def _get_delimiters(self, channel):
         """Get the delimiters for a channel.
@@ -27,6 +27,8 @@ class UserDict(defaultdict):
 
 
 class UserTrack(Plugin):
+    PLUGIN_STATE = ['_users']
+
     def setup(self):
         super(UserTrack, self).setup()
         self._users = UserDict()
@@ -36,6 +38,11 @@ class UserTrack(Plugin):
         user = self._users[nick(e['user'])]
         user['channels'].add(e['channel'])
 
+    @Plugin.hook('core.netjoin')
+    def _netjoin(self, e):
+        for join in e['joins']:
+            self._channel_joined(join)
+
     @Plugin.hook('core.channel.left')
     def _channel_left(self, e):
         user = self._users[nick(e['user'])]
@@ -71,6 +78,11 @@ class UserTrack(Plugin):
         # User is gone, remove record
         del self._users[nick(e['user'])]
 
+    @Plugin.hook('core.netsplit')
+    def _netsplit(self, e):
+        for user in e['users']:
+            self._users.pop(nick(user), None)
+
     def get_user(self, nick):
         """Get a copy of the user record for *nick*.
         """
@@ -11,10 +11,11 @@ class WebServer(Plugin):
         'port': 1337,
     }
 
-    def setup(self):
+    async def setup(self):
+        super().setup()
         # Setup server
-        self.bot.loop.run_until_complete(self._build_app())
-        self.bot.loop.run_until_complete(self._start_app())
+        await self._build_app()
+        await self._start_app()
 
     async def _build_app(self):
         self.app = web.Application()
@@ -33,8 +34,8 @@ class WebServer(Plugin):
         self.app_runner = None
         self.site = None
 
-    def teardown(self):
-        self.bot.loop.run_until_complete(self._stop_app())
+    async def teardown(self):
+        await self._stop_app()
 
         super().teardown()
 
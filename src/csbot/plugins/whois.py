@@ -1,3 +1,5 @@
+import pymongo
+
 from csbot.plugin import Plugin
 from csbot.util import nick
 
@@ -8,40 +10,41 @@ class Whois(Plugin):
 
     PLUGIN_DEPENDS = ['usertrack']
 
-    whoisdb = Plugin.use('mongodb', collection='whois')
+    whoisdb = Plugin.use('mongodb', collection='whois', indexes=[
+        [('account', pymongo.ASCENDING), ('channel', pymongo.ASCENDING)],
+        [('nick', pymongo.ASCENDING), ('channel', pymongo.ASCENDING)],
+    ])
 
-    def whois_lookup(self, nick, channel, db=None):
+    async def whois_lookup(self, nick, channel, db=None):
         """Performs a whois lookup for a nick"""
         db = db or self.whoisdb
 
-        for ident in (self.identify_user(nick, channel),  # lookup channel specific first
-                      self.identify_user(nick)):          # default fallback
-            user = db.find_one(ident)
-            if user:
-                return user['data']
+        # Channel specific first, falling back to the default
+        users = await db.find({'$or': [self.identify_user(nick, channel), self.identify_user(nick)]})
+        for user in sorted(users, key=lambda u: u['channel'] is None):
+            return user['data']
 
-    def whois_set(self, nick, whois_str, channel=None, db=None):
+    async def whois_set(self, nick, whois_str, channel=None, db=None):
         db = db or self.whoisdb
 
-        ident = self.whois_unset(nick, channel=channel)
-        ident['data'] = whois_str
-        db.insert_one(ident)
+        ident = self.identify_user(nick, channel=channel)
+        await db.replace_one(ident, dict(ident, data=whois_str), upsert=True)
 
-    def whois_unset(self, nick, channel=None, db=None):
+    async def whois_unset(self, nick, channel=None, db=None):
         db = db or self.whoisdb
 
         ident = self.identify_user(nick, channel=channel)
-        db.delete_many(ident)
+        await db.delete_many(ident)
 
         return ident
 
     @Plugin.command('whois', help=('whois [nick]: show whois data for'
                                    ' a nick, or for yourself if omitted'))
-    def whois(self, e):
+    async def whois(self, e):
         """Look up a user by nick, and return what data they have set for
         themselves (or an error message if there is no data)"""
         nick_ = e['data'] or nick(e['user'])
-        res = self.whois_lookup(nick_, e['channel'])
+        res = await self.whois_lookup(nick_, e['channel'])
 
         if res is None:
             e.reply('No data for {}'.format(nick_))
@@ -51,21 +54,21 @@ class Whois(Plugin):
     @Plugin.command('whois.setdefault', help=('whois.setdefault [default_whois]: sets the default'
                                               ' whois text for the user, used when no channel-specific'
                                               ' one is set'))
-    def setdefault(self, e):
-        self.whois_set(nick(e['user']), e['data'], channel=None)
+    async def setdefault(self, e):
+        await self.whois_set(nick(e['user']), e['data'], channel=None)
 
     @Plugin.command('whois.set')
-    def set(self, e):
+    async def set(self, e):
         """Allow a user to associate data with themselves for this channel."""
-        self.whois_set(nick(e['user']), e['data'], channel=e['channel'])
+        await self.whois_set(nick(e['user']), e['data'], channel=e['channel'])
 
     @Plugin.command('whois.unset')
-    def unset(self, e):
-        self.whois_unset(nick(e['user']), channel=e['channel'])
+    async def unset(self, e):
+        await self.whois_unset(nick(e['user']), channel=e['channel'])
 
     @Plugin.command('whois.unsetdefault')
-    def unsetdefault(self, e):
-        self.whois_unset(nick(e['user']))
+    async def unsetdefault(self, e):
+        await self.whois_unset(nick(e['user']))
 
     def identify_user(self, nick, channel=None):
         """Identify a user: by account if authed, if not, by nick. Produces a dict
@@ -2,8 +2,8 @@ import html
 import random
 
 from ..plugin import Plugin
-from ..util import simple_http_get_async, cap_string, is_ascii
-from .linkinfo import LinkInfoResult
+from ..util import cap_string, is_ascii
+from .linkinfo import LinkInfoResult, URLSpec
 
 
 def fix_json_unicode(data):
@@ -28,22 +28,28 @@ def fix_json_unicode(data):
     return data
 
 
-async def get_info(number=None):
+#: Seconds to cache a specific comic for (they don't change)
+COMIC_TTL = 7 * 24 * 60 * 60
+
+
+async def get_info(http, number=None):
     """Gets the json data for a particular comic
-    (or the latest, if none provided).
+    (or the latest, if none provided), using the HTTP client *http*.
     """
     if number:
         url = "http://xkcd.com/{}/info.0.json".format(number)
+        ttl = COMIC_TTL
     else:
         url = "http://xkcd.com/info.0.json"
+        ttl = None
 
-    async with simple_http_get_async(url) as httpdata:
-        if httpdata.status != 200:
-            return None
+    httpdata = await http.fetch(url, ttl=ttl)
+    if httpdata.status != 200:
+        return None
 
-        # Only care about part of the data
-        httpjson = await httpdata.json()
-        data = {key: httpjson[key] for key in ["title", "alt", "num"]}
+    # Only care about part of the data
+    httpjson = httpdata.json()
+    data = {key: httpjson[key] for key in ["title", "alt", "num"]}
 
     # Unfuck up unicode strings
     data = fix_json_unicode(data)
@@ -57,6 +63,8 @@ class xkcd(Plugin):
     Based on williebot xkcd plugin.
     """
 
+    http = Plugin.use('@bot', service='http')
+
     class XKCDError(Exception):
         pass
 
@@ -65,7 +73,7 @@ class xkcd(Plugin):
         Returns a string of the response.
         """
 
-        latest = await get_info()
+        latest = await get_info(self.http)
         if not latest:
             raise self.XKCDError("Error getting comics")
 
@@ -74,12 +82,12 @@ class xkcd(Plugin):
         if not user_str or user_str in {'0', 'latest', 'current', 'newest'}:
             requested = latest
         elif user_str in {'rand', 'random'}:
-            requested = await get_info(random.randint(1, latest_num))
+            requested = await get_info(self.http, random.randint(1, latest_num))
         else:
             try:
                 num = int(user_str)
                 if 1 <= num <= latest_num:
-                    requested = await get_info(num)
+                    requested = await get_info(self.http, num)
                 else:
                     raise self.XKCDError("Comic #{} is invalid. The latest is #{}"
                                          .format(num, latest_num))
@@ -110,7 +118,7 @@ class xkcd(Plugin):
             except self.XKCDError:
                 return None
 
-        linkinfo.register_handler(lambda url: url.netloc == "xkcd.com",
+        linkinfo.register_handler(URLSpec(hosts=["xkcd.com"]),
                                   page_handler, exclusive=True)
 
     @Plugin.command('xkcd')
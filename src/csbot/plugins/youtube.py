@@ -5,7 +5,8 @@ import isodate
 from aiogoogle import Aiogoogle, HTTPError
 
 from ..plugin import Plugin
-from .linkinfo import LinkInfoResult
+from ..quota import Priority, QuotaExceeded
+from .linkinfo import LinkInfoResult, URLSpec
 
 
 def get_yt_id(url):
@@ -43,6 +44,15 @@ class YoutubeError(Exception):
                         self.http_error.res.json['error']['message'])
         return s
 
+    @property
+    def quota_exceeded(self):
+        """Was the error caused by the API quota being used up?"""
+        try:
+            errors = self.http_error.res.json['error']['errors']
+            return any(e.get('reason') in {'quotaExceeded', 'dailyLimitExceeded'} for e in errors)
+        except (KeyError, TypeError, AttributeError):
+            return False
+
 
 class Youtube(Plugin):
     """A plugin that does some youtube things.
@@ -50,6 +60,11 @@ class Youtube(Plugin):
     """
     CONFIG_DEFAULTS = {
         'api_key': '',
+        # YouTube Data API quota, in units per day (YouTube's day starts at
+        # midnight Pacific time, but the budget is reset at midnight UTC)
+        'quota_daily': 10000,
+        # Fraction of the quota kept for commands
+        'quota_reserve': 0.2,
     }
 
     CONFIG_ENVVARS = {
@@ -59,7 +74,24 @@ class Youtube(Plugin):
     RESPONSE = '"{title}" [{duration}] (by {uploader} at {uploaded}) | Views: {views} [{likes}]'
     CMD_RESPONSE = RESPONSE + ' | {link}'
 
-    async def get_video_json(self, id):
+    #: Quota cost of a ``videos.list`` request
+    VIDEOS_LIST_COST = 1
+
+    quota = Plugin.use('@bot', service='quota')
+
+    def setup(self):
+        super().setup()
+        self._update_budget()
+
+    def reconfigure(self, old, new):
+        self._update_budget()
+
+    def _update_budget(self):
+        self.quota.budget('youtube', int(self.config_get('quota_daily')),
+                          reserve=float(self.config_get('quota_reserve')))
+
+    async def get_video_json(self, id, priority=Priority.INTERACTIVE):
+        await self.quota.acquire('youtube', cost=self.VIDEOS_LIST_COST, priority=priority)
         async with Aiogoogle(api_key=self.config_get('api_key')) as aiogoogle:
             youtube_v3 = await aiogoogle.discover('youtube', 'v3')
             request = youtube_v3.videos.list(id=id, hl='en', part='snippet,contentDetails,statistics')
@@ -69,21 +101,24 @@ class Youtube(Plugin):
             else:
                 return response['items'][0]
 
-    async def _yt(self, url):
+    async def _yt(self, url, priority=Priority.INTERACTIVE):
         """Builds a nicely formatted version of youtube's own internal JSON"""
 
         vid_id = get_yt_id(url)
         if not vid_id:
             return None
         try:
-            json = await self.get_video_json(vid_id)
+            json = await self.get_video_json(vid_id, priority)
             if json is None:
                 return None
         except (KeyError, ValueError):
             return None
         except HTTPError as e:
             # Chain our own exception that gets a more sanitised error message
-            raise YoutubeError(e) from e
+            error = YoutubeError(e)
+            if error.quota_exceeded:
+                self.quota.budgets['youtube'].exhaust()
+            raise error from e
 
         vid_info = {}
         try:
@@ -143,19 +178,20 @@ class Youtube(Plugin):
     def linkinfo_integrate(self, linkinfo):
         """Handle recognised youtube urls."""
 
-        async def page_handler(url, match):
+        async def page_handler(url, match, priority):
             """Handles privmsg urls."""
             try:
-                response = await self._yt(url)
+                response = await self._yt(url, priority)
                 if response:
                     return LinkInfoResult(url.geturl(), self.RESPONSE.format(**response))
                 else:
                     return None
             except YoutubeError as e:
                 return LinkInfoResult(url.geturl(), str(e), is_error=True)
+            # (QuotaExceeded falls through to the next handler, which needs no quota)
 
-        linkinfo.register_handler(lambda url: url.netloc in {"m.youtube.com", "www.youtube.com", "youtu.be"},
-                                  page_handler)
+        linkinfo.register_handler(URLSpec(hosts=["m.youtube.com", "www.youtube.com", "youtu.be"]), page_handler,
+                                  pass_priority=True)
 
     @Plugin.command('youtube')
     @Plugin.command('yt')
@@ -168,5 +204,5 @@ class Youtube(Plugin):
                 e.reply("Invalid video ID")
             else:
                 e.reply(self.CMD_RESPONSE.format(**response))
-        except YoutubeError as exc:
+        except (YoutubeError, QuotaExceeded) as exc:
             e.reply("Error: " + str(exc))
@@ -0,0 +1,176 @@
+"""Client-side accounting for quota-limited APIs.
+
+Some APIs (e.g. YouTube, Imgur) allow only so many requests, or "cost units",
+per day or hour.  The bot has a :class:`QuotaManager` which plugins get with
+:meth:`.Plugin.use`, and each API has a :class:`Budget` that the plugin spends
+from before making a request::
+
+    class Foo(Plugin):
+        quota = Plugin.use('@bot', service='quota')
+
+        def setup(self):
+            super().setup()
+            self.quota.budget('foo', limit=1000, period=24 * 60 * 60)
+
+        async def lookup(self, thing, priority=Priority.INTERACTIVE):
+            await self.quota.acquire('foo', cost=1, priority=priority)
+            ...
+
+Part of each budget is reserved for :attr:`Priority.INTERACTIVE` lookups (i.e.
+commands), so once a budget is nearly spent :attr:`Priority.BACKGROUND`
+lookups (e.g. linkinfo scanning messages for URLs) are refused first.  The
+priority defaults to interactive; code that does automatic lookups passes
+``priority=Priority.BACKGROUND`` along to :meth:`QuotaManager.acquire`.  If the
+API reports its own view of the quota, pass it to
+:meth:`Budget.observe`, or :meth:`Budget.observe_headers` for
+``X-RateLimit-*`` response headers.
+
+Accounting is in memory, so it starts again from zero when the bot restarts.
+"""
+import asyncio
+import enum
+import time
+
+from .util import pluralize
+
+
+class Priority(enum.IntEnum):
+    #: Automatic lookups, e.g. URLs seen in messages
+    BACKGROUND = 0
+    #: Lookups a user asked for, e.g. commands
+    INTERACTIVE = 1
+
+
+class QuotaExceeded(Exception):
+    """Not enough of *budget* is left for a lookup with *priority*."""
+    def __init__(self, budget, priority):
+        super().__init__(budget, priority)
+        self.budget = budget
+        self.priority = priority
+
+    def __str__(self):
+        if self.priority < Priority.INTERACTIVE and self.budget.remaining > 0:
+            return f'{self.budget.name} quota reserved for commands'
+        return f'{self.budget.name} quota exhausted'
+
+
+class Budget:
+    """A quota of *limit* cost units per *period* seconds for API *name*.
+
+    Periods start at multiples of *period* since the epoch, e.g. midnight UTC
+    for a daily quota, unless the API says otherwise with :meth:`observe`.  A
+    *reserve* fraction of *limit* can only be spent by interactive lookups.
+    """
+    def __init__(self, name, limit, period, reserve=0.2):
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.reserve = reserve
+        self.used = 0
+        self.reset_at = 0
+        self._roll(time.time())
+
+    def __str__(self):
+        return f'{self.name}: {self.remaining}/{self.limit} left'
+
+    @property
+    def remaining(self):
+        self._roll(time.time())
+        return max(0, self.limit - self.used)
+
+    def _roll(self, now):
+        if now >= self.reset_at:
+            self.used = 0
+            self.reset_at = now - (now % self.period) + self.period
+
+    def allows(self, cost, priority):
+        """Can a lookup with *priority* spend *cost* units now?"""
+        remaining = self.remaining
+        if priority < Priority.INTERACTIVE:
+            remaining -= int(self.limit * self.reserve)
+        return cost <= remaining
+
+    def spend(self, cost):
+        self._roll(time.time())
+        self.used += cost
+
+    def observe(self, remaining=None, limit=None, reset=None):
+        """Update the budget from the API's own view of the quota.
+
+        *remaining* and *limit* are in cost units; *reset* is the time (as
+        :func:`time.time`) when the quota is next replenished.  Any of them can
+        be None if unknown.
+        """
+        self._roll(time.time())
+        if limit is not None:
+            self.limit = limit
+        if remaining is not None:
+            self.used = max(0, self.limit - remaining)
+        if reset is not None:
+            self.reset_at = reset
+
+    def observe_headers(self, headers,
+                        remaining='X-RateLimit-Remaining',
+                        limit='X-RateLimit-Limit',
+                        reset='X-RateLimit-Reset'):
+        """Update the budget from rate limit response *headers*, using the
+        named headers (the reset time in seconds since the epoch).  Missing or
+        invalid headers are ignored.
+        """
+        def get(name):
+            try:
+                return int(headers[name])
+            except (KeyError, TypeError, ValueError):
+                return None
+        self.observe(get(remaining), get(limit), get(reset))
+
+    def exhaust(self, reset=None):
+        """Mark the budget as spent, e.g. because the API reported that the
+        quota was exceeded.
+        """
+        self.observe(remaining=0, reset=reset)
+
+
+class QuotaManager:
+    """Keeps the :class:`Budget` for each quota-limited API."""
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.budgets = {}
+
+    def budget(self, name, limit, period=24 * 60 * 60, reserve=0.2) -> Budget:
+        """Get the budget for *name*, creating it if it doesn't exist.
+
+        If it does exist, its *limit*, *period* and *reserve* are updated, so
+        this can be called again when a plugin is reconfigured or reloaded
+        without losing track of what has been spent.
+        """
+        budget = self.budgets.get(name)
+        if budget is None:
+            budget = self.budgets[name] = Budget(name, limit, period, reserve)
+        else:
+            budget.limit, budget.period, budget.reserve = limit, period, reserve
+        return budget
+
+    async def acquire(self, *names, cost=1, priority=Priority.INTERACTIVE, wait=0):
+        """Spend *cost* units from the budget for each of *names*, e.g. for an
+        API with both per-client and per-user quotas.
+
+        If a budget doesn't allow it for *priority*, wait for the budget to
+        reset if that's within *wait* seconds, otherwise raise
+        :exc:`QuotaExceeded`.  Nothing is spent unless all of the budgets allow
+        it.
+        """
+        budgets = [self.budgets[name] for name in names]
+        for budget in budgets:
+            while not budget.allows(cost, priority):
+                delay = budget.reset_at - time.time()
+                if delay > wait:
+                    raise QuotaExceeded(budget, priority)
+                await asyncio.sleep(max(0, delay), loop=self.loop)
+        for budget in budgets:
+            budget.spend(cost)
+
+    def describe(self):
+        """Summarise all budgets, e.g. ``"2 quotas: imgur: 40/50 left, ..."``."""
+        return '{}: {}'.format(pluralize(len(self.budgets), 'quota', 'quotas'),
+                               ', '.join(str(b) for b in self.budgets.values()) or 'none')
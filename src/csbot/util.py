@@ -2,7 +2,9 @@ import shlex
 from itertools import tee
 from collections import deque, OrderedDict
 import asyncio
+import hashlib
 import logging
+import math
 from typing import (
     Dict,
     Iterator,
@@ -67,6 +69,19 @@ def is_channel(channel):
     return channel.startswith('#')
 
 
+_IRC_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\~', 'abcdefghijklmnopqrstuvwxyz{}|^')
+
+
+def irc_lower(s):
+    """Lowercase a nick or channel name using the RFC 1459 case mapping, in
+    which ``[]\\~`` are the uppercase forms of ``{}|^``.
+
+    >>> irc_lower('Nick[away]')
+    'nick{away}'
+    """
+    return s.translate(_IRC_LOWER)
+
+
 def parse_arguments(raw):
     """Parse *raw* into a list of arguments using :mod:`shlex`.
 
@@ -114,6 +129,11 @@ def simple_http_get(url, stream=False):
 
 @asynccontextmanager
 async def simple_http_get_async(url, **kwargs):
+    """Make a one-off HTTP GET request with a new :class:`aiohttp.ClientSession`.
+
+    Plugins should use the bot's shared :class:`~csbot.httpclient.HTTPClient`
+    instead, which pools connections.
+    """
     session_kwargs = {
         'headers': {
             'User-Agent': 'csbot/0.1',
@@ -480,3 +500,56 @@ class RateLimited:
                 except asyncio.QueueEmpty:
                     break
         return cancelled
+
+
+class BloomFilter:
+    """A set-like filter that can say an item has *probably* been added, or
+    has definitely not been added, using a fixed amount of memory.
+
+    Sized for *capacity* items with a false positive rate of *error_rate*.
+    Adding more than *capacity* items would increase the false positive rate,
+    so the filter is cleared instead, i.e. it remembers at most the last
+    *capacity* items (and some older ones).  A *capacity* of 0 disables the
+    filter, so nothing is ever in it.
+
+    >>> f = BloomFilter(100)
+    >>> f.add('a')
+    >>> 'a' in f, 'b' in f
+    (True, False)
+    """
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2))) if capacity > 0 else 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        # Double hashing: the i-th position is h1 + i * h2
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item: str):
+        if self.capacity <= 0 or item in self:
+            return
+        if self._count >= self.capacity:
+            self.clear()
+        for p in self._positions(item):
+            self._bits[p >> 3] |= 1 << (p & 7)
+        self._count += 1
+
+    def __contains__(self, item: str) -> bool:
+        if self.capacity <= 0:
+            return False
+        return all(self._bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def __len__(self):
+        """Approximate number of items added since the filter was last cleared."""
+        return self._count
+
+    def clear(self):
+        self._bits = bytearray(len(self._bits))
+        self._count = 0
@@ -0,0 +1,710 @@
+"""Run plugins in worker processes.
+
+Plugins named in the ``worker_plugins`` bot option are each run in a separate
+Python process, so that CPU-heavy plugins don't hold up the bot's event loop::
+
+    ["@bot"]
+    plugins = ["auth", "calc", "linkinfo"]
+    worker_plugins = ["calc"]
+
+In the bot process the plugin is replaced by a :class:`WorkerPlugin`, which
+forwards the events the plugin hooks and the commands it provides to the worker
+process over a Unix socket.  In the worker process the plugin's ``bot`` is a
+:class:`WorkerBot`, which sends replies, events and other calls back to the
+bot process, and the plugin's dependencies are :class:`RemotePlugin` objects,
+so :meth:`.Plugin.use` keeps working.
+
+Messages are pickled, and there are some limitations:
+
+* Event values that can't be pickled are replaced with ``None``.
+* Values returned from the bot process that can't be pickled, and values
+  provided by :meth:`.Plugin.use`, are :class:`RemoteObject` proxies whose
+  methods are also called in the bot process.
+* Calls to the bot process block the worker until they complete, except for
+  methods that send to IRC (e.g. ``reply()``) and events, which are sent
+  without waiting, and coroutine methods (e.g. of the collections provided by
+  the ``mongodb`` plugin), which return a future to await.
+* Integrations (:meth:`.Plugin.integrate_with`) aren't supported, because
+  the other plugin can't call back into the worker process.
+* A plugin running in a worker process can't provide values to plugins in the
+  bot process.
+"""
+import asyncio
+from collections import abc
+import io
+import itertools
+import logging
+import os
+import pickle
+import socket
+import struct
+import sys
+import threading
+import types
+from typing import Mapping, MutableMapping, Type
+
+from .events import Event
+from .httpclient import HTTPClient
+from .quota import QuotaManager
+from .plugin import Plugin, PluginFeatureError, reload_plugin_class
+from .util import maybe_future, maybe_future_result
+
+
+LOG = logging.getLogger(__name__)
+
+# Each message is a pickle, preceded by its length
+_HEADER = struct.Struct('!I')
+# Exceptions that mean something couldn't be pickled
+_PICKLE_ERRORS = (pickle.PicklingError, TypeError, AttributeError)
+# Returned by Worker.call() for an attribute that is a method, which should be called remotely instead
+_METHOD = object()
+# ... or a coroutine method, which should be called remotely without blocking the worker
+_COROUTINE_METHOD = object()
+
+
+class WorkerError(Exception):
+    """An error in a worker process, or the worker process exiting unexpectedly."""
+
+
+class _ByRef:
+    """Wrapper to send *obj* as a reference instead of pickling it."""
+    def __init__(self, obj, kind='obj'):
+        self.obj = obj
+        self.kind = kind
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file, persistent_id):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self._persistent_id = persistent_id
+
+    def persistent_id(self, obj):
+        return self._persistent_id(obj)
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, persistent_load):
+        super().__init__(file)
+        self._persistent_load = persistent_load
+
+    def persistent_load(self, pid):
+        return self._persistent_load(pid)
+
+
+def _encode(message, persistent_id):
+    f = io.BytesIO()
+    _Pickler(f, persistent_id).dump(message)
+    data = f.getvalue()
+    return _HEADER.pack(len(data)) + data
+
+
+def _decode(data, persistent_load):
+    return _Unpickler(io.BytesIO(data), persistent_load).load()
+
+
+def _error(exc, persistent_id):
+    """Get a picklable version of *exc*."""
+    try:
+        _encode(exc, persistent_id)
+    except _PICKLE_ERRORS:
+        return WorkerError(f'{type(exc).__name__}: {exc}')
+    else:
+        return exc
+
+
+class WorkerPlugin(Plugin):
+    """Stand-in for a plugin running in a worker process.
+
+    Use :meth:`wrap` to create a subclass for a specific plugin class, which
+    has the same name, dependencies and configuration.  :meth:`setup` starts
+    the worker process and :meth:`teardown` stops it.
+    """
+
+    #: The plugin class run in the worker process.
+    hosted: Type[Plugin] = None
+    #: Seconds to wait for the worker process to exit before killing it.
+    EXIT_TIMEOUT = 5
+
+    @classmethod
+    def wrap(cls, hosted: Type[Plugin]) -> Type["WorkerPlugin"]:
+        """Create a :class:`WorkerPlugin` subclass to run *hosted*."""
+        data = hosted._Plugin__plugin_data
+        if len(data.integrations) > 0:
+            LOG.warning(f"integrations not supported in worker process, ignoring for {hosted.plugin_name()}")
+
+        def body(ns):
+            ns['hosted'] = hosted
+            ns['PLUGIN_DEPENDS'] = sorted(data.dependencies)
+            ns['Config'] = getattr(hosted, 'Config', None)
+        return types.new_class(f'Worker{hosted.__name__}', (cls,), exec_body=body)
+
+    @classmethod
+    def plugin_name(cls):
+        if cls.hosted is None:
+            return super().plugin_name()
+        return cls.hosted.plugin_name()
+
+    @classmethod
+    def qualified_name(cls):
+        return f'{super().qualified_name()}[{cls.hosted.qualified_name()}]'
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self._hooks = set(self.hosted._Plugin__plugin_data.hooks)
+        self._process = None
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        # Futures for requests sent to the worker process
+        self._requests = {}
+        self._request_ids = itertools.count()
+        # Objects the worker process has references to
+        self._objects = {}
+        self._object_ids = itertools.count()
+
+    def get_hooks(self, hook):
+        if hook in self._hooks and self._writer is not None:
+            return [self._forward_event]
+        return []
+
+    def provide(self, plugin_name, **kwarg):
+        raise PluginFeatureError(f'{self.plugin_name()} plugin is running in a worker process, '
+                                 f'so does not support Plugin.use()')
+
+    async def setup(self):
+        """Start the worker process and set up the plugin in it.
+
+        Also registers each of the plugin's commands, to be run in the worker
+        process.
+        """
+        parent, child = socket.socketpair()
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                sys.executable, '-m', __name__, str(child.fileno()),
+                pass_fds=[child.fileno()], loop=self.bot.loop)
+        finally:
+            child.close()
+        self.log.info(f'started worker process for {self.plugin_name()}: pid={self._process.pid}')
+        self._reader, self._writer = await asyncio.open_unix_connection(sock=parent, loop=self.bot.loop)
+        self._read_task = self.bot.loop.create_task(self._read_loop())
+
+        # The bot is always sent as the worker's WorkerBot, other plugins are sent as references
+        plugins = {}
+        for p in self.PLUGIN_DEPENDS:
+            plugin = self.bot.plugins[p]
+            plugins[p] = plugin if plugin is self.bot else _ByRef(plugin, 'plugin')
+        try:
+            await self._request('init', self.hosted, self.bot.config_root, plugins)
+        except Exception:
+            await self._stop()
+            raise
+
+        for cmd, meta, name in self.hosted._Plugin__plugin_data.commands:
+            self.bot.register_command(cmd, meta, self._command_forwarder(name), tag=self)
+
+    def reconfigure(self, old, new):
+        """Send the new configuration to the worker process, to reconfigure the plugin there."""
+        return self._request('reconfigure', self.bot.config_root)
+
+    async def teardown(self):
+        """Tear down the plugin in the worker process and stop the worker process."""
+        super().teardown()
+        if self._writer is None:
+            return
+        try:
+            await self._request('teardown')
+        finally:
+            await self._stop()
+
+    async def _stop(self):
+        self._writer.close()
+        self._writer = None
+        await self._read_task
+        try:
+            await asyncio.wait_for(self._process.wait(), self.EXIT_TIMEOUT, loop=self.bot.loop)
+        except asyncio.TimeoutError:
+            self.log.warning(f'killing worker process for {self.plugin_name()}: pid={self._process.pid}')
+            self._process.kill()
+            await self._process.wait()
+
+    def _command_forwarder(self, name):
+        def f(event):
+            return self._request('command', name, event)
+        return f
+
+    def _forward_event(self, event):
+        try:
+            return self._request('event', event)
+        except _PICKLE_ERRORS:
+            return self._request('event', self._picklable_event(event))
+
+    def _picklable_event(self, event):
+        """Copy *event*, replacing values that can't be pickled with None."""
+        event = Event.extend(event)
+        for key, value in event.items():
+            try:
+                self._encode(value)
+            except _PICKLE_ERRORS:
+                self.log.warning(f'cannot send {event.event_type} value to worker process: {key}={value!r}')
+                event[key] = None
+        return event
+
+    def _request(self, op, *args):
+        """Send a request to the worker process.
+
+        Returns a future that resolves when the worker process has finished
+        handling the request.
+        """
+        if self._read_task.done():
+            raise WorkerError(f'worker process for {self.plugin_name()} has exited')
+        request_id = next(self._request_ids)
+        frame = self._encode((op, request_id) + args)
+        future = self._requests[request_id] = self.bot.loop.create_future()
+        self._writer.write(frame)
+        return future
+
+    def _encode(self, message):
+        return _encode(message, self._persistent_id)
+
+    def _persistent_id(self, obj):
+        if obj is self.bot:
+            return 'bot', 'bot'
+        elif isinstance(obj, _ByRef):
+            ref = next(self._object_ids)
+            self._objects[ref] = obj.obj
+            return obj.kind, ref
+        return None
+
+    def _persistent_load(self, pid):
+        _, ref = pid
+        return self.bot if ref == 'bot' else self._objects[ref]
+
+    async def _read_loop(self):
+        try:
+            while True:
+                header = await self._reader.readexactly(_HEADER.size)
+                data = await self._reader.readexactly(_HEADER.unpack(header)[0])
+                self._handle(_decode(data, self._persistent_load))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            self.log.exception(f'error reading from worker process for {self.plugin_name()}')
+        finally:
+            error = WorkerError(f'worker process for {self.plugin_name()} exited')
+            for future in self._requests.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._requests.clear()
+            self._objects.clear()
+
+    def _handle(self, message):
+        op, *args = message
+        if op == 'done':
+            request_id, error = args
+            future = self._requests.pop(request_id)
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+        elif op == 'call':
+            call_id, target, name, call_args, kwargs, by_ref = args
+            self.bot.loop.create_task(self._serve_call(call_id, target, name, call_args, kwargs, by_ref))
+        elif op == 'send':
+            target, name, call_args, kwargs = args
+            try:
+                maybe_future(getattr(target, name)(*call_args, **kwargs), log=self.log, loop=self.bot.loop)
+            except Exception:
+                self.log.exception(f'error in call from worker process: {name}')
+        elif op == 'post':
+            event, = args
+            self.bot.post_event(event)
+        elif op == 'release':
+            ref, = args
+            self._objects.pop(ref, None)
+
+    async def _serve_call(self, call_id, target, name, args, kwargs, by_ref):
+        """Run a call from the worker process, and send the result back.
+
+        *args* is None to just get attribute *name*, which is sent back as
+        ``'method'`` status if it is callable, or ``'coroutine'`` status if it
+        is a coroutine function.
+        """
+        status = 'ok'
+        try:
+            value = getattr(target, name)
+            if args is None:
+                if asyncio.iscoroutinefunction(value):
+                    status, value = 'coroutine', None
+                elif callable(value):
+                    status, value = 'method', None
+            else:
+                value = await maybe_future_result(value(*args, **kwargs), log=self.log)
+        except Exception as e:
+            status, value = 'error', _error(e, self._persistent_id)
+
+        if by_ref and status == 'ok':
+            value = _ByRef(value)
+        try:
+            frame = self._encode(('result', call_id, status, value))
+        except _PICKLE_ERRORS:
+            frame = self._encode(('result', call_id, status, _ByRef(value)))
+        if self._writer is not None:
+            self._writer.write(frame)
+
+
+class WorkerPluginMapping(abc.Mapping):
+    """A mapping of plugin name to plugin class, which wraps the classes from
+    *available* named in *names* with :meth:`WorkerPlugin.wrap`.
+    """
+
+    def __init__(self, available: Mapping[str, Type[Plugin]], names):
+        self.available = available
+        self.names = set(names)
+        self._wrapped: MutableMapping[str, Type[WorkerPlugin]] = {}
+
+    def reload(self, name):
+        reload_plugin_class(self.available, name)
+        return self[name]
+
+    def __getitem__(self, name):
+        cls = self.available[name]
+        if name not in self.names:
+            return cls
+        wrapped = self._wrapped.get(name)
+        if wrapped is None or wrapped.hosted is not cls:
+            wrapped = self._wrapped[name] = WorkerPlugin.wrap(cls)
+        return wrapped
+
+    def __contains__(self, name):
+        return name in self.available
+
+    def __len__(self):
+        return len(self.available)
+
+    def __iter__(self):
+        return iter(self.available)
+
+
+class RemoteObject:
+    """Proxy for an object in the bot process.
+
+    Attributes are fetched from the bot process, and methods are called in the
+    bot process.  Coroutine methods return a future instead of blocking.
+    Iteration and item access are also supported.
+    """
+
+    def __init__(self, worker: "Worker", ref):
+        self._worker = worker
+        self._ref = ref
+        self._methods = {}
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        kind = self._methods.get(name)
+        if kind is None:
+            value = self._worker.call(self, name)
+            if value is not _METHOD and value is not _COROUTINE_METHOD:
+                return value
+            kind = self._methods[name] = value
+
+        if kind is _COROUTINE_METHOD:
+            def method(*args, **kwargs):
+                return self._worker.call_async(self, name, args, kwargs)
+        else:
+            def method(*args, **kwargs):
+                return self._worker.call(self, name, args, kwargs)
+        return method
+
+    def __iter__(self):
+        return self._worker.call(self, '__iter__', (), {}, by_ref=True)
+
+    def __next__(self):
+        return self._worker.call(self, '__next__', (), {})
+
+    def __len__(self):
+        return self._worker.call(self, '__len__', (), {})
+
+    def __getitem__(self, key):
+        return self._worker.call(self, '__getitem__', (key,), {})
+
+    def __contains__(self, item):
+        return self._worker.call(self, '__contains__', (item,), {})
+
+    def __del__(self):
+        if isinstance(self._ref, int):
+            self._worker.release(self._ref)
+
+
+class RemotePlugin(RemoteObject):
+    """Proxy for a plugin in the bot process."""
+
+    def provide(self, plugin_name, **kwargs):
+        return self._worker.call(self, 'provide', (plugin_name,), kwargs, by_ref=True)
+
+
+class WorkerBot(RemotePlugin):
+    """Stand-in for the :class:`.Bot` in a worker process.
+
+    Has a local copy of :attr:`config_root`, and :attr:`plugins` containing
+    just the hosted plugin and its dependencies.  Events are posted in the bot
+    process.  Commands are registered by :class:`WorkerPlugin`, so
+    :meth:`register_command` etc. do nothing.
+    """
+
+    #: Methods that are called without waiting for a result.
+    SEND_METHODS = {'reply', 'msg', 'notice', 'act', 'join', 'leave', 'send_line', 'set_topic', 'get_topic'}
+
+    def __init__(self, worker, config_root, plugins):
+        super().__init__(worker, 'bot')
+        self.config_root = config_root
+        self.plugins = plugins
+        self.loop = worker.loop
+        self.http = None
+        self.quota = QuotaManager(loop=self.loop)
+
+    def __getattr__(self, name):
+        if name in self.SEND_METHODS:
+            def method(*args, **kwargs):
+                self._worker.send(('send', self, name, args, kwargs))
+            return method
+        return super().__getattr__(name)
+
+    def provide(self, plugin_name, **kwargs):
+        """Provide a value for a :meth:`.Plugin.use` usage of ``@bot``.
+
+        The bot's HTTP client and quota accounting can't be shared with another
+        process, so the worker has its own :class:`~csbot.httpclient.HTTPClient`,
+        created from the same configuration, and :class:`~csbot.quota.QuotaManager`.
+        """
+        if kwargs.get('service') == 'http':
+            if self.http is None:
+                from .core import Bot
+                self.http = HTTPClient.from_config(Bot._get_config(self.config_root), loop=self.loop)
+            return self.http
+        if kwargs.get('service') == 'quota':
+            return self.quota
+        return super().provide(plugin_name, **kwargs)
+
+    def post_event(self, event):
+        """Post *event* in the bot process.
+
+        Returns a future that is already done, because the worker process
+        doesn't wait for the event to be handled.
+        """
+        self._worker.send(('post', event))
+        future = self.loop.create_future()
+        future.set_result(None)
+        return future
+
+    def emit_new(self, event_type, data=None):
+        return self.post_event(Event(self, event_type, data))
+
+    def emit(self, event):
+        self.post_event(event)
+
+    def register_command(self, cmd, metadata, f, tag=None):
+        return True
+
+    def unregister_command(self, cmd, tag=None):
+        pass
+
+    def unregister_commands(self, tag):
+        pass
+
+
+class Worker:
+    """Host for a plugin in a worker process, connected to the bot process by *sock*.
+
+    Requests from the bot process are handled in *loop*.  A separate thread
+    reads from *sock*, so that :meth:`call` can block *loop* while waiting for
+    a result, and resolves the futures returned by :meth:`call_async`.
+    """
+
+    def __init__(self, sock: socket.socket, loop):
+        self.sock = sock
+        self.loop = loop
+        self.bot = WorkerBot(self, {}, {})
+        self.plugin = None
+        self._file = sock.makefile('rb')
+        self._send_lock = threading.Lock()
+        # Waiters for calls to the bot process
+        self._calls = {}
+        self._call_ids = itertools.count()
+        self._closed = False
+        self._stopped = loop.create_future()
+
+    async def run(self):
+        """Handle requests until the bot process closes the connection."""
+        thread = threading.Thread(target=self._read_loop, name='csbot-worker-reader', daemon=True)
+        thread.start()
+        await self._stopped
+
+    def send(self, message):
+        """Send *message* to the bot process."""
+        frame = _encode(message, self._persistent_id)
+        with self._send_lock:
+            if not self._closed:
+                self.sock.sendall(frame)
+
+    def call(self, target, name, args=None, kwargs=None, by_ref=False):
+        """Call method *name* of *target* in the bot process, and wait for the result.
+
+        If *args* is None, get attribute *name* instead, or :data:`_METHOD` if
+        it's a method (:data:`_COROUTINE_METHOD` if it's a coroutine method).
+        If *by_ref* is True, always get a :class:`RemoteObject` instead of a
+        pickled result.
+        """
+        waiter = threading.Event()
+        call_id = next(self._call_ids)
+        self._calls[call_id] = waiter
+        self.send(('call', call_id, target, name, args, kwargs, by_ref))
+        waiter.wait()
+        status, value = waiter.result
+        if status == 'error':
+            raise value
+        elif status == 'method':
+            return _METHOD
+        elif status == 'coroutine':
+            return _COROUTINE_METHOD
+        return value
+
+    def call_async(self, target, name, args, kwargs):
+        """Call method *name* of *target* in the bot process, returning a
+        future for the result instead of waiting for it.
+        """
+        future = self.loop.create_future()
+        call_id = next(self._call_ids)
+        self._calls[call_id] = future
+        self.send(('call', call_id, target, name, args, kwargs, False))
+        return future
+
+    def release(self, ref):
+        """Allow the bot process to forget about object *ref*."""
+        try:
+            self.send(('release', ref))
+        except Exception:
+            pass
+
+    def _persistent_id(self, obj):
+        if isinstance(obj, RemoteObject):
+            return 'obj', obj._ref
+        return None
+
+    def _persistent_load(self, pid):
+        kind, ref = pid
+        if kind == 'bot':
+            return self.bot
+        elif kind == 'plugin':
+            return RemotePlugin(self, ref)
+        else:
+            return RemoteObject(self, ref)
+
+    def _read_loop(self):
+        try:
+            while True:
+                header = self._file.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                message = _decode(self._file.read(_HEADER.unpack(header)[0]), self._persistent_load)
+                if message[0] == 'result':
+                    _, call_id, status, value = message
+                    self._resolve(self._calls.pop(call_id), status, value)
+                else:
+                    self.loop.call_soon_threadsafe(self._handle, message)
+        except Exception:
+            LOG.exception('error reading from bot process')
+        finally:
+            with self._send_lock:
+                self._closed = True
+            for call_id in list(self._calls):
+                self._resolve(self._calls.pop(call_id), 'error', WorkerError('bot process closed the connection'))
+            self.loop.call_soon_threadsafe(self._stop)
+
+    def _resolve(self, waiter, status, value):
+        """Pass a call's result to *waiter*, from the reader thread."""
+        if isinstance(waiter, threading.Event):
+            waiter.result = (status, value)
+            waiter.set()
+        else:
+            self.loop.call_soon_threadsafe(self._set_future, waiter, status, value)
+
+    @staticmethod
+    def _set_future(future, status, value):
+        if future.done():
+            return
+        if status == 'error':
+            future.set_exception(value)
+        else:
+            future.set_result(value)
+
+    def _stop(self):
+        if not self._stopped.done():
+            self._stopped.set_result(None)
+
+    def _handle(self, message):
+        op, request_id, *args = message
+        try:
+            result = getattr(self, '_handle_' + op)(*args)
+            future = maybe_future(result, log=LOG, loop=self.loop)
+        except Exception as e:
+            self._done(request_id, e)
+            return
+        if future is None:
+            self._done(request_id, None)
+        else:
+            future.add_done_callback(
+                lambda f: self._done(request_id, None if f.cancelled() else f.exception()))
+
+    def _done(self, request_id, exc):
+        if exc is not None:
+            LOG.error('error in worker process', exc_info=exc)
+            exc = _error(exc, self._persistent_id)
+        self.send(('done', request_id, exc))
+
+    def _handle_init(self, plugin_cls, config_root, plugins):
+        self.bot.config_root = config_root
+        self.bot.plugins.update(plugins)
+        self.plugin = plugin_cls(self.bot)
+        self.bot.plugins[self.plugin.plugin_name()] = self.plugin
+        LOG.info(f'plugin loaded in worker process: {self.plugin.plugin_name()}')
+        return self.plugin.setup()
+
+    def _handle_event(self, event):
+        handlers = self.plugin.get_hooks(event.event_type)
+        return asyncio.gather(*(maybe_future_result(h(event), log=LOG) for h in handlers), loop=self.loop)
+
+    def _handle_command(self, name, event):
+        return getattr(self.plugin, name)(event)
+
+    def _handle_reconfigure(self, config_root):
+        self.bot.config_root = config_root
+        new = self.plugin._get_config(config_root)
+        old = self.plugin._replace_config(new)
+        return self.plugin.reconfigure(old, new)
+
+    async def _handle_teardown(self):
+        await maybe_future_result(self.plugin.teardown(), log=LOG)
+        if self.bot.http is not None:
+            await self.bot.http.close()
+
+
+def main(argv=None):
+    """Run a worker process, connected to the bot process by the socket file
+    descriptor in *argv*.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    logging.basicConfig(level=logging.INFO,
+                        format=f'[worker {os.getpid()}] %(levelname)s:%(name)s:%(message)s')
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    worker = Worker(socket.socket(fileno=int(argv[0])), loop)
+    try:
+        loop.run_until_complete(worker.run())
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
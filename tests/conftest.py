@@ -77,7 +77,11 @@ async def irc_client(request, event_loop, config_example_mode, irc_client_class,
     # Mock all the things!
     client.send_line = mock.Mock(wraps=client.send_line)
 
-    return client
+    yield client
+
+    # Not all tests tear the bot down, but the shared HTTP session must be closed
+    if isinstance(client, Bot):
+        await client.http.close()
 
 
 class IRCClientHelper:
@@ -1,12 +1,14 @@
 import unittest.mock as mock
 import asyncio
+import copy
 import inspect
 import logging
 
 import pytest
 
 from csbot.core import Bot
-from csbot.plugin import Plugin, PluginDependencyUnmet, PluginFeatureError
+import csbot.plugin
+from csbot.plugin import Plugin, PluginConfigError, PluginDependencyUnmet, PluginFeatureError, PluginRegistry
 
 
 class TestDependency:
@@ -169,6 +171,350 @@ class TestHook:
         ]
 
 
+class TestPluginRegistry:
+    def test_entry_points_match_plugins(self):
+        """Check that every plugin is registered as an entry point under its plugin name."""
+        registry = csbot.plugin.find_plugin_registry()
+        assert dict(registry.entries) == {
+            P.plugin_name(): f'{P.__module__}:{P.__qualname__}' for P in csbot.plugin.find_plugins()
+        }
+
+    def test_lazy_import(self):
+        """Check that plugins are only imported when accessed, and import time is recorded."""
+        registry = PluginRegistry({
+            'helix': 'csbot.plugins.helix:Helix',
+            'calc': 'csbot.plugins.calc:Calc',
+        })
+        assert 'helix' in registry
+        assert 'missing' not in registry
+        assert registry.import_times == {}
+        from csbot.plugins.helix import Helix
+        assert registry['helix'] is Helix
+        assert set(registry.import_times) == {'helix'}
+        with pytest.raises(KeyError):
+            registry['missing']
+
+    def test_wrong_name(self):
+        registry = PluginRegistry({'foo': 'csbot.plugins.helix:Helix'})
+        with pytest.raises(PluginFeatureError):
+            registry['foo']
+
+    def test_only_configured_plugins_imported(self, event_loop, config_example_mode):
+        bot = Bot(config={"@bot": {"plugins": ["helix"]}})
+        assert isinstance(bot.available_plugins, PluginRegistry)
+        assert set(bot.available_plugins.import_times) == {'helix'}
+
+
+class TestSetup:
+    class MockPlugin1(Plugin):
+        """Can only finish setup if mockplugin2 is being set up at the same time."""
+        async def setup(self):
+            super().setup()
+            self.bot.setup_order.append('mockplugin1 started')
+            self.bot.plugin1_started.set()
+            await self.bot.plugin2_started.wait()
+            self.bot.setup_order.append('mockplugin1 finished')
+
+        @Plugin.hook('core.message.privmsg')
+        def privmsg(self, event):
+            self.bot.setup_order.append('privmsg')
+
+    class MockPlugin2(Plugin):
+        async def setup(self):
+            super().setup()
+            self.bot.setup_order.append('mockplugin2 started')
+            self.bot.plugin2_started.set()
+            await self.bot.plugin1_started.wait()
+            self.bot.setup_order.append('mockplugin2 finished')
+
+    class MockPlugin3(Plugin):
+        PLUGIN_DEPENDS = ['mockplugin1', 'mockplugin2']
+
+        def setup(self):
+            super().setup()
+            self.bot.setup_order.append('mockplugin3')
+
+        def teardown(self):
+            super().teardown()
+            self.bot.setup_order.append('mockplugin3 teardown')
+
+        @Plugin.hook('webserver.build')
+        def non_core(self, event):
+            self.bot.setup_order.append('non-core event')
+
+    class FailingPlugin(Plugin):
+        PLUGIN_DEPENDS = ['mockplugin1']
+
+        def setup(self):
+            super().setup()
+            raise ValueError('setup failed')
+
+    CONFIG = {
+        "@bot": {
+            "plugins": ["mockplugin3", "mockplugin2", "mockplugin1"],
+        },
+    }
+
+    pytestmark = [
+        pytest.mark.bot(plugins=[MockPlugin1, MockPlugin2, MockPlugin3], config=CONFIG),
+        pytest.mark.asyncio,
+    ]
+
+    @pytest.fixture
+    def irc_client(self, irc_client):
+        irc_client.setup_order = []
+        irc_client.plugin1_started = asyncio.Event()
+        irc_client.plugin2_started = asyncio.Event()
+        return irc_client
+
+    async def test_setup_concurrent_per_level(self, irc_client):
+        """Check that plugins are set up concurrently, but after their dependencies."""
+        await asyncio.wait_for(irc_client.bot_setup_async(), 1)
+        assert set(irc_client.setup_order[:2]) == {'mockplugin1 started', 'mockplugin2 started'}
+        assert set(irc_client.setup_order[2:4]) == {'mockplugin1 finished', 'mockplugin2 finished'}
+        assert irc_client.setup_order[4:] == ['mockplugin3']
+
+        irc_client.setup_order.clear()
+        await irc_client.bot_teardown_async()
+        assert irc_client.setup_order == ['mockplugin3 teardown']
+
+    @pytest.mark.bot(plugins=[MockPlugin1, MockPlugin2, MockPlugin3, FailingPlugin], config={
+        "@bot": {
+            "plugins": ["mockplugin3", "mockplugin2", "mockplugin1", "failingplugin"],
+        },
+    })
+    async def test_setup_failure_tears_down(self, irc_client):
+        """Check that plugins already set up are torn down if another plugin's setup fails."""
+        with pytest.raises(ValueError):
+            await asyncio.wait_for(irc_client.bot_setup_async(), 1)
+        assert irc_client.setup_order[-2:] == ['mockplugin3', 'mockplugin3 teardown']
+
+    async def test_core_events_buffered_until_setup(self, irc_client):
+        """Check that core events wait for plugin setup, but other events don't."""
+        core_future = irc_client.line_received(':nick!user@host PRIVMSG #channel :hello')
+        await irc_client.emit_new('webserver.build', {})
+        assert irc_client.setup_order == ['non-core event']
+        assert not core_future.done()
+
+        await irc_client.bot_setup_async()
+        await asyncio.wait_for(core_future, 1)
+        assert irc_client.setup_order[-1] == 'privmsg'
+
+
+class TestReload:
+    pytestmark = [
+        pytest.mark.bot(config="""\
+            ["@bot"]
+            plugins = ["usertrack", "auth"]
+
+            [auth]
+            admin = "plugins"
+            """),
+        pytest.mark.asyncio,
+    ]
+
+    async def test_reload(self, bot_helper):
+        """Check that a reloaded plugin and its dependents are re-created, keeping declared state."""
+        await bot_helper.client.line_received(':Nick!~user@hostname JOIN #channel')
+        old_usertrack = bot_helper['usertrack']
+        old_auth = bot_helper['auth']
+
+        reloaded = await bot_helper.bot.plugins.reload('usertrack')
+        assert reloaded == ['usertrack', 'auth']
+        assert bot_helper['usertrack'] is not old_usertrack
+        assert type(bot_helper['usertrack']) is not type(old_usertrack)
+        assert bot_helper['auth'] is not old_auth
+        assert type(bot_helper['auth']) is type(old_auth)
+        # State declared with PLUGIN_STATE survives
+        assert bot_helper['usertrack'].get_user('Nick')['channels'] == {'#channel'}
+        # Hooks go to the new instance
+        await bot_helper.client.line_received(':Nick!~user@hostname PART #channel')
+        assert bot_helper['usertrack'].get_user('Nick')['channels'] == set()
+        # Commands go to the new instance
+        assert bot_helper.bot.commands['account'][2] is bot_helper['usertrack']
+
+    async def test_reload_setup_fails(self, bot_helper):
+        """Check that plugins like the old ones are restored if a reloaded plugin's setup fails."""
+        await bot_helper.client.line_received(':Nick!~user@hostname JOIN #channel')
+        old_usertrack = bot_helper['usertrack']
+        old_auth = bot_helper['auth']
+
+        class Broken(type(old_usertrack)):
+            def setup(self):
+                super().setup()
+                raise ValueError('setup failed')
+
+        with mock.patch('csbot.plugin.reload_plugin_class', return_value=Broken):
+            with pytest.raises(ValueError):
+                await bot_helper.bot.plugins.reload('usertrack')
+        assert type(bot_helper['usertrack']) is type(old_usertrack)
+        assert bot_helper['usertrack'] is not old_usertrack
+        assert type(bot_helper['auth']) is type(old_auth)
+        assert bot_helper['usertrack'].get_user('Nick')['channels'] == {'#channel'}
+        await bot_helper.client.line_received(':Nick!~user@hostname PART #channel')
+        assert bot_helper['usertrack'].get_user('Nick')['channels'] == set()
+        assert bot_helper.bot.commands['account'][2] is bot_helper['usertrack']
+
+    async def test_reload_not_allowed(self, bot_helper):
+        with pytest.raises(PluginFeatureError):
+            await bot_helper.bot.plugins.reload('@bot')
+        with pytest.raises(PluginFeatureError):
+            await bot_helper.bot.plugins.reload('missing')
+
+    async def test_reload_command(self, bot_helper):
+        old_usertrack = bot_helper['usertrack']
+        await asyncio.wait(bot_helper.receive([':Nick!~user@hostname PRIVMSG #channel :!plugins.reload usertrack']))
+        bot_helper.assert_sent('NOTICE #channel :error: not authenticated')
+        assert bot_helper['usertrack'] is old_usertrack
+
+        await bot_helper.client.line_received(':Nick!~user@hostname ACCOUNT admin')
+        await asyncio.wait(bot_helper.receive([':Nick!~user@hostname PRIVMSG #channel :!plugins.reload usertrack']))
+        bot_helper.assert_sent('NOTICE #channel :reloaded plugins: usertrack, auth')
+        assert bot_helper['usertrack'] is not old_usertrack
+
+
+class TestReloadConfig:
+    CONFIG = {
+        "@bot": {
+            "nickname": "csbot",
+            "irc_host": "irc.example.com",
+            "plugins": ["usertrack", "auth", "linkinfo"],
+        },
+        "auth": {
+            "admin": "config",
+        },
+        "linkinfo": {
+            "scan_limit": 2,
+        },
+    }
+
+    pytestmark = [
+        pytest.mark.bot(config=CONFIG),
+        pytest.mark.asyncio,
+    ]
+
+    def new_config(self, bot_helper):
+        return copy.deepcopy(bot_helper.bot.config_root)
+
+    async def test_reconfigure_changed(self, bot_helper):
+        """Check that only plugins with changed configuration are reconfigured."""
+        new = self.new_config(bot_helper)
+        new["linkinfo"]["scan_limit"] = 3
+        with mock.patch.object(bot_helper['linkinfo'], 'reconfigure') as reconfigure:
+            assert await bot_helper.bot.reload_config(new) == ['linkinfo']
+            old_config, new_config = reconfigure.call_args[0]
+        assert old_config.scan_limit == 2
+        assert new_config.scan_limit == 3
+        assert bot_helper['linkinfo'].config is new_config
+        assert bot_helper.bot.config_root is new
+
+        new = self.new_config(bot_helper)
+        new["auth"]["admin"] = "plugins"
+        new["auth"]["other"] = "config"
+        with mock.patch.object(bot_helper['linkinfo'], 'reconfigure') as reconfigure:
+            assert await bot_helper.bot.reload_config(new) == ['auth']
+            reconfigure.assert_not_called()
+        assert not bot_helper['auth']._permissions.check('admin', 'config')
+        assert bot_helper['auth']._permissions.check('other', 'config')
+
+    async def test_invalid(self, bot_helper):
+        """Check that invalid configuration doesn't change anything."""
+        old = bot_helper.bot.config_root
+        new = self.new_config(bot_helper)
+        new["auth"]["admin"] = "plugins"
+        new["linkinfo"]["scan_limit"] = "lots"
+        with pytest.raises(PluginConfigError):
+            await bot_helper.bot.reload_config(new)
+        assert bot_helper.bot.config_root is old
+        assert bot_helper['linkinfo'].config.scan_limit == 2
+        assert bot_helper['auth']._permissions.check('admin', 'config')
+
+    async def test_bot_options(self, bot_helper, caplog):
+        new = self.new_config(bot_helper)
+        new["@bot"]["command_prefix"] = "?"
+        new["@bot"]["use_notice"] = False
+        assert await bot_helper.bot.reload_config(new) == ['@bot']
+        await asyncio.wait(bot_helper.receive(':Nick!~user@hostname PRIVMSG #channel :?help plugins'))
+        bot_helper.assert_sent('PRIVMSG #channel :plugins: no help string')
+        assert 'restart needed' not in caplog.text
+
+        new = self.new_config(bot_helper)
+        new["@bot"]["nickname"] = "othernick"
+        await bot_helper.bot.reload_config(new)
+        assert 'restart needed to apply configuration changes: nickname' in caplog.text
+
+    async def test_reload_command(self, bot_helper):
+        new = self.new_config(bot_helper)
+        new["linkinfo"]["scan_limit"] = 3
+        bot_helper.bot.config_loader = lambda: new
+
+        await asyncio.wait(bot_helper.receive([':Nick!~user@hostname PRIVMSG #channel :!config.reload']))
+        bot_helper.assert_sent('NOTICE #channel :error: not authenticated')
+        assert bot_helper['linkinfo'].config.scan_limit == 2
+
+        await bot_helper.client.line_received(':Nick!~user@hostname ACCOUNT admin')
+        await asyncio.wait(bot_helper.receive([':Nick!~user@hostname PRIVMSG #channel :!config.reload']))
+        bot_helper.assert_sent('NOTICE #channel :reconfigured plugins: linkinfo')
+        assert bot_helper['linkinfo'].config.scan_limit == 3
+
+        await asyncio.wait(bot_helper.receive([':Nick!~user@hostname PRIVMSG #channel :!config.reload']))
+        bot_helper.assert_sent('NOTICE #channel :reconfigured plugins: none')
+
+
+class TestNetsplit:
+    class NetsplitPlugin(Plugin):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.handler_mock = mock.Mock(spec=callable)
+
+        @Plugin.hook('core.netsplit')
+        def netsplit(self, event):
+            self.handler_mock('netsplit', event['servers'], event['users'])
+
+        @Plugin.hook('core.user.quit')
+        def quit(self, event):
+            self.handler_mock('quit', event['user'])
+
+    class QuitPlugin(Plugin):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.handler_mock = mock.Mock(spec=callable)
+
+        @Plugin.hook('core.user.quit')
+        def quit(self, event):
+            self.handler_mock('quit', event['user'])
+
+    CONFIG = {
+        "@bot": {
+            "plugins": ["netsplitplugin", "quitplugin"],
+        },
+    }
+
+    pytestmark = pytest.mark.bot(plugins=[NetsplitPlugin, QuitPlugin], config=CONFIG)
+
+    @pytest.mark.asyncio
+    async def test_netsplit(self, bot_helper, fast_forward):
+        """Check that a netsplit is a single event, and only other plugins get the individual quits."""
+        users = [f'nick{i}!user{i}@host{i}' for i in range(5)]
+        messages = [f':{user} QUIT :*.net *.split' for user in users]
+        messages.append(':other!user@host QUIT :Quit: bye')
+        await asyncio.wait(bot_helper.receive(messages))
+        assert bot_helper['netsplitplugin'].handler_mock.mock_calls == [
+            mock.call('quit', 'other!user@host'),
+        ]
+        assert bot_helper['quitplugin'].handler_mock.mock_calls == (
+            [mock.call('quit', user) for user in users] + [mock.call('quit', 'other!user@host')]
+        )
+
+        bot_helper['quitplugin'].handler_mock.reset_mock()
+        await fast_forward(bot_helper.bot.NETSPLIT_QUIET_PERIOD + 1)
+        assert bot_helper['netsplitplugin'].handler_mock.mock_calls == [
+            mock.call('quit', 'other!user@host'),
+            mock.call('netsplit', ['*.net', '*.split'], users),
+        ]
+        assert bot_helper['quitplugin'].handler_mock.mock_calls == []
+
+
 class TestCommand:
     class MockPlugin1(Plugin):
         def __init__(self, *args, **kwargs):
@@ -202,7 +548,7 @@ class TestCommand:
         bot_helper.assert_sent('NOTICE #channel :loaded plugins: @bot, mockplugin1')
 
         await asyncio.wait(bot_helper.receive([':nick!user@host PRIVMSG #channel :&help']))
-        bot_helper.assert_sent('NOTICE #channel :a, b, c, d, help, plugins')
+        bot_helper.assert_sent('NOTICE #channel :a, b, c, config.reload, d, help, http.status, plugins, plugins.reload')
 
         await asyncio.wait(bot_helper.receive([':nick!user@host PRIVMSG #channel :&help x']))
         bot_helper.assert_sent('NOTICE #channel :x: no such command')
@@ -78,6 +78,34 @@ def test_with_plugin_section(bot_helper):
         assert plugin.config_get('env_only') == 'config3'
 
 
+@pytest.mark.bot(plugins=PLUGINS, config=base_config + plugin_config + """
+["mockplugin/sub"]
+default = "sub1"
+extra = "sub2"
+""")
+def test_config_table(bot_helper):
+    plugin = bot_helper.bot.plugins['mockplugin']
+    with TempEnvVars({'CSBOTTEST_ENV_MULTI_2': 'env value'}):
+        table = plugin.build_config_table()
+    # Plugin section, resolved like config_get()
+    assert table[None, 'default'] == 'config1'
+    assert table[None, 'env_and_default'] == 'config2'
+    assert table[None, 'multiple_env'] == 'env value'
+    with pytest.raises(KeyError):
+        table[None, 'absent']
+    # Subsection values, falling back to the plugin section
+    assert table['sub', 'default'] == 'sub1'
+    assert table['sub', 'extra'] == 'sub2'
+    assert table['sub', 'env_only'] == 'config3'
+    assert table['missing', 'default'] == 'config1'
+    with pytest.raises(KeyError):
+        table['missing', 'extra']
+    # Doesn't change in response to the environment
+    assert table[None, 'multiple_env'] == 'env value'
+    # Doesn't create missing subsections
+    assert 'mockplugin/missing' not in bot_helper.bot.config_root
+
+
 def test_config_option_default():
     class Config(config.Config):
         # Implicit default=None
@@ -459,6 +487,36 @@ def test_config_nested_map():
         }, Config)
 
 
+def test_config_snapshot():
+    class Inner(config.Config):
+        x = config.option(int, default=1, help="")
+
+    class Config(config.Config):
+        a = config.option(int, default=1, help="")
+        b = config.option(Inner, default=Inner, help="")
+        c = config.option_list(Inner, help="")
+
+    c1 = config.structure({"c": [{"x": 2}]}, Config)
+    assert isinstance(c1, config.ConfigSnapshot)
+    assert isinstance(c1, Config)
+    assert config.is_config(c1)
+    assert isinstance(c1.b, config.ConfigSnapshot)
+    assert isinstance(c1.c[0], Inner)
+    assert c1.c[0].x == 2
+
+    # Snapshot classes are generated once per Config class
+    assert type(c1) is config.snapshot_class(Config)
+    assert type(config.structure({}, Config)) is type(c1)
+
+    # Snapshots are frozen and slotted
+    with pytest.raises(AttributeError):
+        c1.a = 2
+    assert not hasattr(c1, "__dict__")
+
+    assert config.unstructure(c1) == {"a": 1, "b": {"x": 1}, "c": [{"x": 2}]}
+    assert config.structure(config.unstructure(c1), Config) == c1
+
+
 def test_config_option_example():
     class Config(config.Config):
         a = config.option(int, default=1, example=2, help="default and example values")
@@ -0,0 +1,287 @@
+import asyncio
+import os
+import time
+from unittest import mock
+
+import aiohttp
+import pytest
+
+from csbot.plugin import Plugin, PluginFeatureError
+from csbot.httpclient import (
+    HTTPClient, HTTPCache, DiskStore, ResponseTooLarge, freshness_lifetime,
+    CircuitBreaker, CircuitOpen, FetchScheduler,
+)
+
+
+class Fetcher(Plugin):
+    http = Plugin.use('@bot', service='http')
+
+
+@pytest.fixture
+async def http(event_loop):
+    client = HTTPClient(loop=event_loop, max_response_size=10)
+    yield client
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_fetch(http, aioresponses):
+    aioresponses.get('http://example.com/', status=200, body='{"a": 1}', content_type='application/json')
+    resp = await http.fetch('http://example.com/')
+    assert resp.status == 200
+    assert resp.json() == {'a': 1}
+    assert resp.text() == '{"a": 1}'
+
+
+@pytest.mark.asyncio
+async def test_session_shared(http, aioresponses):
+    aioresponses.get('http://example.com/', status=200, body='a', repeat=True)
+    await http.fetch('http://example.com/')
+    session = http.session
+    await http.fetch('http://example.com/')
+    assert http.session is session
+    await http.close()
+    assert session.closed
+
+
+@pytest.mark.asyncio
+async def test_max_response_size(http, aioresponses):
+    aioresponses.get('http://example.com/', status=200, body='x' * 11, repeat=True)
+    with pytest.raises(ResponseTooLarge):
+        await http.fetch('http://example.com/')
+    assert len((await http.fetch('http://example.com/', max_size=11)).body) == 11
+    async with http.get('http://example.com/') as resp:
+        assert await http.read(resp, 5, truncate=True) == b'xxxxx'
+
+
+@pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["fetcher"]
+    http_max_response_size = 1234
+    """, plugins=[Fetcher])
+@pytest.mark.asyncio
+async def test_provided(bot_helper):
+    http = bot_helper['fetcher'].http
+    assert http is bot_helper.bot.http
+    assert http.max_response_size == 1234
+    with pytest.raises(PluginFeatureError):
+        bot_helper.bot.provide('fetcher', service='nope')
+    await bot_helper.bot.bot_teardown_async()
+    assert http._session is None
+
+
+@pytest.fixture
+async def cached_http(event_loop):
+    client = HTTPClient(loop=event_loop, cache=HTTPCache(max_entries=2))
+    yield client
+    await client.close()
+
+
+def test_freshness_lifetime():
+    assert freshness_lifetime({'Cache-Control': 'public, max-age=60'}) == 60
+    assert freshness_lifetime({'Cache-Control': 'max-age=60', 'Age': '20'}) == 40
+    assert freshness_lifetime({'Cache-Control': 'no-cache, max-age=60'}) == 0
+    assert freshness_lifetime({'Cache-Control': 'no-store'}) is None
+    assert freshness_lifetime({'Date': 'Mon, 19 Oct 2026 10:00:00 GMT',
+                               'Expires': 'Mon, 19 Oct 2026 10:05:00 GMT'}) == 300
+    assert freshness_lifetime({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_cache_max_age(cached_http, aioresponses):
+    aioresponses.get('http://example.com/', status=200, body='a', headers={'Cache-Control': 'max-age=60'})
+    first = await cached_http.fetch('http://example.com/')
+    second = await cached_http.fetch('http://example.com/')
+    assert (first.from_cache, second.from_cache) == (False, True)
+    assert second.body == b'a'
+    assert cached_http.cache.stats.hits == 1
+    assert cached_http.cache.stats.misses == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_not_stored(cached_http, aioresponses):
+    aioresponses.get('http://example.com/a', status=200, body='a', repeat=True)
+    aioresponses.get('http://example.com/b', status=200, body='b', repeat=True,
+                     headers={'Cache-Control': 'no-store'})
+    await cached_http.fetch('http://example.com/a')
+    await cached_http.fetch('http://example.com/b', ttl=60)
+    assert len(cached_http.cache) == 0
+    assert not (await cached_http.fetch('http://example.com/a')).from_cache
+
+
+@pytest.mark.asyncio
+async def test_cache_ttl_override(cached_http, aioresponses):
+    aioresponses.get('http://example.com/', status=200, body='a')
+    await cached_http.fetch('http://example.com/', ttl=60)
+    assert (await cached_http.fetch('http://example.com/')).from_cache
+    with mock.patch('time.time', return_value=time.time() + 61):
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await cached_http.fetch('http://example.com/')
+
+
+@pytest.mark.asyncio
+async def test_cache_revalidate(cached_http, aioresponses):
+    aioresponses.get('http://example.com/', status=200, body='a', headers={'ETag': '"v1"'})
+    aioresponses.get('http://example.com/', status=304, headers={'ETag': '"v1"'})
+    await cached_http.fetch('http://example.com/')
+    resp = await cached_http.fetch('http://example.com/')
+    assert resp.status == 200
+    assert resp.body == b'a'
+    assert resp.from_cache
+    [(first, second)] = aioresponses.requests.values()
+    assert 'If-None-Match' not in (first.kwargs.get('headers') or {})
+    assert second.kwargs['headers']['If-None-Match'] == '"v1"'
+    assert cached_http.cache.stats.revalidated == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_lru(cached_http, aioresponses):
+    for path in 'abc':
+        aioresponses.get(f'http://example.com/{path}', status=200, body=path, repeat=True,
+                         headers={'Cache-Control': 'max-age=60'})
+    await cached_http.fetch('http://example.com/a')
+    await cached_http.fetch('http://example.com/b')
+    await cached_http.fetch('http://example.com/a')
+    await cached_http.fetch('http://example.com/c')
+    assert cached_http.cache.stats.evictions == 1
+    assert (await cached_http.fetch('http://example.com/a')).from_cache
+    assert not (await cached_http.fetch('http://example.com/b')).from_cache
+
+
+@pytest.mark.asyncio
+async def test_cache_disk(event_loop, tmp_path, aioresponses):
+    aioresponses.get('http://example.com/', status=200, body='a', headers={'Cache-Control': 'max-age=60'})
+    client = HTTPClient(loop=event_loop, cache=HTTPCache(disk=DiskStore(str(tmp_path))))
+    await client.fetch('http://example.com/')
+    await client.close()
+
+    client = HTTPClient(loop=event_loop, cache=HTTPCache(disk=DiskStore(str(tmp_path))))
+    resp = await client.fetch('http://example.com/')
+    assert resp.from_cache
+    assert resp.body == b'a'
+    await client.close()
+
+
+def test_disk_store_prune(tmp_path):
+    store = DiskStore(str(tmp_path), max_entries=2)
+    for i, key in enumerate('abca'):
+        store.put(key, i)
+        os.utime(os.path.join(str(tmp_path), key), (i, i))
+    assert len(store) == 2
+    store.put('d', 4)
+    # Least recently written first
+    assert len(store) == 2
+    assert (store.get('a'), store.get('b'), store.get('c'), store.get('d')) == (3, None, None, 4)
+    assert len(DiskStore(str(tmp_path))) == 2
+
+
+def test_circuit_breaker():
+    now = [0]
+    breaker = CircuitBreaker('example.com', threshold=2, cooldown=10, clock=lambda: now[0])
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert str(breaker) == 'example.com (retry in 10s)'
+    now[0] = 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one trial request
+    assert breaker.allow()
+    assert not breaker.allow()
+    # Trial failed, so open again
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    now[0] = 20
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_host_limit(event_loop):
+    scheduler = FetchScheduler(loop=event_loop, limit=2, limit_per_host=1)
+    entered = []
+
+    async def request(host, n):
+        async with scheduler.slot(host):
+            entered.append(n)
+            await asyncio.sleep(0.01)
+
+    tasks = [event_loop.create_task(request(host, n)) for n, host in enumerate(['a', 'a', 'b'])]
+    await asyncio.sleep(0.005)
+    assert entered == [0, 2]
+    assert scheduler.active == 3
+    await asyncio.gather(*tasks)
+    assert entered == [0, 2, 1]
+    assert scheduler.active == 0
+    assert scheduler._host_semaphores == {}
+
+
+@pytest.mark.asyncio
+async def test_scheduler_deadline(event_loop):
+    scheduler = FetchScheduler(loop=event_loop, failure_threshold=1)
+    with pytest.raises(asyncio.TimeoutError):
+        async with scheduler.slot('example.com', deadline=0.01):
+            await asyncio.sleep(1)
+    with pytest.raises(CircuitOpen):
+        async with scheduler.slot('example.com'):
+            pass
+    assert scheduler.describe().startswith('0 requests in progress, open circuits: example.com (retry in ')
+
+
+@pytest.mark.asyncio
+async def test_scheduler_queue_timeout(event_loop):
+    scheduler = FetchScheduler(loop=event_loop, limit_per_host=1, failure_threshold=1)
+    release = asyncio.Event()
+
+    async def busy():
+        async with scheduler.slot('example.com'):
+            await release.wait()
+
+    task = event_loop.create_task(busy())
+    await asyncio.sleep(0)
+    # Timing out while waiting for a turn isn't the host's fault
+    with pytest.raises(asyncio.TimeoutError):
+        async with scheduler.slot('example.com', deadline=0.01):
+            pass
+    assert scheduler.breakers == {}
+    release.set()
+    await task
+
+
+def test_scheduler_forgets_idle_breakers():
+    now = [0]
+    scheduler = FetchScheduler(failure_threshold=2, failure_cooldown=10, clock=lambda: now[0])
+    scheduler._record('a', False)
+    scheduler._record('b', False)
+    scheduler._record('b', False)
+    assert set(scheduler.breakers) == {'a', 'b'}
+    now[0] = 10
+    scheduler._record('c', False)
+    assert set(scheduler.breakers) == {'b', 'c'}
+    # Half-open for a whole cooldown without a trial request
+    now[0] = 20
+    scheduler._record('c', False)
+    assert set(scheduler.breakers) == {'c'}
+
+
+@pytest.mark.asyncio
+async def test_circuit_open(event_loop, aioresponses):
+    http = HTTPClient(loop=event_loop, failure_threshold=2)
+    aioresponses.get('http://example.com/', status=503, repeat=True)
+    aioresponses.get('http://example.org/', status=404, repeat=True)
+    # Not found isn't a failure
+    for _ in range(3):
+        await http.fetch('http://example.org/')
+    assert http.scheduler.breakers == {}
+    # Server errors and connection errors are
+    await http.fetch('http://example.com/')
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await http.fetch('http://example.com/nope')
+    with pytest.raises(CircuitOpen):
+        await http.fetch('http://example.com/')
+    assert [b.host for b in http.scheduler.open_breakers()] == ['example.com']
+    await http.close()
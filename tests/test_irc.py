@@ -408,6 +408,18 @@ def test_parse_failure(irc_client_helper):
         irc_client_helper.receive('')
 
 
+def test_parse_tags():
+    """Check that IRCv3 message tags are parsed and unescaped."""
+    msg = IRCMessage.parse(r'@batch=abc;flag;text=a\sb\:c :nick!user@host QUIT :bye')
+    assert msg.prefix == 'nick!user@host'
+    assert msg.command == 'QUIT'
+    assert msg.params == ['bye']
+    assert msg.tags == {'batch': 'abc', 'flag': '', 'text': 'a b;c'}
+    assert msg.get_tag('batch') == 'abc'
+    assert msg.get_tag('missing') is None
+    assert IRCMessage.parse(':nick!user@host QUIT :bye').get_tag('batch') is None
+
+
 @pytest.mark.asyncio
 async def test_wait_for_success(irc_client_helper):
     messages = [
@@ -0,0 +1,184 @@
+import datetime
+
+from bson import ObjectId
+import pymongo
+from pymongo.errors import DuplicateKeyError
+import pytest
+
+from csbot.localdb import LocalClient, encode, decode
+
+
+@pytest.fixture
+def client(tmp_path):
+    client = LocalClient(str(tmp_path / 'test.sqlite3'))
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def coll(client):
+    return client.get_database()['test']
+
+
+@pytest.mark.parametrize('value', [
+    None, True, 1, 1.5, 'foo', '\x1efoo', [1, 'a'], {'a': {'b': [None]}},
+    datetime.datetime(2020, 1, 2, 3, 4, 5, 6), ObjectId(),
+])
+def test_encode_decode(value):
+    assert decode(encode(value)) == value
+
+
+def test_encode_aware_datetime():
+    value = datetime.datetime(2020, 1, 1, 12, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    assert decode(encode(value)) == datetime.datetime(2020, 1, 1, 10)
+
+
+def test_encode_unsupported():
+    with pytest.raises(TypeError):
+        encode(b'bytes')
+
+
+def test_insert_find(coll):
+    doc = {'nick': 'foo', 'when': datetime.datetime(2020, 1, 1)}
+    id = coll.insert_one(doc).inserted_id
+    assert isinstance(id, ObjectId) and doc['_id'] == id
+    assert coll.find_one({'nick': 'foo'}) == doc
+    assert coll.find_one(id) == doc
+    assert coll.find_one({'nick': 'bar'}) is None
+    with pytest.raises(DuplicateKeyError):
+        coll.insert_one(doc)
+
+
+@pytest.mark.parametrize('filter, expected', [
+    ({}, [1, 2, 3, 4]),
+    ({'n': 2}, [2]),
+    ({'n': {'$gt': 1, '$lte': 3}}, [2, 3]),
+    ({'n': {'$ne': 2}}, [1, 3, 4]),
+    ({'n': {'$in': [1, 4]}}, [1, 4]),
+    ({'n': {'$nin': [1, 4]}}, [2, 3]),
+    ({'tag': None}, [3, 4]),
+    ({'tag': {'$exists': False}}, [4]),
+    ({'tag': {'$ne': None}}, [1, 2]),
+    ({'tag': {'$ne': 'a'}}, [2, 3, 4]),
+    ({'$or': [{'n': 1}, {'tag': 'b'}]}, [1, 2]),
+    ({'$and': [{'n': {'$gt': 1}}, {'n': {'$lt': 3}}]}, [2]),
+    ({'sub.x': 'y'}, [1]),
+    ({'list': [1, 2]}, [2]),
+    ({'when': {'$lt': datetime.datetime(2020, 1, 3)}}, [1, 2]),
+    # Only values of the same type are compared
+    ({'tag': {'$gte': 'a'}}, [1, 2]),
+    ({'tag': {'$lt': 5}}, []),
+    ({'n': {'$lt': 'z'}}, []),
+    ({'when': {'$gt': '2020'}}, []),
+    ({'when': {'$gt': ObjectId('0' * 24)}}, []),
+])
+def test_filters(coll, filter, expected):
+    coll.insert_many([
+        {'n': 1, 'tag': 'a', 'sub': {'x': 'y'}, 'when': datetime.datetime(2020, 1, 1)},
+        {'n': 2, 'tag': 'b', 'list': [1, 2], 'when': datetime.datetime(2020, 1, 2)},
+        {'n': 3, 'tag': None, 'when': datetime.datetime(2020, 1, 3)},
+        {'n': 4},
+    ])
+    assert [d['n'] for d in coll.find(filter, sort=[('n', pymongo.ASCENDING)])] == expected
+    assert coll.count_documents(filter) == len(expected)
+
+
+def test_unsupported_filter(coll):
+    with pytest.raises(NotImplementedError):
+        coll.find({'n': {'$regex': 'a'}})
+    with pytest.raises(NotImplementedError):
+        coll.find({'n': {'$lt': [1]}})
+
+
+def test_sort_limit(coll):
+    coll.insert_many([{'n': n} for n in [3, 1, 4, 1, 5, 9, 2, 6]])
+    assert [d['n'] for d in coll.find(sort=[('n', pymongo.DESCENDING)], limit=3)] == [9, 6, 5]
+    assert [d['n'] for d in coll.find(sort=[('n', pymongo.ASCENDING)], skip=1, limit=2)] == [1, 2]
+    assert coll.find_one({'n': {'$lt': 5}}, sort=[('n', pymongo.DESCENDING)])['n'] == 4
+
+
+def test_replace_delete(coll):
+    result = coll.replace_one({'nick': 'foo'}, {'nick': 'foo', 'n': 1}, upsert=True)
+    assert result.upserted_id is not None
+    result = coll.replace_one({'nick': 'foo'}, {'nick': 'foo', 'n': 2}, upsert=True)
+    assert result.matched_count == 1 and result.upserted_id is None
+    assert coll.count_documents({}) == 1
+    assert coll.replace_one({'nick': 'bar'}, {'nick': 'bar'}).matched_count == 0
+    coll.insert_many([{'nick': 'bar'}, {'nick': 'bar'}])
+    assert coll.delete_one({'nick': 'bar'}).deleted_count == 1
+    assert coll.delete_many({}).deleted_count == 2
+
+
+def test_legacy_methods(coll):
+    id = coll.insert({'n': 1})
+    assert coll.insert([{'n': 2}, {'n': 3}])[0] != id
+    doc = coll.find_one(id)
+    doc['n'] = 10
+    assert coll.save(doc) == id
+    assert coll.find_one(id)['n'] == 10
+    assert coll.remove({'n': {'$gte': 3}})['n'] == 2
+    assert coll.count_documents({}) == 1
+
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / 'test.sqlite3')
+    client = LocalClient(path)
+    coll = client.get_database()['test']
+    coll.create_index([('nick', pymongo.ASCENDING)])
+    coll.insert_one({'nick': 'foo'})
+    client.close()
+
+    client = LocalClient(path)
+    coll = client.get_database()['test']
+    assert coll.find_one({'nick': 'foo'})['nick'] == 'foo'
+    assert 'nick_1' in coll.index_information()
+    client.close()
+
+
+def test_indexes(coll):
+    names = coll.create_indexes([
+        pymongo.IndexModel([('owner', pymongo.ASCENDING), ('when', pymongo.DESCENDING)]),
+        pymongo.IndexModel('expires', expireAfterSeconds=0),
+        pymongo.IndexModel('key', unique=True),
+    ])
+    assert names == ['owner_1_when_-1', 'expires_1', 'key_1']
+    info = coll.index_information()
+    assert info['owner_1_when_-1']['key'] == [('owner', 1), ('when', -1)]
+    assert info['expires_1']['expireAfterSeconds'] == 0
+    assert 'owner_1_when_-1' in coll.explain({'owner': 'a'}, sort=[('when', pymongo.DESCENDING)])
+    assert 'expires_1' not in coll.explain({'nick': 'a'})
+
+    coll.insert_one({'key': 1})
+    with pytest.raises(DuplicateKeyError):
+        coll.insert_one({'key': 1})
+    coll.insert_one({'key': 2})
+    with pytest.raises(DuplicateKeyError):
+        coll.replace_one({'key': 2}, {'key': 1})
+    assert coll.count_documents({'key': 2}) == 1
+
+
+def test_ttl_index(coll):
+    coll.create_index('expires', expireAfterSeconds=0)
+    coll.insert_many([
+        {'n': 1, 'expires': datetime.datetime.utcnow() - datetime.timedelta(minutes=1)},
+        {'n': 2, 'expires': datetime.datetime.utcnow() + datetime.timedelta(minutes=1)},
+        {'n': 3},
+    ])
+    assert [d['n'] for d in coll.find()] == [2, 3]
+
+
+def test_bulk_write(coll):
+    coll.insert_one({'n': 1})
+    result = coll.bulk_write([
+        pymongo.ReplaceOne({'n': 1}, {'n': 10}, upsert=True),
+        pymongo.ReplaceOne({'n': 2}, {'n': 20}, upsert=True),
+        pymongo.InsertOne({'n': 30}),
+        pymongo.DeleteOne({'n': 30}),
+    ], ordered=False)
+    assert (result.matched_count, result.upserted_count, result.inserted_count, result.deleted_count) == (1, 1, 1, 1)
+    assert [d['n'] for d in coll.find(sort=[('n', pymongo.ASCENDING)])] == [10, 20]
+
+    # Nothing is applied if any operation fails
+    with pytest.raises(DuplicateKeyError):
+        coll.bulk_write([pymongo.DeleteMany({}), pymongo.InsertOne({'_id': 1}), pymongo.InsertOne({'_id': 1})])
+    assert coll.count_documents({}) == 2
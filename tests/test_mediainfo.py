@@ -0,0 +1,60 @@
+import struct
+
+import pytest
+
+from csbot.mediainfo import MediaInfo, parse_header, parse_isobmff, format_duration, format_size
+
+
+def box(type, *contents):
+    data = b''.join(contents)
+    return struct.pack('>I4s', 8 + len(data), type) + data
+
+
+def mvhd(timescale, duration):
+    return box(b'mvhd', b'\x00\x00\x00\x00', b'\x00' * 8, struct.pack('>II', timescale, duration), b'\x00' * 80)
+
+
+def tkhd(width, height):
+    return box(b'tkhd', b'\x00' * 76, struct.pack('>II', width << 16, height << 16))
+
+
+FTYP = box(b'ftyp', b'isom', b'\x00\x00\x02\x00')
+MOOV = box(b'moov', mvhd(1000, 205500), box(b'trak', tkhd(0, 0)), box(b'trak', tkhd(1280, 720)))
+
+
+@pytest.mark.parametrize('data, expected', [
+    (b'\x89PNG\r\n\x1a\n\x00\x00\x00\x0dIHDR\x00\x00\x03\x20\x00\x00\x02\x58', MediaInfo('PNG', 'image', 800, 600)),
+    (b'GIF89a\x20\x03\x58\x02', MediaInfo('GIF', 'image', 800, 600)),
+    # SOI, APP0 segment, padding, SOF2
+    (b'\xff\xd8' + b'\xff\xe0\x00\x04ab' + b'\xff\xff\xc2\x00\x11\x08\x02\x58\x03\x20',
+     MediaInfo('JPEG', 'image', 800, 600)),
+    # Frame header not in the data
+    (b'\xff\xd8' + b'\xff\xe1\xff\xff', MediaInfo('JPEG', 'image')),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8 ' + b'\x00' * 10 + b'\x20\x03\x58\x02', MediaInfo('WebP', 'image', 800, 600)),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8L\x00\x00\x00\x00\x2f' + (799 | 599 << 14).to_bytes(4, 'little'),
+     MediaInfo('WebP', 'image', 800, 600)),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8X' + b'\x00' * 8 + b'\x1f\x03\x00\x57\x02\x00', MediaInfo('WebP', 'image', 800, 600)),
+    (FTYP + MOOV + box(b'mdat', b'x' * 100), MediaInfo('MP4', 'video', 1280, 720, 205.5)),
+    (b'hello world', None),
+])
+def test_parse_header(data, expected):
+    assert parse_header(data) == expected
+
+
+def test_parse_mp4_moov_at_end():
+    mdat = box(b'mdat', b'x' * 100)
+    data = FTYP + mdat + MOOV
+    # Only the start of the file was read
+    info = parse_header(data[:len(FTYP) + 20])
+    assert info == MediaInfo('MP4', 'video', more_at=len(FTYP) + len(mdat))
+    info = parse_isobmff(data[info.more_at:], info.more_at, info)
+    assert info == MediaInfo('MP4', 'video', 1280, 720, 205.5)
+    assert info.describe(47400000) == 'MP4 video (3:26, 1280x720, 45.2 MiB)'
+
+
+def test_format():
+    assert format_duration(59.4) == '0:59'
+    assert format_duration(3 * 3600 + 61) == '3:01:01'
+    assert format_size(1000) == '1000 bytes'
+    assert format_size(1536) == '1.5 KiB'
+    assert format_size(3 * 1024 ** 4) == '3072.0 GiB'
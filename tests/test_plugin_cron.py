@@ -0,0 +1,182 @@
+import asyncio
+import datetime
+
+import pytest
+
+from csbot.plugin import Plugin
+from csbot.plugins.cron import Cron, DuplicateTaskError, Misfire
+from csbot.plugins.mongodb import MongoDB
+
+
+class Tester(Plugin):
+    cron = Plugin.use('cron')
+
+    def setup(self):
+        super().setup()
+        self.calls = []
+
+    def callback(self, when, *args, **kwargs):
+        self.calls.append((when, args, kwargs))
+
+    async def async_callback(self, when, *args, **kwargs):
+        self.calls.append((when, args, kwargs))
+
+
+pytestmark = pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["mongodb", "cron", "tester"]
+
+    [mongodb]
+    mode = "mock"
+    """, plugins=[MongoDB, Cron, Tester])
+
+
+@pytest.fixture
+async def cron(bot_helper):
+    cron = bot_helper['cron']
+    yield cron
+    await cron.teardown()
+
+
+def ago(**kwargs):
+    return datetime.datetime.now() - datetime.timedelta(**kwargs)
+
+
+async def settle(cron):
+    """Wait for the event runner to run the tasks that are due."""
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        idle = cron.runner is None and not cron.running
+        if idle and (cron.scheduler_next is None or cron.scheduler_next > datetime.datetime.now()):
+            return
+
+
+@pytest.mark.asyncio
+async def test_run_due_tasks(bot_helper, cron):
+    tester = bot_helper['tester']
+    past, repeat, future = ago(minutes=1), ago(minutes=30), ago(minutes=-1)
+    await tester.cron.at(past, 'once', 'callback', 1, x=2)
+    await tester.cron.schedule('repeat', repeat, interval=datetime.timedelta(hours=1), callback='async_callback')
+    await tester.cron.at(future, 'later', 'callback')
+
+    await settle(cron)
+    assert sorted(tester.calls) == [(repeat, (), {}), (past, (1,), {'x': 2})]
+    assert set(cron.scheduled['tester']) == {('repeat', (), ()), ('later', (), ())}
+    # Changes are saved
+    assert await cron.tasks.count_documents({'owner': 'tester', 'name': 'once'}) == 0
+    saved = await cron.tasks.find_one({'owner': 'tester', 'name': 'repeat'})
+    # (MongoDB stores times to the millisecond)
+    assert abs(saved['when'] - (repeat + datetime.timedelta(hours=1))) < datetime.timedelta(milliseconds=1)
+    # The runner is scheduled for the next task (which might be cron.hourly)
+    assert cron.scheduler_next == cron._next_task()['when'] <= future
+
+
+@pytest.mark.asyncio
+async def test_duplicate_and_unschedule(bot_helper, cron):
+    tester = bot_helper['tester']
+    await tester.cron.after(datetime.timedelta(minutes=1), 'task', 'callback', 'a')
+    await tester.cron.after(datetime.timedelta(minutes=2), 'task', 'callback', 'b')
+    with pytest.raises(DuplicateTaskError):
+        await tester.cron.after(datetime.timedelta(minutes=3), 'task', 'callback', 'a')
+
+    await tester.cron.unschedule('task', args=['a'])
+    assert set(cron.scheduled['tester']) == {('task', ('b',), ())}
+    assert [t['args'] for t in await cron.tasks.find({'owner': 'tester'})] == [['b']]
+    await tester.cron.unschedule_all()
+    assert 'tester' not in cron.scheduled
+    assert await cron.tasks.count_documents({'owner': 'tester'}) == 0
+    assert cron._next_task()['owner'] == 'cron'
+
+
+@pytest.mark.asyncio
+async def test_due_while_saving(bot_helper, cron, monkeypatch):
+    tester = bot_helper['tester']
+    await tester.cron.at(ago(minutes=1), 'first', 'callback')
+    insert_one = cron.tasks.insert_one
+
+    async def slow_insert_one(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        return await insert_one(*args, **kwargs)
+
+    # The event runner starts while the second task is still being saved
+    monkeypatch.setattr(cron.tasks, 'insert_one', slow_insert_one)
+    await tester.cron.at(ago(minutes=1), 'second', 'callback')
+    await settle(cron)
+    assert len(tester.calls) == 2
+    # The task isn't deleted before it has been saved, leaving it behind
+    assert await cron.tasks.count_documents({'owner': 'tester'}) == 0
+
+
+@pytest.mark.asyncio
+async def test_load_tasks(bot_helper, cron):
+    await cron.tasks.insert_one({'owner': 'tester', 'name': 'saved', 'when': ago(minutes=1), 'interval': None,
+                                 'callback': 'callback', 'args': [], 'kwargs': {}})
+    await cron.tasks.insert_one({'owner': 'missing', 'name': 'saved', 'when': ago(minutes=1), 'interval': 60,
+                                 'callback': 'callback', 'args': [], 'kwargs': {}})
+    await cron.teardown()
+    await cron.setup()
+
+    await settle(cron)
+    assert len(bot_helper['tester'].calls) == 1
+    assert 'tester' not in cron.scheduled
+    # Tasks for plugins that don't exist are dropped
+    assert 'missing' not in cron.scheduled
+    assert await cron.tasks.count_documents({'owner': {'$in': ['tester', 'missing']}}) == 0
+
+
+@pytest.mark.parametrize('misfire, catch_up_limit, expected', [
+    (Misfire.RUN_ONCE, 2, [3]),
+    (Misfire.SKIP, 2, []),
+    (Misfire.CATCH_UP, 2, [2, 3]),
+    (Misfire.CATCH_UP, 0, []),
+    (Misfire.CATCH_UP, None, [0, 1, 2, 3]),
+])
+@pytest.mark.asyncio
+async def test_misfire(bot_helper, cron, misfire, catch_up_limit, expected):
+    tester = bot_helper['tester']
+    # Due 3.5 hours ago, so 4 occurrences have been missed
+    first = ago(hours=3, minutes=30)
+    await tester.cron.schedule('repeat', first, interval=datetime.timedelta(hours=1), callback='callback',
+                               misfire=misfire, catch_up_limit=catch_up_limit)
+    await settle(cron)
+    assert [when for when, _, _ in tester.calls] == [first + datetime.timedelta(hours=n) for n in expected]
+    # Straight to the next occurrence after now
+    assert cron.scheduled['tester'][('repeat', (), ())]['when'] == first + datetime.timedelta(hours=4)
+
+
+class Slow(Plugin):
+    cron = Plugin.use('cron')
+
+    def setup(self):
+        super().setup()
+        self.started = []
+        self.release = asyncio.Event()
+
+    async def callback(self, when, name):
+        self.started.append(name)
+        await self.release.wait()
+
+
+@pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["mongodb", "cron", "slow"]
+
+    [mongodb]
+    mode = "mock"
+
+    [cron]
+    max_concurrent_tasks = 2
+    """, plugins=[MongoDB, Cron, Slow])
+@pytest.mark.asyncio
+async def test_concurrency_limit(bot_helper, cron):
+    slow = bot_helper['slow']
+    for name in ['a', 'b', 'c']:
+        await slow.cron.at(ago(seconds=1), name, 'callback', name)
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+    # Slow callbacks don't hold up the event runner, but only 2 run at once
+    assert cron.runner is None
+    assert len(slow.started) == 2 and len(cron.running) == 3
+    slow.release.set()
+    await settle(cron)
+    assert sorted(slow.started) == ['a', 'b', 'c']
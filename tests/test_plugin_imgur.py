@@ -1,4 +1,5 @@
 import pytest
+from yarl import URL
 
 from . import read_fixture_file
 
@@ -197,3 +198,22 @@ async def test_invalid_URL(bot_helper, aioresponses):
     """Test that an unrecognised URL never even results in a request."""
     result = await bot_helper['linkinfo'].get_link_info('http://imgur.com/invalid/url')
     assert result.is_error
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_headers(bot_helper, aioresponses):
+    url, api_url, status, content_type, fixture, title = nsfw_test_cases[0]
+    aioresponses.get(api_url, status=status, body=read_fixture_file(fixture), content_type=content_type,
+                     headers={'X-RateLimit-UserLimit': '500', 'X-RateLimit-UserRemaining': '10',
+                              'X-RateLimit-ClientLimit': '12500', 'X-RateLimit-ClientRemaining': '9000'})
+    imgur = bot_helper['imgur']
+    await bot_helper['linkinfo'].get_link_info(url)
+    assert imgur.user_budget.remaining == 10
+    assert imgur.client_budget.remaining == 9000
+
+    # Automatic lookups are refused once only the reserve is left, without a request
+    bot_helper['linkinfo'].result_cache.clear()
+    bot_helper.reset_mock()
+    await bot_helper.client.line_received(':nick!user@host PRIVMSG #channel :' + url)
+    bot_helper.client.send_line.assert_not_called()
+    assert len(aioresponses.requests[('GET', URL(api_url))]) == 1
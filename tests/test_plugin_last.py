@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+
+import pytest
+
+
+pytestmark = pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["mongodb", "last"]
+
+    [mongodb]
+    mode = "mock"
+
+    [last]
+    flush_interval = 5
+    """)
+
+
+async def receive(bot_helper, lines):
+    await asyncio.wait(bot_helper.receive(lines))
+
+
+@pytest.mark.asyncio
+async def test_write_behind(bot_helper):
+    last = bot_helper['last']
+    await receive(bot_helper, [
+        ':Nick!~user@hostname PRIVMSG #channel :hello',
+        ':Nick!~user@hostname PRIVMSG #channel :world',
+        ':Nick!~user@hostname PRIVMSG #channel :\x01ACTION waves\x01',
+        ':Other!~user@hostname PRIVMSG #other :hi',
+    ])
+    # Nothing written yet, but lookups include unwritten records
+    assert await last.db.count_documents({}) == 0
+    assert (await last.last('nick', '#Channel'))['message'] == 'waves'
+    assert (await last.last('Nick', '#channel'))['message'] == 'waves'
+    assert (await last.last_message('Nick'))['message'] == 'world'
+
+    await last.flush()
+    assert last.pending == {}
+    assert await last.db.count_documents({}) == 3
+    assert bot_helper['mongodb'].stats['last__last.bulk_write'].count == 1
+    assert (await last.last_message('Nick'))['message'] == 'world'
+
+    # Newer unwritten records take precedence over written ones
+    await receive(bot_helper, ':Nick!~user@hostname PRIVMSG #channel :again')
+    assert (await last.last('Nick'))['message'] == 'again'
+
+    # Pending records are written on teardown
+    await bot_helper.bot.bot_teardown_async()
+    assert last.db.collection.find_one({'message': 'again'}) is not None
+
+
+@pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["mongodb", "last"]
+
+    [mongodb]
+    mode = "mock"
+    # So that operations happen in order
+    pool_size = 1
+    """)
+@pytest.mark.asyncio
+async def test_flush_periodically(fast_forward, bot_helper):
+    last = bot_helper['last']
+    await receive(bot_helper, ':Nick!~user@hostname PRIVMSG #channel :hello')
+    await fast_forward(6)
+    assert last.pending == {}
+    assert (await last.db.find_one({'nick': 'Nick'}))['message'] == 'hello'
+    last._flusher.cancel()
+
+
+@pytest.mark.asyncio
+async def test_flush_error(bot_helper):
+    last = bot_helper['last']
+    await receive(bot_helper, ':Nick!~user@hostname PRIVMSG #channel :hello')
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError('broken')
+    last.db.bulk_write = broken
+    await last.flush()
+    assert (await last.last('Nick'))['message'] == 'hello'
+    del last.db.bulk_write
+    await last.flush()
+    assert last.pending == {}
+    assert await last.db.count_documents({}) == 1
+    last._flusher.cancel()
+
+
+@pytest.mark.asyncio
+async def test_lookups_from_memory(bot_helper):
+    last = bot_helper['last']
+    when = datetime.datetime(2020, 1, 1)
+    await last.db.insert_many([
+        {'nick': 'Nick', 'channel': '#a', 'type': 'message', 'when': when, 'message': 'old'},
+        {'nick': 'NICK', 'channel': '#a', 'type': 'message', 'when': when.replace(day=2), 'message': 'newer'},
+        {'nick': 'nick', 'channel': '#b', 'type': 'action', 'when': when.replace(day=3), 'message': 'waves'},
+    ])
+    # Index is loaded from the database on setup
+    last._flusher.cancel()
+    await last.setup()
+    reads = bot_helper['mongodb'].stats['last__last.find'].count
+
+    assert (await last.last_message('nick', '#A'))['message'] == 'newer'
+    assert (await last.last('Nick'))['message'] == 'waves'
+    assert await last.last_command('Nick') is None
+    assert await last.last('Other') is None
+    assert bot_helper['mongodb'].stats['last__last.find'].count == reads
+    last._flusher.cancel()
+
+
+@pytest.mark.asyncio
+async def test_seen_commands(bot_helper):
+    last = bot_helper['last']
+    await receive(bot_helper, [
+        ':Nick!~user@hostname PRIVMSG #other :hello',
+        ':Someone!~user@hostname PRIVMSG #channel :!seen nick',
+    ])
+    bot_helper.assert_sent('NOTICE #channel :Nothing recorded for nick')
+    await receive(bot_helper, ':Someone!~user@hostname PRIVMSG #channel :!seen.anywhere nick')
+    when = last.pending[('Nick', '#other', 'message')]['when'].strftime('%Y-%m-%d %H:%M:%S')
+    bot_helper.assert_sent(f'NOTICE #channel :[{when}] #other <Nick> hello')
+    last._flusher.cancel()
@@ -2,13 +2,18 @@
 from lxml.etree import LIBXML_VERSION
 import unittest.mock as mock
 import asyncio
+import re
+from urllib.parse import urlparse
 
 import pytest
 import asynctest.mock
 import aiohttp
 from aioresponses import CallbackResult
 
+from csbot.events import Event
 from csbot.plugin import Plugin, find_plugins
+from csbot.plugins.linkinfo import normalise_url, LinkInfoResult, TitleExtractor, URLSpec, URLIndex
+from csbot.quota import Priority, QuotaExceeded
 
 
 #: Test encoding handling; tests are (url, content-type, body, expected_title)
@@ -172,12 +177,247 @@ async def test_not_found(bot_helper, aioresponses):
     assert result.is_error
 
 
+def test_url_spec():
+    spec = URLSpec(hosts=['Example.com'], suffixes=['.example.org'], path=r'^/(\d+)$')
+    assert spec(urlparse('http://example.com:8080/123')).group(1) == '123'
+    assert spec(urlparse('http://example.org/1'))
+    assert spec(urlparse('http://a.b.example.org/1'))
+    assert not spec(urlparse('http://www.example.com/1'))
+    assert not spec(urlparse('http://notexample.org/1'))
+    assert not spec(urlparse('http://example.com/abc'))
+    assert URLSpec()(urlparse('http://anything/')) is True
+    with pytest.raises(ValueError):
+        URLSpec(path=re.compile('a', re.A))
+
+
+def test_url_index():
+    index = URLIndex()
+    index.add(URLSpec(path=re.compile(r'\.png$', re.I)), 'png')
+    index.add(URLSpec(suffixes=['example.com']), 'example')
+    index.add(lambda url: url.path.startswith('/x'), 'callable')
+    index.add(URLSpec(hosts=['www.example.com'], path='^/x'), 'www')
+    index.add(URLSpec(path='^/x/'), 'x')
+
+    def values(url):
+        return [value for value, match in index.matches(urlparse(url))]
+
+    assert values('http://www.example.com/x/a.PNG') == ['png', 'example', 'callable', 'www', 'x']
+    assert values('http://example.com/y') == ['example']
+    assert values('http://example.net/x') == ['callable']
+    assert values('http://example.net/y.png') == ['png']
+    assert index.any(urlparse('http://example.net/a.png'))
+    assert not index.any(urlparse('http://example.net/y'))
+    index.clear()
+    assert len(index) == 0
+    assert not index.any(urlparse('http://example.com/a.png'))
+
+
+def test_url_index_path_groups():
+    index = URLIndex()
+    index.add(URLSpec(path=r'^/a/(?P<id>\d+)$'), 'a')
+    index.add(URLSpec(path=r'^/b/(?P<id>\d+)$'), 'b')
+    index.add(URLSpec(path=r'^/(c)\1$'), 'cc')
+    index.add(URLSpec(path=r'^/d$'), 'd')
+
+    def matches(url):
+        return [(value, match.groups()) for value, match in index.matches(urlparse(url))]
+
+    assert matches('http://example.com/b/1') == [('b', ('1',))]
+    assert matches('http://example.com/cc') == [('cc', ('c',))]
+    assert matches('http://example.com/d') == [('d', ())]
+    assert matches('http://example.com/e') == []
+
+
+def test_title_extractor_stops_early():
+    extractor = TitleExtractor()
+    assert not extractor.feed(b'<!DOCTYPE html><html><head><meta charset="utf-8"><ti')
+    assert extractor.feed(b'tle>  The\n title </title><style>')
+    assert extractor.feed(b'x' * 1000)
+    extractor.close()
+    assert extractor.title == 'The title'
+
+
+@pytest.mark.asyncio
+async def test_og_title(bot_helper, aioresponses):
+    body = (b'<html><head><meta property="og:title" content="OpenGraph title"></head>'
+            b'<body><svg><title>not this</title></svg></body></html>')
+    aioresponses.get('http://example.com/', status=200, body=body, headers={'Content-Type': 'text/html'})
+    result = await bot_helper['linkinfo'].get_link_info('http://example.com/')
+    assert result.text == 'OpenGraph title'
+
+
+@pytest.mark.parametrize("url, expected", [
+    ('HTTP://Example.COM', 'http://example.com/'),
+    ('https://example.com:443/a?utm_source=x&b=1&fbclid=y#frag', 'https://example.com/a?b=1#frag'),
+    ('http://example.com:8080/', 'http://example.com:8080/'),
+    ('http://[::1]:80/a', 'http://[::1]/a'),
+])
+def test_normalise_url(url, expected):
+    assert normalise_url(urlparse(url)) == expected
+
+
+@pytest.mark.asyncio
+async def test_result_cache(bot_helper, aioresponses):
+    aioresponses.get('http://example.com/?utm_source=a', status=200, content_type='text/html',
+                     body=b'<html><head><title>Example</title></head></html>')
+    first = await bot_helper['linkinfo'].get_link_info('http://example.com/?utm_source=a')
+    first.nsfw = True
+    # Served from the cache, because aioresponses only allows one request
+    second = await bot_helper['linkinfo'].get_link_info('http://EXAMPLE.com')
+    assert (second.text, second.url, second.nsfw) == ('Example', 'http://EXAMPLE.com', False)
+
+
+@pytest.mark.asyncio
+async def test_error_cache(event_loop, bot_helper, aioresponses):
+    linkinfo = bot_helper['linkinfo']
+    aioresponses.get('http://example.com/', status=404)
+    assert (await linkinfo.get_link_info('http://example.com/')).text.startswith('HTTP request failed: 404')
+    assert (await linkinfo.get_link_info('http://example.com/')).text.startswith('HTTP request failed: 404')
+    # Expired, so tries again (and gets a connection error from aioresponses)
+    with mock.patch.object(event_loop, 'time', return_value=event_loop.time() + linkinfo.config.error_cache_ttl):
+        assert (await linkinfo.get_link_info('http://example.com/')).text == 'Connection error'
+
+
+@pytest.mark.asyncio
+async def test_quota_exceeded_not_cached(bot_helper, aioresponses):
+    linkinfo = bot_helper['linkinfo']
+    handler = mock.Mock(side_effect=QuotaExceeded('api', Priority.BACKGROUND))
+    linkinfo.register_handler(URLSpec(hosts=['example.com']), handler)
+    aioresponses.get('http://example.com/', status=200, content_type='text/html',
+                     body=b'<html><head><title>Example</title></head></html>')
+    # Falls through to scraping the title, but tries the handler again next time
+    assert (await linkinfo.get_link_info('http://example.com/')).text == 'Example'
+    assert len(linkinfo.result_cache) == 0
+    handler.side_effect = None
+    handler.return_value = LinkInfoResult('http://example.com/', 'From handler')
+    assert (await linkinfo.get_link_info('http://example.com/')).text == 'From handler'
+
+
+@pytest.mark.asyncio
+async def test_handler_priority(bot_helper):
+    linkinfo = bot_helper['linkinfo']
+    handler = mock.Mock(return_value=LinkInfoResult('http://example.com/', 'From handler'))
+    linkinfo.register_handler(URLSpec(hosts=['example.com']), handler, pass_priority=True)
+    await linkinfo.get_link_info('http://example.com/a', priority=Priority.BACKGROUND)
+    assert handler.call_args[1] == {'priority': Priority.BACKGROUND}
+    await linkinfo.get_link_info('http://example.com/b')
+    assert handler.call_args[1] == {'priority': Priority.INTERACTIVE}
+
+
+@pytest.mark.asyncio
+async def test_excluded_urls(bot_helper):
+    linkinfo = bot_helper['linkinfo']
+    linkinfo.register_exclude(URLSpec(path=r'\.zip$'))
+    result = await linkinfo.get_link_info('http://example.com/file.zip')
+    assert result.text == 'URL excluded'
+    assert 'http://example.com/file.zip' in linkinfo.excluded_urls
+    assert len(linkinfo.result_cache) == 0
+    # Doesn't need the exclusion filters to reject it again
+    linkinfo.excludes.clear()
+    assert (await linkinfo.get_link_info('http://example.com/file.zip')).text == 'URL excluded'
+
+
+@pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["linkinfo"]
+
+    [linkinfo]
+    excluded_filter_size = 0
+    """)
+@pytest.mark.asyncio
+async def test_excluded_urls_not_remembered(bot_helper):
+    linkinfo = bot_helper['linkinfo']
+    linkinfo.register_exclude(URLSpec(path=r'\.zip$'))
+    assert (await linkinfo.get_link_info('http://example.com/file.zip')).text == 'URL excluded'
+    assert 'http://example.com/file.zip' not in linkinfo.excluded_urls
+
+
+PNG_HEADER = b'\x89PNG\r\n\x1a\n\x00\x00\x00\x0dIHDR\x00\x00\x03\x20\x00\x00\x02\x58'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('status, headers, expected', [
+    (206, {'Content-Type': 'image/png', 'Content-Range': 'bytes 0-23/1258291'}, 'PNG image (800x600, 1.2 MiB)'),
+    (200, {'Content-Type': 'image/png', 'Content-Length': '1024'}, 'PNG image (800x600, 1.0 KiB)'),
+])
+async def test_media_info(bot_helper, aioresponses, status, headers, expected):
+    body = PNG_HEADER if status == 206 else PNG_HEADER + b'x' * 1000
+    aioresponses.get('http://example.com/image.png', status=status, body=body, headers=headers)
+    result = await bot_helper['linkinfo'].get_link_info('http://example.com/image.png')
+    assert result.text == expected
+    [[request]] = aioresponses.requests.values()
+    assert request.kwargs['headers'] == {'Range': 'bytes=0-65535'}
+
+
+@pytest.mark.asyncio
+async def test_media_info_content_type(bot_helper, aioresponses):
+    # Not recognised from the file extension or contents
+    aioresponses.get('http://example.com/song', status=200, body=b'ID3\x04' + b'x' * 100,
+                     headers={'Content-Type': 'audio/mpeg; foo=bar', 'Content-Length': '104'})
+    result = await bot_helper['linkinfo'].get_link_info('http://example.com/song')
+    assert result.text == 'audio/mpeg (104 bytes)'
+
+
+@pytest.mark.asyncio
+async def test_media_info_html(bot_helper, aioresponses):
+    aioresponses.get('http://example.com/image.jpg', status=200, repeat=True, headers={'Content-Type': 'text/html'},
+                     body=b'<html><head><title>Image viewer</title></head></html>')
+    result = await bot_helper['linkinfo'].get_link_info('http://example.com/image.jpg')
+    assert result.text == 'Image viewer'
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_shared(event_loop, bot_helper, aioresponses):
+    linkinfo = bot_helper['linkinfo']
+    event = asyncio.Event(loop=event_loop)
+    requests = []
+
+    async def handler(url, **kwargs):
+        requests.append(url)
+        await event.wait()
+        return CallbackResult(status=200, content_type='text/html',
+                              body=b'<html><head><title>foo</title></head></html>')
+    aioresponses.get('http://example.com/', callback=handler, repeat=True)
+
+    a = event_loop.create_task(linkinfo.get_link_info('http://example.com/'))
+    b = event_loop.create_task(linkinfo.get_link_info('http://Example.com'))
+    c = event_loop.create_task(linkinfo.get_link_info('http://example.com/?utm_source=x'))
+    await asyncio.sleep(0.01)
+    assert len(linkinfo.lookups) == 1
+    # Cancelling one caller doesn't affect the others
+    a.cancel()
+    event.set()
+    results = await asyncio.gather(b, c, loop=event_loop)
+    assert [r.text for r in results] == ['foo', 'foo']
+    assert [r.url for r in results] == ['http://Example.com', 'http://example.com/?utm_source=x']
+    assert len(requests) == 1
+    assert linkinfo.lookups == {}
+
+
+@pytest.mark.asyncio
+async def test_lookup_cancelled_with_last_caller(event_loop, bot_helper, aioresponses):
+    linkinfo = bot_helper['linkinfo']
+    event = asyncio.Event(loop=event_loop)
+
+    async def handler(url, **kwargs):
+        await event.wait()
+    aioresponses.get('http://example.com/', callback=handler)
+
+    a = event_loop.create_task(linkinfo.get_link_info('http://example.com/'))
+    await asyncio.sleep(0.01)
+    [lookup] = linkinfo.lookups.values()
+    a.cancel()
+    await asyncio.sleep(0.01)
+    assert lookup.task.cancelled()
+    assert linkinfo.lookups == {}
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("msg, urls", [('http://example.com', ['http://example.com'])])
 async def test_scan_privmsg(event_loop, bot_helper, aioresponses, msg, urls):
     with asynctest.mock.patch.object(bot_helper['linkinfo'], 'get_link_info') as get_link_info:
         await bot_helper.client.line_received(':nick!user@host PRIVMSG #channel :' + msg)
-        get_link_info.assert_has_calls([mock.call(url) for url in urls])
+        get_link_info.assert_has_calls([mock.call(url, priority=Priority.BACKGROUND) for url in urls])
 
 
 @pytest.mark.asyncio
@@ -205,12 +445,102 @@ def test_scan_privmsg_rate_limit(bot_helper, aioresponses):
         with asynctest.mock.patch.object(linkinfo, 'get_link_info', ) as get_link_info:
             yield from bot_helper.client.line_received(
                 ':nick!user@host PRIVMSG #channel :http://example.com/{}'.format(i))
-            get_link_info.assert_called_once_with('http://example.com/{}'.format(i))
+            get_link_info.assert_called_once_with('http://example.com/{}'.format(i), priority=Priority.BACKGROUND)
     with asynctest.mock.patch.object(linkinfo, 'get_link_info') as get_link_info:
         yield from bot_helper.client.line_received(':nick!user@host PRIVMSG #channel :http://example.com/12345')
         assert not get_link_info.called
 
 
+@pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["linkinfo"]
+
+    [linkinfo]
+    scan_limit = 3
+    scan_timeout = 0.5
+    """)
+class TestConcurrentScan:
+    @pytest.fixture
+    def pages(self, event_loop, aioresponses):
+        """Serve ``http://example.com/<name>`` with title *name* when ``pages[name]`` is set."""
+        pages = {}
+        cancelled = []
+
+        def add(name, status=200):
+            pages[name] = asyncio.Event(loop=event_loop)
+
+            async def handler(url, **kwargs):
+                try:
+                    await pages[name].wait()
+                except asyncio.CancelledError:
+                    cancelled.append(name)
+                    raise
+                return CallbackResult(status=status, content_type='text/html',
+                                      body=f'<html><head><title>{name} page</title></head></html>')
+            aioresponses.get(f'http://example.com/{name}', callback=handler)
+        pages['add'] = add
+        pages['cancelled'] = cancelled
+        return pages
+
+    async def _scan(self, event_loop, bot_helper, *urls):
+        bot_helper.reset_mock()
+        event = Event(bot_helper.bot, 'core.message.privmsg', {
+            'message': ' '.join(urls),
+            'reply_to': '#channel',
+        })
+        return event_loop.create_task(bot_helper['linkinfo'].scan_privmsg(event))
+
+    @pytest.mark.asyncio
+    async def test_replies_in_message_order(self, event_loop, bot_helper, pages):
+        bot_helper.client.reply = mock.Mock()
+        pages['add']('a')
+        pages['add']('b')
+        scan = await self._scan(event_loop, bot_helper, 'http://example.com/a', 'http://example.com/b')
+        # The later URL finishing first doesn't get a reply
+        pages['b'].set()
+        await asyncio.sleep(0.01)
+        assert not scan.done()
+        pages['a'].set()
+        await scan
+        bot_helper.client.reply.assert_called_once_with('#channel', 'a page')
+
+    @pytest.mark.asyncio
+    async def test_falls_through_errors(self, event_loop, bot_helper, pages):
+        bot_helper.client.reply = mock.Mock()
+        pages['add']('a', status=404)
+        pages['add']('b')
+        scan = await self._scan(event_loop, bot_helper, 'http://example.com/a', 'http://example.com/b')
+        pages['a'].set()
+        pages['b'].set()
+        await scan
+        bot_helper.client.reply.assert_called_once_with('#channel', 'b page')
+
+    @pytest.mark.asyncio
+    async def test_cancels_unneeded(self, event_loop, bot_helper, pages):
+        bot_helper.client.reply = mock.Mock()
+        pages['add']('a')
+        pages['add']('b')
+        scan = await self._scan(event_loop, bot_helper, 'http://example.com/a', 'http://example.com/b')
+        pages['a'].set()
+        await scan
+        await asyncio.sleep(0.01)
+        bot_helper.client.reply.assert_called_once_with('#channel', 'a page')
+        assert pages['cancelled'] == ['b']
+        assert bot_helper['linkinfo'].lookups == {}
+        # Only the lookup that was used counts towards the rate limit
+        assert len(bot_helper['linkinfo'].rate_limit_list) == 1
+
+    @pytest.mark.asyncio
+    async def test_timeout(self, event_loop, bot_helper, pages):
+        bot_helper.client.reply = mock.Mock()
+        pages['add']('a')
+        scan = await self._scan(event_loop, bot_helper, 'http://example.com/a')
+        await asyncio.wait_for(scan, 1, loop=event_loop)
+        await asyncio.sleep(0.01)
+        bot_helper.client.reply.assert_not_called()
+        assert pages['cancelled'] == ['a']
+
+
 class TestNonBlocking:
     class MockPlugin(Plugin):
         def __init__(self, *args, **kwargs):
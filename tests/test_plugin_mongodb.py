@@ -0,0 +1,101 @@
+import asyncio
+
+import pymongo
+import pytest
+
+from csbot.plugin import Plugin
+from csbot.plugins.mongodb import MongoDB, AsyncCollection
+
+
+class Stuff(Plugin):
+    stuff = Plugin.use('mongodb', collection='stuff')
+
+
+pytestmark = pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["mongodb", "stuff"]
+
+    [mongodb]
+    mode = "mock"
+    """, plugins=[MongoDB, Stuff])
+
+
+@pytest.mark.asyncio
+async def test_async_collection(bot_helper):
+    stuff = bot_helper['stuff'].stuff
+    assert isinstance(stuff, AsyncCollection)
+    await stuff.insert_many([{'a': 1}, {'a': 3}, {'a': 2}])
+    assert (await stuff.find_one({'a': 2}))['a'] == 2
+    assert [d['a'] for d in await stuff.find({'a': {'$gt': 1}}, sort=[('a', pymongo.DESCENDING)])] == [3, 2]
+    await stuff.replace_one({'a': 4}, {'a': 4}, upsert=True)
+    assert await stuff.count_documents({}) == 4
+
+    stats = bot_helper['mongodb'].stats
+    assert stats['stuff__stuff.find'].count == 1
+    assert stats['stuff__stuff.insert_many'].count == 1
+    assert stats['stuff__stuff.find'].max > 0
+
+
+@pytest.mark.asyncio
+async def test_async_collection_error(bot_helper):
+    stuff = bot_helper['stuff'].stuff
+    with pytest.raises(TypeError):
+        await stuff.insert_one('not a document')
+    assert bot_helper['mongodb'].stats['stuff__stuff.insert_one'].errors == 1
+
+
+class Indexed(Plugin):
+    things = Plugin.use('mongodb', collection='things', indexes=[
+        [('owner', pymongo.ASCENDING), ('when', pymongo.DESCENDING)],
+        pymongo.IndexModel('expires', expireAfterSeconds=0),
+    ])
+
+
+@pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["mongodb", "indexed"]
+
+    [mongodb]
+    mode = "mock"
+    """, plugins=[MongoDB, Indexed])
+@pytest.mark.asyncio
+async def test_indexes(bot_helper, caplog):
+    things = bot_helper['indexed'].things
+    await asyncio.gather(*bot_helper['mongodb'].index_tasks)
+    info = things.collection.index_information()
+    assert info['owner_1_when_-1']['key'] == [('owner', 1), ('when', -1)]
+    assert info['expires_1']['expireAfterSeconds'] == 0
+
+    def warnings():
+        return [r.getMessage() for r in caplog.records if r.levelname == 'WARNING']
+
+    await things.find({'owner': 'a', 'when': {'$lt': 5}}, sort=[('when', pymongo.DESCENDING)])
+    await things.find({'$or': [{'_id': 1}, {'expires': None}]})
+    await things.find()
+    await things.delete_many({'owner': 'a'})
+    assert warnings() == []
+    await things.find_one({'name': 'a'})
+    await things.find_one({'name': 'b'})
+    await things.find(sort=[('name', pymongo.ASCENDING)])
+    assert warnings() == [
+        'no index for indexed__things query on name',
+        'no index for indexed__things query on all documents sorted by name',
+    ]
+
+
+@pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["mongodb", "indexed"]
+
+    [mongodb]
+    mode = "local"
+    path = ":memory:"
+    """, plugins=[MongoDB, Indexed])
+@pytest.mark.asyncio
+async def test_local_mode(bot_helper):
+    things = bot_helper['indexed'].things
+    await asyncio.gather(*bot_helper['mongodb'].index_tasks)
+    assert 'owner_1_when_-1' in things.collection.index_information()
+    await things.insert_many([{'owner': 'a', 'when': 1}, {'owner': 'a', 'when': 2}, {'owner': 'b', 'when': 3}])
+    latest = await things.find_one({'owner': 'a'}, sort=[('when', pymongo.DESCENDING)])
+    assert latest['when'] == 2
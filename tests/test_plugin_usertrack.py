@@ -132,3 +132,60 @@ async def test_account_kept_on_nick_changed(bot_helper):
     await bot_helper.client.line_received(':Nick!~user@hostname NICK :Other')
     bot_helper.assert_account('Nick', None)
     bot_helper.assert_account('Other', 'accountname')
+
+
+async def test_netsplit_and_netjoin(bot_helper, fast_forward):
+    await bot_helper.client.line_received(":Nick!~user@hostname JOIN #channel accountname :Other Info")
+    await bot_helper.client.line_received(":Other!~user@hostname JOIN #channel * :Other Info")
+    await bot_helper.client.line_received(":Other!~user@hostname JOIN #other * :Other Info")
+    bot_helper.assert_channels('Nick', {'#channel'})
+    bot_helper.assert_channels('Other', {'#channel', '#other'})
+
+    # Users are removed once the netsplit is over
+    await bot_helper.client.line_received(":Nick!~user@hostname QUIT :*.net *.split")
+    await bot_helper.client.line_received(":Other!~user@hostname QUIT :*.net *.split")
+    await fast_forward(bot_helper.bot.NETSPLIT_QUIET_PERIOD + 1)
+    bot_helper.assert_channels('Nick', set())
+    bot_helper.assert_channels('Other', set())
+
+    # Users are restored once the netjoin is over
+    await bot_helper.client.line_received(":Nick!~user@hostname JOIN #channel accountname :Other Info")
+    await bot_helper.client.line_received(":Other!~user@hostname JOIN #channel * :Other Info")
+    await bot_helper.client.line_received(":Other!~user@hostname JOIN #other * :Other Info")
+    await fast_forward(bot_helper.bot.NETSPLIT_QUIET_PERIOD + 1)
+    bot_helper.assert_channels('Nick', {'#channel'})
+    bot_helper.assert_channels('Other', {'#channel', '#other'})
+    bot_helper.assert_account('Nick', 'accountname')
+
+    # Later joins are ordinary joins, not another netjoin
+    await bot_helper.client.line_received(":Other!~user@hostname PART #other")
+    await bot_helper.client.line_received(":Other!~user@hostname JOIN #other * :Other Info")
+    bot_helper.assert_channels('Other', {'#channel', '#other'})
+    assert bot_helper.bot._split_users == {}
+
+
+async def test_netjoin_nick_case(bot_helper, fast_forward):
+    await bot_helper.client.line_received(":Nick!~user@hostname JOIN #channel * :Other Info")
+    await bot_helper.client.line_received(":Nick!~user@hostname QUIT :*.net *.split")
+    await fast_forward(bot_helper.bot.NETSPLIT_QUIET_PERIOD + 1)
+    await bot_helper.client.line_received(":NICK!~user@hostname JOIN #channel * :Other Info")
+    # Part of a netjoin, so not seen until it's over
+    bot_helper.assert_channels('NICK', set())
+    await fast_forward(bot_helper.bot.NETSPLIT_QUIET_PERIOD + 1)
+    bot_helper.assert_channels('NICK', {'#channel'})
+
+
+async def test_netsplit_batch(bot_helper):
+    await bot_helper.client.line_received(":Nick!~user@hostname JOIN #channel accountname :Other Info")
+    bot_helper.assert_channels('Nick', {'#channel'})
+    await bot_helper.client.line_received(":server BATCH +abc netsplit irc.hub other.host")
+    await bot_helper.client.line_received("@batch=abc :Nick!~user@hostname QUIT :irc.hub other.host")
+    bot_helper.assert_channels('Nick', {'#channel'})
+    await bot_helper.client.line_received(":server BATCH -abc")
+    bot_helper.assert_channels('Nick', set())
+
+    await bot_helper.client.line_received(":server BATCH +def netjoin irc.hub other.host")
+    await bot_helper.client.line_received("@batch=def :Nick!~user@hostname JOIN #channel accountname :Other Info")
+    bot_helper.assert_channels('Nick', set())
+    await bot_helper.client.line_received(":server BATCH -def")
+    bot_helper.assert_channels('Nick', {'#channel'})
@@ -6,7 +6,7 @@ import mongomock
 def failsafe(bot_helper):
     """forces the test to fail if not using a mock
     this prevents the tests from accidentally polluting a real database in the event of failure"""
-    assert isinstance(bot_helper['whois'].whoisdb,
+    assert isinstance(bot_helper['whois'].whoisdb.collection,
                       mongomock.Collection),\
         'Not mocking MongoDB -- may be writing to actual database (!) (aborted test)'
 
@@ -29,69 +29,70 @@ pytestmark = pytest.mark.bot(config="""\
     """)
 
 
+@pytest.mark.asyncio
 class TestWhoisAPI:
     @pytest.fixture
     def whois(self, bot_helper):
         return bot_helper['whois']
 
-    def test_whois_empty(self, whois):
-        assert whois.whois_lookup('this_nick_doesnt_exist', '#anyChannel') is None
-
-    def test_whois_insert(self, whois):
-        whois.whois_set('Nick', channel='#First', whois_str='test data')
-        assert whois.whois_lookup('Nick', '#First') == 'test data'
-
-    def test_whois_unset(self, whois):
-        whois.whois_set('Nick', channel='#First', whois_str='test data')
-        assert whois.whois_lookup('Nick', '#First') == 'test data'
-        whois.whois_unset('Nick', '#First')
-        assert whois.whois_lookup('Nick', '#First') is None
-
-    def test_whois_set_overwrite(self, whois):
-        whois.whois_set('Nick', channel='#First', whois_str='test data')
-        whois.whois_set('Nick', channel='#First', whois_str='overwritten data')
-        assert whois.whois_lookup('Nick', '#First') == 'overwritten data'
-
-    def test_whois_multi_user(self, whois):
-        whois.whois_set('Nick', channel='#First', whois_str='test1')
-        whois.whois_set('OtherNick', channel='#First', whois_str='test2')
-        assert whois.whois_lookup('Nick', '#First') == 'test1'
-        assert whois.whois_lookup('OtherNick', '#First') == 'test2'
-
-    def test_whois_multi_channel(self, whois):
-        whois.whois_set('Nick', channel='#First', whois_str='first data')
-        whois.whois_set('Nick', channel='#Second', whois_str='second data')
-        assert whois.whois_lookup('Nick', '#First') == 'first data'
-        assert whois.whois_lookup('Nick', '#Second') == 'second data'
-
-    def test_whois_channel_specific(self, whois):
-        whois.whois_set('Nick', channel='#First', whois_str='first data')
-        assert whois.whois_lookup('Nick', '#AnyOtherChannel') is None
-
-    def test_whois_setdefault(self, whois):
-        whois.whois_set('Nick', 'test default data')
-        assert whois.whois_lookup('Nick', '#First') == 'test default data'
-        assert whois.whois_lookup('Nick', '#Other') == 'test default data'
-        whois.whois_unset('Nick', '#First')
-        assert whois.whois_lookup('Nick', '#First') == 'test default data'
-
-    def test_whois_channel_before_setdefault(self, whois):
-        whois.whois_set('Nick', 'test default data')
-        whois.whois_set('Nick', channel='#First', whois_str='test first data')
-        assert whois.whois_lookup('Nick', '#First') == 'test first data'
-        assert whois.whois_lookup('Nick', '#Other') == 'test default data'
-        whois.whois_unset('Nick', '#First')
-        assert whois.whois_lookup('Nick', '#First') == 'test default data'
-
-    def test_whois_setdefault_unset(self, whois):
-        whois.whois_set('Nick', 'test default data')
-        assert whois.whois_lookup('Nick', '#First') == 'test default data'
-        assert whois.whois_lookup('Nick', '#Other') == 'test default data'
-        whois.whois_unset('Nick', '#First')
-        assert whois.whois_lookup('Nick', '#First') == 'test default data'
-        whois.whois_unset('Nick')
-        assert whois.whois_lookup('Nick', '#First') is None
-        assert whois.whois_lookup('Nick', '#Second') is None
+    async def test_whois_empty(self, whois):
+        assert await whois.whois_lookup('this_nick_doesnt_exist', '#anyChannel') is None
+
+    async def test_whois_insert(self, whois):
+        await whois.whois_set('Nick', channel='#First', whois_str='test data')
+        assert await whois.whois_lookup('Nick', '#First') == 'test data'
+
+    async def test_whois_unset(self, whois):
+        await whois.whois_set('Nick', channel='#First', whois_str='test data')
+        assert await whois.whois_lookup('Nick', '#First') == 'test data'
+        await whois.whois_unset('Nick', '#First')
+        assert await whois.whois_lookup('Nick', '#First') is None
+
+    async def test_whois_set_overwrite(self, whois):
+        await whois.whois_set('Nick', channel='#First', whois_str='test data')
+        await whois.whois_set('Nick', channel='#First', whois_str='overwritten data')
+        assert await whois.whois_lookup('Nick', '#First') == 'overwritten data'
+
+    async def test_whois_multi_user(self, whois):
+        await whois.whois_set('Nick', channel='#First', whois_str='test1')
+        await whois.whois_set('OtherNick', channel='#First', whois_str='test2')
+        assert await whois.whois_lookup('Nick', '#First') == 'test1'
+        assert await whois.whois_lookup('OtherNick', '#First') == 'test2'
+
+    async def test_whois_multi_channel(self, whois):
+        await whois.whois_set('Nick', channel='#First', whois_str='first data')
+        await whois.whois_set('Nick', channel='#Second', whois_str='second data')
+        assert await whois.whois_lookup('Nick', '#First') == 'first data'
+        assert await whois.whois_lookup('Nick', '#Second') == 'second data'
+
+    async def test_whois_channel_specific(self, whois):
+        await whois.whois_set('Nick', channel='#First', whois_str='first data')
+        assert await whois.whois_lookup('Nick', '#AnyOtherChannel') is None
+
+    async def test_whois_setdefault(self, whois):
+        await whois.whois_set('Nick', 'test default data')
+        assert await whois.whois_lookup('Nick', '#First') == 'test default data'
+        assert await whois.whois_lookup('Nick', '#Other') == 'test default data'
+        await whois.whois_unset('Nick', '#First')
+        assert await whois.whois_lookup('Nick', '#First') == 'test default data'
+
+    async def test_whois_channel_before_setdefault(self, whois):
+        await whois.whois_set('Nick', 'test default data')
+        await whois.whois_set('Nick', channel='#First', whois_str='test first data')
+        assert await whois.whois_lookup('Nick', '#First') == 'test first data'
+        assert await whois.whois_lookup('Nick', '#Other') == 'test default data'
+        await whois.whois_unset('Nick', '#First')
+        assert await whois.whois_lookup('Nick', '#First') == 'test default data'
+
+    async def test_whois_setdefault_unset(self, whois):
+        await whois.whois_set('Nick', 'test default data')
+        assert await whois.whois_lookup('Nick', '#First') == 'test default data'
+        assert await whois.whois_lookup('Nick', '#Other') == 'test default data'
+        await whois.whois_unset('Nick', '#First')
+        assert await whois.whois_lookup('Nick', '#First') == 'test default data'
+        await whois.whois_unset('Nick')
+        assert await whois.whois_lookup('Nick', '#First') is None
+        assert await whois.whois_lookup('Nick', '#Second') is None
 
 
 @pytest.mark.usefixtures("run_client")
@@ -0,0 +1,64 @@
+import time
+from unittest import mock
+
+import pytest
+
+from csbot.quota import QuotaManager, QuotaExceeded, Priority
+
+
+@pytest.fixture
+def quota(event_loop):
+    return QuotaManager(loop=event_loop)
+
+
+@pytest.mark.asyncio
+async def test_reserve(quota):
+    budget = quota.budget('api', limit=10, reserve=0.5)
+    for _ in range(5):
+        await quota.acquire('api', priority=Priority.BACKGROUND)
+    with pytest.raises(QuotaExceeded, match='reserved for commands'):
+        await quota.acquire('api', priority=Priority.BACKGROUND)
+    await quota.acquire('api', cost=5, priority=Priority.INTERACTIVE)
+    with pytest.raises(QuotaExceeded, match='exhausted'):
+        await quota.acquire('api', priority=Priority.INTERACTIVE)
+    assert budget.remaining == 0
+
+
+@pytest.mark.asyncio
+async def test_acquire_all_or_nothing(quota):
+    a = quota.budget('a', limit=10)
+    b = quota.budget('b', limit=10)
+    b.exhaust()
+    with pytest.raises(QuotaExceeded):
+        await quota.acquire('a', 'b')
+    assert a.remaining == 10
+
+
+@pytest.mark.asyncio
+async def test_period_reset(quota):
+    budget = quota.budget('api', limit=1, period=60)
+    await quota.acquire('api')
+    with pytest.raises(QuotaExceeded):
+        await quota.acquire('api')
+    with mock.patch('time.time', return_value=budget.reset_at):
+        await quota.acquire('api')
+
+
+@pytest.mark.asyncio
+async def test_wait_for_reset(quota):
+    budget = quota.budget('api', limit=1)
+    budget.exhaust(reset=time.time() + 0.01)
+    await quota.acquire('api', wait=1)
+    assert budget.used == 1
+
+
+def test_observe_headers(quota):
+    budget = quota.budget('api', limit=100)
+    budget.observe_headers({'X-RateLimit-Remaining': '7', 'X-RateLimit-Limit': '50',
+                            'X-RateLimit-Reset': str(int(time.time()) + 30)})
+    assert (budget.limit, budget.remaining) == (50, 7)
+    budget.observe_headers({'X-RateLimit-Remaining': 'junk'})
+    assert budget.remaining == 7
+    # Re-registering keeps the accounting
+    assert quota.budget('api', limit=50) is budget
+    assert budget.remaining == 7
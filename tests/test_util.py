@@ -69,6 +69,28 @@ def test_truncate_utf8():
     assert util.truncate_utf8(b"\xE2\x98\xBA\xE2\x98\xBA\xE2\x98\xBA", 8) == b"\xE2\x98\xBA..."
 
 
+def test_irc_lower():
+    assert util.irc_lower("Nick[m]\\~") == "nick{m}|^"
+    assert util.irc_lower("#CS-York") == "#cs-york"
+
+
+def test_bloom_filter():
+    f = util.BloomFilter(100, error_rate=0.01)
+    for i in range(100):
+        f.add(str(i))
+    assert all(str(i) in f for i in range(100))
+    assert sum(str(i) in f for i in range(100, 1100)) < 50
+    # Going over capacity starts again
+    for i in range(100, 150):
+        f.add(str(i))
+    assert len(f) <= 50
+    assert '149' in f
+    # Disabled
+    f = util.BloomFilter(0)
+    f.add('a')
+    assert 'a' not in f and len(f) == 0
+
+
 # @pytest.mark.skip
 class TestRateLimited:
     @pytest.mark.asyncio
@@ -0,0 +1,167 @@
+import asyncio
+import os
+
+import pytest
+
+from csbot.plugin import Plugin
+from csbot.plugins.mongodb import MongoDB
+from csbot.worker import WorkerPlugin
+
+
+class Counters:
+    def __init__(self):
+        self.counts = {}
+
+    def increment(self, key):
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return self.counts[key]
+
+
+class Counter(Plugin):
+    def setup(self):
+        super().setup()
+        self.counters = Counters()
+
+    def provide(self, plugin_name, **kwargs):
+        return self.counters
+
+
+class Worked(Plugin):
+    counters = Plugin.use('counter')
+
+    @Plugin.command('pid')
+    def pid(self, e):
+        e.reply(str(os.getpid()))
+
+    @Plugin.command('count')
+    def count(self, e):
+        e.reply(f'{e["data"]}: {self.counters.increment(e["data"])}')
+
+    @Plugin.command('nick')
+    async def nick(self, e):
+        await asyncio.sleep(0)
+        e.reply(self.bot.nick)
+
+    @Plugin.hook('core.message.privmsg')
+    def privmsg(self, e):
+        if e['message'] == 'ping':
+            self.bot.emit_new('worked.pinged', {'user': e['user']})
+
+    @Plugin.command('fail')
+    def fail(self, e):
+        raise ValueError('failed')
+
+
+class Pinged(Plugin):
+    pinged = []
+
+    @Plugin.hook('worked.pinged')
+    def record(self, e):
+        self.pinged.append(e['user'])
+
+
+class Stored(Plugin):
+    db = Plugin.use('mongodb', collection='stored')
+
+    @Plugin.command('store')
+    async def store(self, e):
+        await self.db.insert_one({'data': e['data']})
+        doc = await self.db.find_one({'data': e['data']})
+        e.reply(f'stored {doc["data"]} in {os.getpid()}')
+
+
+pytestmark = pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["counter", "worked", "pinged"]
+    worker_plugins = ["worked"]
+    """, plugins=[Counter, Worked, Pinged])
+
+
+@pytest.fixture
+async def worker_bot_helper(bot_helper):
+    yield bot_helper
+    await bot_helper.bot.bot_teardown_async()
+
+
+@pytest.mark.asyncio
+async def test_plugin_replaced(worker_bot_helper):
+    worked = worker_bot_helper['worked']
+    assert isinstance(worked, WorkerPlugin)
+    assert worked.plugin_name() == 'worked'
+    assert not isinstance(worker_bot_helper['counter'], WorkerPlugin)
+    assert {'pid', 'count', 'nick'} <= set(worker_bot_helper.bot.commands)
+
+
+@pytest.mark.asyncio
+async def test_command(worker_bot_helper):
+    await asyncio.wait(worker_bot_helper.receive(':Nick!~user@hostname PRIVMSG #channel :!pid'))
+    pid = worker_bot_helper['worked']._process.pid
+    assert pid != os.getpid()
+    worker_bot_helper.assert_sent(f'NOTICE #channel :{pid}')
+
+
+@pytest.mark.asyncio
+async def test_async_command_bot_attribute(worker_bot_helper):
+    await asyncio.wait(worker_bot_helper.receive(':Nick!~user@hostname PRIVMSG #channel :!nick'))
+    worker_bot_helper.assert_sent(f'NOTICE #channel :{worker_bot_helper.bot.nick}')
+
+
+@pytest.mark.asyncio
+async def test_provided_by_plugin(worker_bot_helper):
+    await asyncio.wait(worker_bot_helper.receive([
+        ':Nick!~user@hostname PRIVMSG #channel :!count a',
+        ':Nick!~user@hostname PRIVMSG #channel :!count a',
+        ':Nick!~user@hostname PRIVMSG #channel :!count b',
+    ]))
+    worker_bot_helper.assert_sent([
+        'NOTICE #channel :a: 1',
+        'NOTICE #channel :a: 2',
+        'NOTICE #channel :b: 1',
+    ])
+    # State lives in the bot process
+    assert worker_bot_helper['counter'].counters.counts == {'a': 2, 'b': 1}
+
+
+@pytest.mark.bot(config="""\
+    ["@bot"]
+    plugins = ["mongodb", "stored"]
+    worker_plugins = ["stored"]
+
+    [mongodb]
+    mode = "mock"
+    """, plugins=[MongoDB, Stored])
+@pytest.mark.asyncio
+async def test_coroutine_method(worker_bot_helper):
+    await asyncio.wait(worker_bot_helper.receive(':Nick!~user@hostname PRIVMSG #channel :!store foo'))
+    pid = worker_bot_helper['stored']._process.pid
+    worker_bot_helper.assert_sent(f'NOTICE #channel :stored foo in {pid}')
+    assert worker_bot_helper['mongodb'].stats['stored__stored.insert_one'].count == 1
+
+
+@pytest.mark.asyncio
+async def test_hook_and_event(worker_bot_helper):
+    Pinged.pinged.clear()
+    await asyncio.wait(worker_bot_helper.receive(':Nick!~user@hostname PRIVMSG #channel :ping'))
+    # Event posted from the worker process arrives asynchronously
+    for _ in range(100):
+        if Pinged.pinged:
+            break
+        await asyncio.sleep(0.01)
+    assert Pinged.pinged == ['Nick!~user@hostname']
+
+
+@pytest.mark.asyncio
+async def test_error(worker_bot_helper, event_loop):
+    errors = []
+    event_loop.set_exception_handler(lambda loop, ctx: errors.append(ctx))
+    await asyncio.wait(worker_bot_helper.receive(':Nick!~user@hostname PRIVMSG #channel :!fail'))
+    assert len(errors) == 1
+    assert isinstance(errors[0]['exception'], ValueError)
+
+
+@pytest.mark.asyncio
+async def test_teardown(worker_bot_helper):
+    process = worker_bot_helper['worked']._process
+    await worker_bot_helper.bot.bot_teardown_async()
+    assert process.returncode is not None
+    assert 'pid' not in worker_bot_helper.bot.commands